@@ -0,0 +1,51 @@
+"""Resolve the signed-in user of a request from its better-auth session cookie.
+
+The frontend owns authentication. Requests reach the backend through its proxy
+with the browser's cookies, or from its server actions with the cookies
+forwarded, so the session token is looked up in the session table that
+better-auth maintains. User ids sent in request bodies are never trusted.
+"""
+from datetime import datetime, timezone
+from typing import Optional
+from urllib.parse import unquote
+
+from fastapi import Request
+from sqlalchemy import select
+
+from database import AsyncSessionLocal, session
+from ttl_cache import TTLCache
+
+# Secure-prefixed over https, plain on localhost
+SESSION_COOKIES = ("__Secure-better-auth.session_token", "better-auth.session_token")
+
+
+def session_token(http_request: Request) -> Optional[str]:
+    for name in SESSION_COOKIES:
+        value = http_request.cookies.get(name)
+        if value:
+            # The cookie is "<token>.<signature>", the token alone identifies the session
+            return unquote(value).split(".", 1)[0] or None
+    return None
+
+
+class SessionResolver:
+    """Session token -> user id, cached briefly so a burst of requests costs one query."""
+
+    def __init__(self, ttl: float = 60.0, max_size: int = 10000):
+        # Unknown or expired tokens are cached as "" so they aren't looked up on every request
+        self.cache = TTLCache(max_size=max_size, ttl=ttl)
+
+    async def user_id(self, http_request: Request) -> Optional[str]:
+        token = session_token(http_request)
+        if token is None:
+            return None
+        user_id = self.cache.get(token)
+        if user_id is None:
+            # better-auth stores naive UTC timestamps
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            async with AsyncSessionLocal() as db:
+                user_id = (await db.execute(
+                    select(session.c.user_id).where(session.c.token == token, session.c.expires_at > now)
+                )).scalar() or ""
+            self.cache.set(token, user_id)
+        return user_id or None
@@ -0,0 +1,72 @@
+import hashlib
+import zlib
+from typing import Iterable
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database import battle_texts
+
+try:
+    import zstandard
+except ImportError:  # zlib is always there, zstd is smaller and faster when installed
+    zstandard = None
+
+ZSTD_LEVEL = 6
+
+# Battle columns whose text is stored in battle_texts, with the id column replacing each
+TEXT_COLUMNS = {
+    "question": "question_text_id",
+    "response1": "response1_text_id",
+    "response2": "response2_text_id",
+}
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def compress(text: str) -> tuple[str, bytes]:
+    raw = text.encode("utf-8")
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    return "zlib", zlib.compress(raw, 6)
+
+
+def decompress(codec: str, data: bytes) -> str:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd-compressed battle text")
+        return zstandard.ZstdDecompressor().decompress(data).decode("utf-8")
+    return zlib.decompress(data).decode("utf-8")
+
+
+def text_rows(texts: Iterable[str]) -> dict[str, dict]:
+    # One row per distinct text, keyed by hash, so a batch deduplicates within itself too
+    rows = {}
+    for text in texts:
+        digest = hash_text(text)
+        if digest not in rows:
+            codec, data = compress(text)
+            rows[digest] = {"hash": digest, "codec": codec, "size": len(text.encode("utf-8")), "data": data}
+    return rows
+
+
+def insert_texts(dialect_name: str):
+    # Texts another writer already stored are skipped, their ids are read back afterwards
+    insert = pg_insert if dialect_name == "postgresql" else sqlite_insert
+    return insert(battle_texts).on_conflict_do_nothing(index_elements=["hash"])
+
+
+def select_text_ids(hashes: Iterable[str]):
+    return select(battle_texts.c.hash, battle_texts.c.id).where(battle_texts.c.hash.in_(list(hashes)))
+
+
+def with_text_ids(row: dict, ids: dict[str, int]) -> dict:
+    # Battle row with its text columns swapped for battle_texts ids
+    row = dict(row)
+    for column, id_column in TEXT_COLUMNS.items():
+        text = row.pop(column, None)
+        row[id_column] = ids[hash_text(text)] if text is not None else None
+    return row
@@ -0,0 +1,285 @@
+import asyncio
+import glob
+import json
+import os
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.sql import text
+
+from battle_texts import TEXT_COLUMNS, insert_texts, select_text_ids, text_rows, with_text_ids
+from database import AsyncSessionLocal, async_engine, battles
+from model_registry import ModelRegistry
+
+# Hands out ids from the battles sequence without inserting anything
+RESERVE_IDS_SQL = text("SELECT nextval(pg_get_serial_sequence('battles', 'id')) FROM generate_series(1, :n)")
+
+
+def insert_battles(dialect_name: str):
+    return (pg_insert if dialect_name == "postgresql" else sqlite_insert)(battles)
+
+
+class BattleWriter:
+    """Write-behind persistence for finished battles.
+
+    With write-behind on, submit() reserves the battle id from an in-memory block of
+    sequence values and queues the row, so the caller gets its id without waiting on
+    the insert. A background task drains the queue into multi-row inserts. Rows that
+    still cannot be written after a few attempts are appended to a spill file, which
+    is replayed every replay_interval seconds and on the next start. When the queue
+    is full, or write-behind is off, rows are inserted inline as before.
+    """
+
+    def __init__(
+        self,
+        registry: ModelRegistry,
+        write_behind: bool = True,
+        queue_size: int = 1000,
+        batch_size: int = 100,
+        flush_interval: float = 0.2,
+        id_block_size: int = 50,
+        spill_path: Optional[str] = None,
+        max_attempts: int = 3,
+        replay_interval: float = 60.0,
+        miss_timeout: float = 2.0,
+    ):
+        self.registry = registry
+        self.write_behind = write_behind
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.id_block_size = id_block_size
+        self.spill_path = spill_path
+        self.max_attempts = max_attempts
+        self.replay_interval = replay_interval
+        self.miss_timeout = miss_timeout
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.written = 0
+        self.batches = 0
+        self.inline = 0
+        self.spilled = 0
+        self._ids: list[int] = []
+        self._ids_lock = asyncio.Lock()
+        self._pending: dict[int, asyncio.Event] = {}
+        # Rows taken off the queue for the batch being collected
+        self._batch: list[dict] = []
+        self._task: Optional[asyncio.Task] = None
+        self._replay_task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self.write_behind and self._task is None:
+            self._task = asyncio.create_task(self._run())
+            if self.spill_path and self.replay_interval > 0:
+                self._replay_task = asyncio.create_task(self._replay_periodically())
+
+    async def close(self) -> None:
+        # Stop the flusher, then write whatever is still queued
+        for task in (self._replay_task, self._task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._replay_task = None
+        rows, self._batch = self._batch, []
+        while not self.queue.empty():
+            rows.append(self.queue.get_nowait())
+        for i in range(0, len(rows), self.batch_size):
+            await self._write(rows[i:i + self.batch_size])
+
+    async def _reserve_id(self) -> int:
+        async with self._ids_lock:
+            if not self._ids:
+                async with AsyncSessionLocal() as db:
+                    result = await db.execute(RESERVE_IDS_SQL, {"n": self.id_block_size})
+                    self._ids = [row[0] for row in result]
+                    await db.commit()
+                self._ids.reverse()
+            return self._ids.pop()
+
+    async def submit(self, model1_id: str, model2_id: str, question: str, response1: str, response2: str) -> int:
+        row = {
+            "model1_id": await self.registry.pk(model1_id),
+            "model2_id": await self.registry.pk(model2_id),
+            "winner_id": None,
+            "question": question,
+            "response1": response1,
+            "response2": response2,
+            "result": None,
+            "created_at": datetime.now(timezone.utc).replace(tzinfo=None),
+            "voted_at": None,
+        }
+        if not self.write_behind:
+            return await self._insert_one(row)
+
+        row["id"] = await self._reserve_id()
+        try:
+            self.queue.put_nowait(row)
+        except asyncio.QueueFull:
+            # Backpressure: the flusher is behind, so this request pays for its own insert
+            await self._insert_one(row)
+            return row["id"]
+        self._pending[row["id"]] = asyncio.Event()
+        return row["id"]
+
+    async def wait_until_written(self, battle_id: int, timeout: float = 5.0) -> None:
+        # Lets a vote that races the flusher see its battle row
+        event = self._pending.get(battle_id)
+        if event is not None:
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        elif self.write_behind:
+            # Not queued here, another worker may still be flushing it
+            await self._poll_written(battle_id, self.miss_timeout)
+
+    async def _poll_written(self, battle_id: int, timeout: float) -> bool:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            async with AsyncSessionLocal() as db:
+                if (await db.execute(select(battles.c.id).where(battles.c.id == battle_id))).first() is not None:
+                    return True
+            if loop.time() >= deadline:
+                return False
+            await asyncio.sleep(self.flush_interval)
+
+    async def _with_texts(self, db, rows: list[dict]) -> list[dict]:
+        # Question and responses go to battle_texts, compressed and deduplicated, battles keeps their ids
+        texts = text_rows(row[column] for row in rows for column in TEXT_COLUMNS if row.get(column) is not None)
+        ids = {}
+        if texts:
+            await db.execute(insert_texts(async_engine.dialect.name), list(texts.values()))
+            ids = dict((await db.execute(select_text_ids(texts))).all())
+        return [with_text_ids(row, ids) for row in rows]
+
+    async def _insert_one(self, row: dict) -> int:
+        self.inline += 1
+        async with AsyncSessionLocal() as db:
+            [row] = await self._with_texts(db, [row])
+            result = await db.execute(battles.insert().values(**row))
+            await db.commit()
+            return result.inserted_primary_key[0]
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            self._batch.append(await self.queue.get())
+            flush_at = loop.time() + self.flush_interval
+            while len(self._batch) < self.batch_size:
+                remaining = flush_at - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    self._batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            batch, self._batch = self._batch, []
+            await self._write(batch)
+
+    async def _write(self, rows: list[dict]) -> None:
+        delay = 0.5
+        try:
+            for attempt in range(self.max_attempts):
+                try:
+                    async with AsyncSessionLocal() as db:
+                        # One multi-row INSERT for the whole batch
+                        await db.execute(battles.insert(), await self._with_texts(db, rows))
+                        await db.commit()
+                    self.written += len(rows)
+                    self.batches += 1
+                    return
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"Battle batch insert failed (attempt {attempt + 1}): {str(e)}")
+                    if attempt + 1 < self.max_attempts:
+                        await asyncio.sleep(delay)
+                        delay *= 2
+            self._spill(rows)
+        except asyncio.CancelledError:
+            # Shutting down mid-write, keep the rows rather than drop them
+            self._spill(rows)
+            raise
+        finally:
+            for row in rows:
+                event = self._pending.pop(row["id"], None)
+                if event is not None:
+                    event.set()
+
+    def _spill(self, rows: list[dict]) -> None:
+        if not self.spill_path:
+            print(f"Dropping {len(rows)} battles, no spill path configured")
+            return
+        self._append_spill(rows)
+        self.spilled += len(rows)
+        print(f"Spilled {len(rows)} battles to {self.spill_path}")
+
+    def _append_spill(self, rows: list[dict]) -> None:
+        os.makedirs(os.path.dirname(self.spill_path), exist_ok=True)
+        with open(self.spill_path, "a") as f:
+            for row in rows:
+                f.write(json.dumps(row, default=lambda v: v.isoformat()) + "\n")
+
+    async def _replay_periodically(self) -> None:
+        # Spilled rows would otherwise 404 on vote until the next restart
+        while True:
+            await asyncio.sleep(self.replay_interval)
+            try:
+                await self.replay_spill()
+            except Exception as e:
+                print(f"Failed to replay spilled battles: {str(e)}")
+
+    async def replay_spill(self, pattern: Optional[str] = None) -> int:
+        # Rows that never reached the database, from every file matching pattern
+        pattern = pattern or self.spill_path
+        if not pattern:
+            return 0
+        replayed = 0
+        for path in sorted(glob.glob(pattern)):
+            # Claim the file first: new spills start a fresh one, and a file another worker
+            # already claimed is skipped
+            claimed = f"{path}.{os.getpid()}.replaying"
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            with open(claimed) as f:
+                rows = [json.loads(line) for line in f if line.strip()]
+            for row in rows:
+                row["created_at"] = datetime.fromisoformat(row["created_at"])
+            try:
+                if rows:
+                    async with AsyncSessionLocal() as db:
+                        # Ids were reserved up front, so a partly replayed file is safe to replay again
+                        await db.execute(
+                            insert_battles(async_engine.dialect.name).on_conflict_do_nothing(index_elements=["id"]),
+                            await self._with_texts(db, rows),
+                        )
+                        await db.commit()
+            except BaseException:
+                # Hand the rows back to this worker's spill file for the next attempt
+                if self.spill_path:
+                    self._append_spill(rows)
+                    os.remove(claimed)
+                else:
+                    os.rename(claimed, path)
+                raise
+            os.remove(claimed)
+            replayed += len(rows)
+            print(f"Replayed {len(rows)} spilled battles from {path}")
+        return replayed
+
+    def stats(self) -> dict:
+        return {
+            "write_behind": self.write_behind,
+            "queued": self.queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "inline": self.inline,
+            "spilled": self.spilled,
+        }
@@ -0,0 +1,150 @@
+"""Compare FAISS index types on the cached corpus vectors.
+
+For every index type this reports recall@k against exact flat search, p50/p99
+single-query latency, build time and memory, using the questions in
+jfk_qa_example.json as queries. Corpus vectors come from the embedding cache,
+so only the queries ever hit the embedding API (and they are cached too).
+
+    python bench_index.py --k 3 --output cache/index_bench.json
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+
+from faiss_index import INDEX_TYPES, create_index, index_memory_bytes
+from index_builder import MANIFEST_NAME, EmbeddingCache, hash_text
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def resident_memory_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def load_corpus_vectors(cache_path: str, embedding_cache: EmbeddingCache) -> np.ndarray:
+    with open(os.path.join(cache_path, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    chunk_hashes = [chunk["hash"] for entry in manifest["files"].values() for chunk in entry["chunks"]]
+    vectors = embedding_cache.get_many(chunk_hashes)
+    missing = len(set(chunk_hashes)) - len(vectors)
+    if missing:
+        print(f"Warning: {missing} chunks have no cached embedding and are left out")
+    return np.asarray(list(vectors.values()), dtype=np.float32)
+
+
+def load_query_vectors(qa_path: str, embedding_cache: EmbeddingCache) -> np.ndarray:
+    from langchain_openai import OpenAIEmbeddings
+
+    with open(qa_path) as f:
+        queries = [item["query"] for item in json.load(f)]
+    query_hashes = [hash_text("query:" + query) for query in queries]
+    vectors = embedding_cache.get_many(query_hashes)
+    missing = [(h, q) for h, q in zip(query_hashes, queries) if h not in vectors]
+    if missing:
+        embeddings = OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"))
+        embedded = dict(zip([h for h, _ in missing], embeddings.embed_documents([q for _, q in missing])))
+        embedding_cache.put_many(embedded)
+        vectors.update(embedded)
+    return np.asarray([vectors[h] for h in query_hashes], dtype=np.float32)
+
+
+def sample_query_vectors(corpus: np.ndarray, n: int, seed: int = 0) -> np.ndarray:
+    # Offline stand-in for real questions: perturbed copies of random corpus vectors
+    rng = np.random.default_rng(seed)
+    picks = corpus[rng.choice(len(corpus), size=min(n, len(corpus)), replace=False)]
+    noise = rng.normal(scale=picks.std() * 0.5, size=picks.shape).astype(np.float32)
+    return picks + noise
+
+
+def bench(index_type: str, corpus: np.ndarray, queries: np.ndarray, truth: np.ndarray, k: int, repeat: int, params: dict) -> dict:
+    rss_before = resident_memory_bytes()
+    start = time.perf_counter()
+    index = create_index(index_type, corpus, **params)
+    build_seconds = time.perf_counter() - start
+    rss_delta = resident_memory_bytes() - rss_before
+
+    latencies = []
+    found = None
+    for _ in range(repeat):
+        rows = []
+        for query in queries:
+            start = time.perf_counter()
+            _, ids = index.search(query.reshape(1, -1), k)
+            latencies.append(time.perf_counter() - start)
+            rows.append(ids[0])
+        found = np.asarray(rows)
+
+    recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        "index_type": index_type,
+        f"recall@{k}": round(float(recall), 4),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 4),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 4),
+        "build_s": round(build_seconds, 3),
+        "index_mb": round(index_memory_bytes(index) / 2**20, 2),
+        "rss_delta_mb": round(rss_delta / 2**20, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=20, help="passes over the query set for latency")
+    parser.add_argument("--types", default=",".join(INDEX_TYPES))
+    parser.add_argument("--qa-path", default=os.path.join(base_dir, "..", "jfk_qa_example.json"))
+    parser.add_argument("--sample-queries", type=int, default=0, help="use N synthetic queries instead of the QA set (no API calls)")
+    parser.add_argument("--nlist", type=int, default=0)
+    parser.add_argument("--nprobe", type=int, default=8)
+    parser.add_argument("--pq-m", type=int, default=0)
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--ef-search", type=int, default=64)
+    parser.add_argument("--embedding-model", default="text-embedding-ada-002", help="model the cached vectors were built with")
+    parser.add_argument("--output", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    load_dotenv()
+    embedding_cache = EmbeddingCache(os.path.join(base_dir, "cache", "embeddings.sqlite3"), args.embedding_model)
+    corpus = load_corpus_vectors(os.path.join(base_dir, "cache", "faiss_store"), embedding_cache)
+    if args.sample_queries:
+        queries = sample_query_vectors(corpus, args.sample_queries)
+    else:
+        queries = load_query_vectors(args.qa_path, embedding_cache)
+    embedding_cache.close()
+    print(f"Corpus: {corpus.shape[0]} vectors x {corpus.shape[1]} dims, {len(queries)} queries")
+
+    _, truth = create_index("flat", corpus).search(queries, args.k)
+    params = {
+        "nlist": args.nlist,
+        "nprobe": args.nprobe,
+        "pq_m": args.pq_m,
+        "hnsw_m": args.hnsw_m,
+        "ef_search": args.ef_search,
+    }
+
+    results = [
+        bench(index_type, corpus, queries, truth, args.k, args.repeat, params)
+        for index_type in args.types.split(",")
+    ]
+
+    columns = list(results[0])
+    print("  ".join(f"{c:>12}" for c in columns))
+    for row in results:
+        print("  ".join(f"{row[c]:>12}" for c in columns))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"corpus_size": int(corpus.shape[0]), "k": args.k, "params": params, "results": results}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
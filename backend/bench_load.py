@@ -0,0 +1,502 @@
+"""Load-test /battle, /vote and /leaderboard against local stand-ins.
+
+Starts a stub OpenRouter server (configurable latency, streaming speed and error
+rate) and the app under uvicorn, pointed at the stub, at offline hash embeddings
+and at a local database. Every scenario is then driven at each concurrency level
+and throughput, p50/p95/p99 latency and error rate are reported per endpoint.
+Results are saved as JSON so runs can be compared against each other later.
+
+    python bench_load.py run --concurrency 1,8,32 --duration 20 --workers 2
+    python bench_load.py compare cache/bench/load-before.json cache/bench/load-after.json
+    python bench_load.py stub-upstream --port 9100 --latency-ms 800 --error-rate 0.02
+
+Set DATABASE_URL (or --database-url) to a local Postgres to measure the
+write-behind battle path, which is off on SQLite.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from typing import Optional
+
+import httpx
+import numpy as np
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+
+SCENARIOS = ("leaderboard", "battle", "stream", "flow")
+
+STUB_WORDS = (
+    "the president motorcade dallas warren commission report oswald depository "
+    "rifle witness testimony evidence investigation records document archive"
+).split()
+
+
+def create_stub_upstream(
+    latency: float = 0.5,
+    jitter: float = 0.3,
+    tokens: int = 200,
+    token_interval: float = 0.01,
+    error_rate: float = 0.0,
+    error_status: int = 500,
+    seed: int = 0,
+):
+    """OpenRouter chat completions stand-in.
+
+    Waits latency (log-normally jittered) before the first token, then produces
+    tokens words at one per token_interval, streamed or all at once. error_rate of
+    the requests fail with error_status after the initial wait instead.
+    """
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse, StreamingResponse
+
+    app = FastAPI()
+    rng = random.Random(seed)
+
+    @app.post("/api/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        await asyncio.sleep(latency * rng.lognormvariate(0, jitter) if jitter else latency)
+        if rng.random() < error_rate:
+            return JSONResponse(
+                status_code=error_status,
+                content={"error": {"code": error_status, "message": "Stub upstream error"}},
+            )
+
+        words = [rng.choice(STUB_WORDS) + " " for _ in range(tokens)]
+        if not body.get("stream"):
+            await asyncio.sleep(token_interval * tokens)
+            return {
+                "id": "stub",
+                "model": body.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(words).strip()}, "finish_reason": "stop"}],
+                "usage": {"completion_tokens": tokens},
+            }
+
+        async def chunks():
+            yield ": OPENROUTER PROCESSING\n\n"
+            for word in words:
+                yield f"data: {json.dumps({'choices': [{'index': 0, 'delta': {'content': word}}]})}\n\n"
+                if token_interval:
+                    await asyncio.sleep(token_interval)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    return app
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latencies: list[float] = []
+        self.first_token: list[float] = []
+        self.statuses: Counter = Counter()
+        self.errors = 0
+
+    def record(self, seconds: float, status, ok: bool, first_token: Optional[float] = None) -> None:
+        self.latencies.append(seconds)
+        self.statuses[str(status)] += 1
+        if not ok:
+            self.errors += 1
+        if first_token is not None:
+            self.first_token.append(first_token)
+
+    def summary(self, elapsed: float) -> dict:
+        latencies_ms = np.asarray(self.latencies) * 1000
+        p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+        summary = {
+            "requests": len(self.latencies),
+            "errors": self.errors,
+            "error_rate": round(self.errors / len(self.latencies), 4),
+            "rps": round(len(self.latencies) / elapsed, 2),
+            "p50_ms": round(float(p50), 1),
+            "p95_ms": round(float(p95), 1),
+            "p99_ms": round(float(p99), 1),
+            "max_ms": round(float(latencies_ms.max()), 1),
+            "statuses": dict(self.statuses),
+        }
+        if self.first_token:
+            first_ms = np.asarray(self.first_token) * 1000
+            summary["first_token_p50_ms"] = round(float(np.percentile(first_ms, 50)), 1)
+            summary["first_token_p95_ms"] = round(float(np.percentile(first_ms, 95)), 1)
+        return summary
+
+
+class Session:
+    """One simulated client, which keeps its own leaderboard ETag like the frontend does."""
+
+    def __init__(self, client: httpx.AsyncClient, stats: dict, rng: random.Random, models: list[str], questions: list[str], user_id: str):
+        self.client = client
+        self.stats = stats
+        self.rng = rng
+        self.models = models
+        self.questions = questions
+        # Sent like the frontend does. Rate limits key on the session cookie, which simulated
+        # sessions don't have, so with limits on they all share one per-address bucket.
+        self.user_id = user_id
+        self.etag = None
+
+    def battle_request(self) -> dict:
+        model1, model2 = self.rng.sample(self.models, 2)
+        return {"model1": model1, "model2": model2, "question": self.rng.choice(self.questions), "user_id": self.user_id}
+
+    async def call(self, endpoint: str, method: str, path: str, **kwargs) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, path, **kwargs)
+        except httpx.HTTPError as e:
+            self.stats[endpoint].record(time.perf_counter() - start, type(e).__name__, False)
+            return None
+        self.stats[endpoint].record(time.perf_counter() - start, response.status_code, response.status_code < 400)
+        return response
+
+    async def leaderboard(self) -> None:
+        headers = {"If-None-Match": self.etag} if self.etag else {}
+        response = await self.call("GET /leaderboard", "GET", "/leaderboard", headers=headers)
+        if response is not None and response.status_code in (200, 304):
+            self.etag = response.headers.get("etag")
+
+    async def battle(self) -> Optional[dict]:
+        request = self.battle_request()
+        response = await self.call("POST /battle", "POST", "/battle", json=request)
+        if response is None or response.status_code != 200:
+            return None
+        return {**request, "battle_id": response.json()["battle_id"]}
+
+    async def stream(self) -> Optional[dict]:
+        # Ok only once the battle event arrives, errors come in-band on a 200 stream
+        request = self.battle_request()
+        start = time.perf_counter()
+        first_token = None
+        battle_id = None
+        status = None
+        try:
+            async with self.client.stream("POST", "/battle/stream", json=request) as response:
+                status = response.status_code
+                event = None
+                async for line in response.aiter_lines():
+                    if line.startswith("event: "):
+                        event = line[len("event: "):]
+                    elif line.startswith("data: "):
+                        if event == "token" and first_token is None:
+                            first_token = time.perf_counter() - start
+                        elif event == "battle":
+                            battle_id = json.loads(line[len("data: "):])["battle_id"]
+                        elif event == "error":
+                            status = "stream_error"
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        self.stats["POST /battle/stream"].record(time.perf_counter() - start, status, battle_id is not None, first_token)
+        return {**request, "battle_id": battle_id} if battle_id is not None else None
+
+    async def vote(self, battle: dict) -> None:
+        result = self.rng.choices(["model1", "model2", "draw", "invalid"], weights=[45, 45, 8, 2])[0]
+        await self.call("POST /vote", "POST", "/vote", json={**battle, "result": result})
+
+    async def flow(self) -> None:
+        # What a real visitor does: ask, vote, look at the leaderboard
+        battle = await self.battle()
+        if battle is not None:
+            await self.vote(battle)
+        await self.leaderboard()
+
+    async def run(self, scenario: str) -> None:
+        await getattr(self, scenario)()
+
+
+async def run_level(base_url: str, scenario: str, concurrency: int, duration: float, models: list[str], questions: list[str], timeout: float) -> tuple[dict, float]:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    stats = defaultdict(EndpointStats)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        deadline = time.perf_counter() + duration
+
+        async def worker(seed: int):
+            session = Session(client, stats, random.Random(seed), models, questions, f"bench-{seed}")
+            while time.perf_counter() < deadline:
+                await session.run(scenario)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return stats, elapsed
+
+
+async def run_suite(base_url: str, scenarios: list[str], levels: list[int], duration: float, warmup: float, timeout: float, questions: list[str]) -> list[dict]:
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout) as client:
+        models = [model["id"] for model in (await client.get("/models")).json()]
+
+    results = []
+    for scenario in scenarios:
+        for concurrency in levels:
+            if warmup:
+                await run_level(base_url, scenario, concurrency, warmup, models, questions, timeout)
+            stats, elapsed = await run_level(base_url, scenario, concurrency, duration, models, questions, timeout)
+            for endpoint, endpoint_stats in sorted(stats.items()):
+                row = {"scenario": scenario, "concurrency": concurrency, "endpoint": endpoint, **endpoint_stats.summary(elapsed)}
+                results.append(row)
+                print_row(row)
+    return results
+
+
+def print_header() -> None:
+    print(f"{'scenario':<12} {'conc':>5} {'endpoint':<20} {'reqs':>7} {'rps':>8} {'p50_ms':>9} {'p95_ms':>9} {'p99_ms':>9} {'errors':>7}")
+
+
+def print_row(row: dict) -> None:
+    print(
+        f"{row['scenario']:<12} {row['concurrency']:>5} {row['endpoint']:<20} {row['requests']:>7} {row['rps']:>8.1f} "
+        f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['error_rate']:>7.2%}"
+    )
+
+
+def load_questions(qa_path: str) -> list[str]:
+    try:
+        with open(qa_path) as f:
+            return [item["query"] for item in json.load(f)]
+    except (OSError, ValueError, KeyError):
+        return [f"What does document {i} say about the motorcade route?" for i in range(20)]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_process(args: list[str], env: dict, log_path: str) -> subprocess.Popen:
+    log = open(log_path, "w")
+    return subprocess.Popen(args, cwd=base_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_until_ready(url: str, process: subprocess.Popen, log_path: str, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode}, see {log_path}")
+        try:
+            if httpx.get(url, timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{url} not ready after {timeout:.0f}s, see {log_path}")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=base_dir, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(before: dict, after: dict, threshold: float) -> bool:
+    """Prints per-endpoint changes between two runs and returns whether anything regressed."""
+    previous = {(r["scenario"], r["concurrency"], r["endpoint"]): r for r in before["results"]}
+    print(f"Comparing {before.get('commit')} ({before.get('created')}) -> {after.get('commit')} ({after.get('created')})")
+    print(f"{'scenario':<12} {'conc':>5} {'endpoint':<20} {'rps':>16} {'p95_ms':>18} {'errors':>16}")
+    regressed = False
+    for row in after["results"]:
+        old = previous.get((row["scenario"], row["concurrency"], row["endpoint"]))
+        if old is None:
+            continue
+        slower = row["p95_ms"] > old["p95_ms"] * (1 + threshold)
+        fewer = row["rps"] < old["rps"] * (1 - threshold)
+        failing = row["error_rate"] > old["error_rate"] + 0.01
+        flag = "  REGRESSION" if slower or fewer or failing else ""
+        regressed = regressed or bool(flag)
+        print(
+            f"{row['scenario']:<12} {row['concurrency']:>5} {row['endpoint']:<20} "
+            f"{old['rps']:>7.1f} -> {row['rps']:<6.1f} {old['p95_ms']:>8.1f} -> {row['p95_ms']:<7.1f} "
+            f"{old['error_rate']:>6.2%} -> {row['error_rate']:<6.2%}{flag}"
+        )
+    return regressed
+
+
+def stub_args(args) -> list[str]:
+    return [
+        "--latency-ms", str(args.latency_ms),
+        "--jitter", str(args.jitter),
+        "--tokens", str(args.tokens),
+        "--token-ms", str(args.token_ms),
+        "--error-rate", str(args.error_rate),
+        "--error-status", str(args.error_status),
+    ]
+
+
+def run(args) -> None:
+    scenarios = args.scenarios.split(",")
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    levels = [int(level) for level in args.concurrency.split(",")]
+    questions = load_questions(args.qa_path)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench-load-")
+    os.makedirs(workdir, exist_ok=True)
+    processes = []
+    try:
+        base_url = args.url
+        if base_url is None:
+            stub_port = free_port()
+            stub_log = os.path.join(workdir, "stub.log")
+            stub = start_process(
+                [sys.executable, os.path.abspath(__file__), "stub-upstream", "--port", str(stub_port), *stub_args(args)],
+                dict(os.environ), stub_log,
+            )
+            processes.append(stub)
+
+            app_port = free_port()
+            app_log = os.path.join(workdir, "app.log")
+            env = {
+                **os.environ,
+                "DATABASE_URL": args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+                "OPENROUTER_URL": f"http://127.0.0.1:{stub_port}/api/v1/chat/completions",
+                "OPENROUTER_API_KEY": "stub",
+                "EMBEDDINGS_PROVIDER": "hash",
+                "HASH_EMBEDDINGS_LATENCY_MS": str(args.embed_latency_ms),
+                "CACHE_DIR": os.path.join(workdir, "cache"),
+                "WEB_CONCURRENCY": str(args.workers),
+                # Simulated sessions battle back to back, far faster than a person, so the per-user
+                # limit would reject nearly everything. Admission control stays on and is measured.
+                # Pass --env USER_BATTLES_PER_MINUTE=10 to bench with it.
+                "USER_BATTLES_PER_MINUTE": "0",
+                **dict(item.split("=", 1) for item in args.env),
+            }
+            if args.data_dir:
+                env["DATA_DIR"] = args.data_dir
+            app = start_process(
+                [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(app_port),
+                 "--workers", str(args.workers), "--log-level", "warning"],
+                env, app_log,
+            )
+            processes.append(app)
+
+            wait_until_ready(f"http://127.0.0.1:{stub_port}/docs", stub, stub_log, 30)
+            base_url = f"http://127.0.0.1:{app_port}"
+            wait_until_ready(f"{base_url}/readyz", app, app_log, args.ready_timeout)
+            print(f"App on {base_url} ({args.workers} workers), logs in {workdir}")
+
+        print_header()
+        results = asyncio.run(run_suite(base_url, scenarios, levels, args.duration, args.warmup, args.timeout, questions))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if args.workdir is None and not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "host": {"python": platform.python_version(), "cpus": os.cpu_count(), "platform": platform.platform()},
+        "settings": {
+            "target": args.url or "local",
+            "workers": args.workers,
+            "duration": args.duration,
+            "database": "external" if args.database_url or args.url else "sqlite",
+            "upstream": dict(zip(stub_args(args)[::2], stub_args(args)[1::2])),
+            "embed_latency_ms": args.embed_latency_ms,
+            "env": args.env,
+        },
+        "results": results,
+    }
+    output = args.output or os.path.join(base_dir, "cache", "bench", f"load-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            if compare(json.load(f), report, args.threshold):
+                sys.exit(1)
+
+
+def add_stub_arguments(parser) -> None:
+    parser.add_argument("--latency-ms", type=float, default=500, help="upstream wait before the first token")
+    parser.add_argument("--jitter", type=float, default=0.3, help="log-normal sigma applied to that wait")
+    parser.add_argument("--tokens", type=int, default=200, help="tokens per completion")
+    parser.add_argument("--token-ms", type=float, default=10, help="time per generated token")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream calls that fail")
+    parser.add_argument("--error-status", type=int, default=500)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="start the stand-ins and the app, then run the load")
+    run_parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    run_parser.add_argument("--concurrency", default="1,8,32", help="comma-separated concurrent clients per level")
+    run_parser.add_argument("--duration", type=float, default=20, help="seconds measured per scenario and level")
+    run_parser.add_argument("--warmup", type=float, default=2, help="unmeasured seconds before each level")
+    run_parser.add_argument("--timeout", type=float, default=60, help="client timeout per request")
+    run_parser.add_argument("--ready-timeout", type=float, default=300, help="seconds to wait for the app to become ready")
+    run_parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    run_parser.add_argument("--url", help="load an already running app instead of starting one with stubs")
+    run_parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"), help="defaults to a fresh SQLite file")
+    run_parser.add_argument("--data-dir", help="documents to index, defaults to the app's data directory")
+    run_parser.add_argument("--embed-latency-ms", type=float, default=0, help="simulated embedding API latency")
+    run_parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra app setting, repeatable")
+    run_parser.add_argument("--qa-path", default=os.path.join(base_dir, "..", "jfk_qa_example.json"))
+    run_parser.add_argument("--workdir", help="keep database, index and logs here")
+    run_parser.add_argument("--keep", action="store_true", help="keep the temporary workdir")
+    run_parser.add_argument("--output", help="defaults to cache/bench/load-<timestamp>.json")
+    run_parser.add_argument("--baseline", help="compare against this earlier run and exit 1 on regression")
+    run_parser.add_argument("--threshold", type=float, default=0.1, help="relative change counted as a regression")
+    add_stub_arguments(run_parser)
+
+    compare_parser = sub.add_parser("compare", help="compare two saved runs")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.add_argument("--threshold", type=float, default=0.1)
+
+    stub_parser = sub.add_parser("stub-upstream", help="serve only the stub OpenRouter API")
+    stub_parser.add_argument("--host", default="127.0.0.1")
+    stub_parser.add_argument("--port", type=int, default=9100)
+    stub_parser.add_argument("--seed", type=int, default=0)
+    add_stub_arguments(stub_parser)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    elif args.command == "compare":
+        with open(args.before) as f:
+            before = json.load(f)
+        with open(args.after) as f:
+            after = json.load(f)
+        if compare(before, after, args.threshold):
+            sys.exit(1)
+    elif args.command == "stub-upstream":
+        import uvicorn
+
+        app = create_stub_upstream(
+            latency=args.latency_ms / 1000,
+            jitter=args.jitter,
+            tokens=args.tokens,
+            token_interval=args.token_ms / 1000,
+            error_rate=args.error_rate,
+            error_status=args.error_status,
+            seed=args.seed,
+        )
+        uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import os
+import re
+from collections import Counter
+from typing import Optional
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by did do does for from had has have he her his how i in is it its "
+    "of on or she that the their them they this to was were what when where which who whom why "
+    "will with you".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    # Keeps hyphenated cryptonyms like "licraft-1" together as a single term
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """Okapi BM25 over the document chunks, stored as CSR-style postings arrays.
+
+    Postings for term t live in docs[offsets[t]:offsets[t + 1]] with matching
+    term frequencies in tfs, so the whole index is a handful of flat NumPy arrays
+    that save and load without pickling.
+    """
+
+    def __init__(
+        self,
+        vocab: dict[str, int],
+        doc_ids: list[str],
+        offsets: np.ndarray,
+        docs: np.ndarray,
+        tfs: np.ndarray,
+        doc_lengths: np.ndarray,
+        signature: str = "",
+        k1: float = 1.5,
+        b: float = 0.75,
+    ):
+        self.vocab = vocab
+        self.doc_ids = doc_ids
+        self.offsets = offsets
+        self.docs = docs
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self.signature = signature
+        self.k1 = k1
+        self.b = b
+        self.avg_doc_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+        doc_freqs = np.diff(offsets).astype(np.float32)
+        n = len(doc_ids)
+        self.idf = np.log1p((n - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+        # Per-document length normalization is query independent, compute it once
+        self._norm = (k1 * (1 - b + b * doc_lengths / max(self.avg_doc_length, 1e-9))).astype(np.float32)
+
+    @classmethod
+    def build(cls, doc_ids: list[str], texts: list[str], signature: str = "") -> "BM25Index":
+        vocab: dict[str, int] = {}
+        postings: list[list[tuple[int, int]]] = []
+        doc_lengths = np.zeros(len(texts), dtype=np.int32)
+
+        for doc_index, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths[doc_index] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                term_id = vocab.setdefault(term, len(vocab))
+                if term_id == len(postings):
+                    postings.append([])
+                postings[term_id].append((doc_index, tf))
+
+        offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(p) for p in postings])
+        docs = np.fromiter((d for p in postings for d, _ in p), dtype=np.int32, count=int(offsets[-1]))
+        tfs = np.fromiter((tf for p in postings for _, tf in p), dtype=np.float32, count=int(offsets[-1]))
+
+        return cls(vocab, list(doc_ids), offsets, docs, tfs, doc_lengths, signature)
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def search(self, query: str, k: int) -> list[tuple[str, float]]:
+        term_ids = [self.vocab[t] for t in set(tokenize(query)) if t in self.vocab]
+        if not term_ids or not self.doc_ids:
+            return []
+
+        scores = np.zeros(len(self.doc_ids), dtype=np.float32)
+        for term_id in term_ids:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs = self.docs[start:end]
+            tfs = self.tfs[start:end]
+            # Each document appears at most once per term, so plain fancy-index add is safe
+            scores[docs] += self.idf[term_id] * tfs * (self.k1 + 1) / (tfs + self._norm[docs])
+
+        k = min(k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.doc_ids[i], float(scores[i])) for i in top]
+
+    def save(self, path: str) -> None:
+        terms = [None] * len(self.vocab)
+        for term, term_id in self.vocab.items():
+            terms[term_id] = term
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            terms=np.array(terms, dtype=str),
+            doc_ids=np.array(self.doc_ids, dtype=str),
+            offsets=self.offsets,
+            docs=self.docs,
+            tfs=self.tfs,
+            doc_lengths=self.doc_lengths,
+            signature=np.array(self.signature),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["BM25Index"]:
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                vocab = {term: i for i, term in enumerate(data["terms"].tolist())}
+                return cls(
+                    vocab,
+                    data["doc_ids"].tolist(),
+                    data["offsets"],
+                    data["docs"],
+                    data["tfs"],
+                    data["doc_lengths"],
+                    str(data["signature"]),
+                )
+        except Exception as e:
+            print(f"Failed to load BM25 index: {str(e)}")
+            return None
+
+
+def reciprocal_rank_fusion(rankings: list[list[str]], k: int, rrf_k: int = 60) -> list[str]:
+    scores: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)[:k]
@@ -0,0 +1,204 @@
+import os
+import time
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, BigInteger, Column, Integer, String, Float, MetaData, Table, func, ForeignKey, DateTime, UniqueConstraint, Boolean, Index, LargeBinary
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from metrics import DB_POOL_WAIT_SECONDS, record
+
+load_dotenv()
+
+# Database connection
+DATABASE_URL = os.getenv("DATABASE_URL")
+if not DATABASE_URL:
+    raise Exception("DATABASE_URL environment variable is not set")
+
+# Pool settings, per engine and per process
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+# Fail fast instead of parking requests for long when the pool is exhausted
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+
+def async_database_url(url: str) -> str:
+    # Same database, async driver: asyncpg for Postgres, aiosqlite for local SQLite
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend == "postgresql":
+        query = dict(parsed.query)
+        # asyncpg takes ssl= where libpq takes sslmode=
+        if "sslmode" in query:
+            query["ssl"] = query.pop("sslmode")
+        parsed = parsed.set(drivername="postgresql+asyncpg", query=query)
+    elif backend == "sqlite":
+        parsed = parsed.set(drivername="sqlite+aiosqlite")
+    return parsed.render_as_string(hide_password=False)
+
+class CheckoutTimer:
+    # Times every pool checkout, so exhaustion shows up as wait before it shows up as timeouts
+    engine_label = ""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            record(DB_POOL_WAIT_SECONDS, started, self.engine_label, span="db_pool_wait")
+
+class TimedQueuePool(CheckoutTimer, QueuePool):
+    engine_label = "sync"
+
+class TimedAsyncQueuePool(CheckoutTimer, AsyncAdaptedQueuePool):
+    engine_label = "async"
+
+def pool_options(poolclass) -> dict:
+    if make_url(DATABASE_URL).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "poolclass": poolclass,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+    }
+
+def sync_connect_args() -> dict:
+    if make_url(DATABASE_URL).get_backend_name() != "postgresql":
+        return {}
+    return {
+        "connect_timeout": DB_CONNECT_TIMEOUT,  # Connection timeout
+        "keepalives": 1,        # Enable keepalive
+        "keepalives_idle": 30,  # Keepalive idle time
+        "keepalives_interval": 10,  # Keepalive interval
+        "keepalives_count": 5,   # Keepalive retry count
+    }
+
+def async_connect_args() -> dict:
+    if make_url(DATABASE_URL).get_backend_name() != "postgresql":
+        return {}
+    return {"timeout": DB_CONNECT_TIMEOUT}
+
+print(f"Connecting to database: {make_url(DATABASE_URL).render_as_string(hide_password=True)}")
+
+# Sync engine, used for schema setup and offline scripts
+engine = create_engine(
+    DATABASE_URL,
+    pool_pre_ping=True,  # Automatically check if connection is valid
+    pool_recycle=DB_POOL_RECYCLE,
+    connect_args=sync_connect_args(),
+    **pool_options(TimedQueuePool),
+)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Async engine, used by request handlers so queries never block the event loop
+async_engine = create_async_engine(
+    async_database_url(DATABASE_URL),
+    pool_pre_ping=True,
+    pool_recycle=DB_POOL_RECYCLE,
+    connect_args=async_connect_args(),
+    **pool_options(TimedAsyncQueuePool),
+)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+def pool_status() -> dict:
+    pool = async_engine.pool
+    if not hasattr(pool, "checkedout"):
+        return {"pool": pool.status()}
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "max_overflow": DB_MAX_OVERFLOW,
+    }
+
+# Create database tables
+metadata = MetaData()
+
+user = Table(
+    "user",
+    metadata,
+    Column("id", String, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("email", String, nullable=False, unique=True),
+    Column("email_verified", Boolean, nullable=False),
+    Column("image", String, nullable=True),
+    Column("created_at", DateTime, nullable=False),
+    Column("updated_at", DateTime, nullable=False),
+    Column("anonymous", Boolean, nullable=False, default=False),
+)
+
+# Written by better-auth in the frontend, read here to tell who a request comes from
+session = Table(
+    "session",
+    metadata,
+    Column("id", String, primary_key=True),
+    Column("expires_at", DateTime, nullable=False),
+    Column("token", String, nullable=False, unique=True),
+    Column("created_at", DateTime, nullable=False),
+    Column("updated_at", DateTime, nullable=False),
+    Column("ip_address", String, nullable=True),
+    Column("user_agent", String, nullable=True),
+    Column("user_id", String, ForeignKey("user.id", ondelete="CASCADE"), nullable=False),
+)
+
+models = Table(
+    "models",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("model_id", String),
+    Column("name", String),
+    Column("wins", Integer, default=0),
+    Column("losses", Integer, default=0),
+    Column("draws", Integer, default=0),
+    Column("invalid", Integer, default=0),
+    Column("elo", Float, default=1500.0),
+    Column("user_id", String, ForeignKey("user.id", ondelete="CASCADE"), nullable=True),
+    UniqueConstraint('user_id', 'model_id', name='models_user_id_model_id_key')
+)
+
+# Compressed question and response text, deduplicated by content hash
+battle_texts = Table(
+    "battle_texts",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("hash", String(64), nullable=False, unique=True),  # sha256 of the raw text
+    Column("codec", String(8), nullable=False),  # 'zstd' or 'zlib'
+    Column("size", Integer, nullable=False),  # raw length in bytes
+    Column("data", LargeBinary, nullable=False),
+)
+
+battles = Table(
+    "battles",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("model1_id", Integer, ForeignKey("models.id", ondelete="CASCADE")),
+    Column("model2_id", Integer, ForeignKey("models.id", ondelete="CASCADE")),
+    Column("winner_id", Integer, ForeignKey("models.id", ondelete="CASCADE"), nullable=True),
+    # Legacy inline text, NULL once a row's text lives in battle_texts
+    Column("question", String),
+    Column("response1", String),
+    Column("response2", String),
+    Column("result", String, nullable=True),  # 'model1_win', 'model2_win', 'draw', 'invalid'
+    Column("created_at", DateTime, default=func.now()),
+    Column("voted_at", DateTime, nullable=True),
+    Column("user_id", String, ForeignKey("user.id", ondelete="CASCADE"), nullable=True),
+    Column("question_text_id", Integer, ForeignKey("battle_texts.id"), nullable=True),
+    Column("response1_text_id", Integer, ForeignKey("battle_texts.id"), nullable=True),
+    Column("response2_text_id", Integer, ForeignKey("battle_texts.id"), nullable=True),
+    # Per-user history, vote stats and pair lookups
+    Index("ix_battles_user_id_created_at", "user_id", "created_at"),
+    Index("ix_battles_result", "result"),
+    Index("ix_battles_model_pair", "model1_id", "model2_id"),
+)
+
+# Monotonic counters other workers poll to notice changes, e.g. "leaderboard" after every vote
+change_counters = Table(
+    "change_counters",
+    metadata,
+    Column("name", String, primary_key=True),
+    Column("value", BigInteger, nullable=False, default=0),
+)
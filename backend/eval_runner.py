@@ -0,0 +1,222 @@
+"""Run every QA question against every supported model in one concurrent batch.
+
+Context is retrieved once per question and shared by all models, completions go
+through the same prompt, retries and circuit breakers as /battle, and each result
+is appended to a JSONL file as soon as it arrives. Rerunning with the same output
+skips the (question, model) pairs that already succeeded, so an interrupted run
+resumes where it stopped. Needs the same .env as the server.
+
+    python eval_runner.py --output cache/eval/nightly.jsonl --concurrency 64 --per-model 4 --rps 20
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import Counter, defaultdict
+
+import main as server
+from resilience import CircuitOpenError, Deadline, TokenBucket
+from upstream import OPENROUTER_URL, UpstreamClient
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def question_hash(question: str) -> str:
+    return hashlib.sha256(question.encode("utf-8")).hexdigest()[:16]
+
+
+def load_checkpoint(path: str, prompt_version: str) -> set[tuple[str, str]]:
+    # (question hash, model id) pairs already answered with the current prompt
+    done = set()
+    if not os.path.exists(path):
+        return done
+    line = ""
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # A line cut short by a crash, that pair just runs again
+            if record.get("status") == "ok" and record.get("prompt_version") == prompt_version:
+                done.add((record["question_hash"], record["model_id"]))
+    if line and not line.endswith("\n"):
+        # End the cut line so the next record starts on a line of its own
+        with open(path, "a") as f:
+            f.write("\n")
+    return done
+
+
+class EvalRun:
+    """One batch run, holding only counters in memory while results stream to disk."""
+
+    def __init__(
+        self,
+        upstream: UpstreamClient,
+        models: list[str],
+        output,
+        done: set,
+        concurrency: int = 32,
+        rps: float = 0.0,
+        per_model_rps: float = 0.0,
+        context_lookahead: int = 8,
+        deadline: float = 120.0,
+    ):
+        self.upstream = upstream
+        self.models = models
+        self.output = output
+        self.done = done
+        self.concurrency = concurrency
+        self.deadline = deadline
+        self.context_lookahead = context_lookahead
+        self.bucket = TokenBucket(rps) if rps else None
+        self.model_buckets = defaultdict(lambda: TokenBucket(per_model_rps)) if per_model_rps else None
+        # Bounded, so retrieval only runs a little ahead of the completions
+        self.jobs: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+        self.counts: Counter = Counter()
+        self.latency = defaultdict(float)
+
+    async def _throttle(self, model_id: str) -> None:
+        if self.bucket is not None:
+            await self.bucket.acquire()
+        if self.model_buckets is not None:
+            await self.model_buckets[model_id].acquire()
+
+    async def _produce(self, items: list[dict]) -> None:
+        lookahead = asyncio.Semaphore(self.context_lookahead)
+
+        async def expand(index: int, item: dict):
+            qhash = question_hash(item["query"])
+            models = [model_id for model_id in self.models if (qhash, model_id) not in self.done]
+            if not models:
+                return
+            # Held until every job is queued, so at most lookahead contexts wait in memory
+            async with lookahead:
+                context = await server.get_relevant_context(item["query"])
+                for model_id in models:
+                    await self.jobs.put((index, qhash, item, context, model_id))
+
+        await asyncio.gather(*(expand(index, item) for index, item in enumerate(items)))
+
+    def _write(self, record: dict) -> None:
+        self.output.write(json.dumps(record) + "\n")
+        self.output.flush()
+
+    async def _answer(self, index: int, qhash: str, item: dict, context: str, model_id: str) -> None:
+        await self._throttle(model_id)
+        started = time.perf_counter()
+        record = {
+            "question_index": index,
+            "question_hash": qhash,
+            "model_id": model_id,
+            "prompt_version": server.PROMPT_VERSION,
+            "question": item["query"],
+            "expected_answer": item.get("expected_answer"),
+        }
+        try:
+            response = await server.upstream_policy.call(
+                model_id,
+                lambda: server.get_model_response(self.upstream, model_id, item["query"], context),
+                Deadline(self.deadline),
+            )
+            record.update(status="ok", response=response)
+        except CircuitOpenError:
+            record.update(status="error", error="circuit open")
+        except asyncio.TimeoutError:
+            record.update(status="error", error="timeout")
+        except Exception as e:
+            record.update(status="error", error=str(getattr(e, "detail", e)))
+        record["latency_s"] = round(time.perf_counter() - started, 3)
+        self._write(record)
+        self.counts[(model_id, record["status"])] += 1
+        self.latency[model_id] += record["latency_s"]
+
+    async def _work(self) -> None:
+        while True:
+            job = await self.jobs.get()
+            try:
+                await self._answer(*job)
+            finally:
+                self.jobs.task_done()
+
+    async def run(self, items: list[dict]) -> None:
+        workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+        try:
+            await self._produce(items)
+            await self.jobs.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+
+async def evaluate(args) -> EvalRun:
+    with open(args.qa_path) as f:
+        items = json.load(f)[:args.limit or None]
+    models = args.models.split(",") if args.models else [model["id"] for model in server.SUPPORTED_MODELS]
+
+    await server.warm_up_index()
+    print(f"Index {server.startup_state['index']}, {len(items)} questions x {len(models)} models")
+
+    upstream = UpstreamClient(
+        os.getenv("OPENROUTER_API_KEY"),
+        url=os.getenv("OPENROUTER_URL", OPENROUTER_URL),
+        max_connections=args.concurrency,
+        max_keepalive_connections=args.concurrency,
+        per_model_concurrency=args.per_model,
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    done = load_checkpoint(args.output, server.PROMPT_VERSION)
+    if done:
+        print(f"Resuming, {len(done)} answers already in {args.output}")
+    try:
+        with open(args.output, "a") as output:
+            run = EvalRun(
+                upstream,
+                models,
+                output,
+                done,
+                concurrency=args.concurrency,
+                rps=args.rps,
+                per_model_rps=args.per_model_rps,
+                context_lookahead=args.context_lookahead,
+                deadline=args.deadline,
+            )
+            await run.run(items)
+    finally:
+        await upstream.aclose()
+        server.retriever.close()
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--qa-path", default=os.path.join(base_dir, "..", "jfk_qa_example.json"))
+    parser.add_argument("--output", default=os.path.join(base_dir, "cache", "eval", "results.jsonl"))
+    parser.add_argument("--models", help="comma-separated model ids, defaults to every supported model")
+    parser.add_argument("--limit", type=int, default=0, help="only the first N questions")
+    parser.add_argument("--concurrency", type=int, default=32, help="completions in flight across all models")
+    parser.add_argument("--per-model", type=int, default=4, help="completions in flight per model")
+    parser.add_argument("--rps", type=float, default=0, help="global request rate limit, 0 for none")
+    parser.add_argument("--per-model-rps", type=float, default=0, help="request rate limit per model, 0 for none")
+    parser.add_argument("--context-lookahead", type=int, default=8, help="questions retrieved concurrently")
+    parser.add_argument("--deadline", type=float, default=server.BATTLE_DEADLINE, help="seconds per answer, retries included")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    run = asyncio.run(evaluate(args))
+    elapsed = time.perf_counter() - started
+
+    print(f"{'model':<48} {'ok':>6} {'errors':>7} {'avg_s':>7}")
+    for model_id in run.models:
+        ok = run.counts[(model_id, "ok")]
+        errors = run.counts[(model_id, "error")]
+        average = run.latency[model_id] / (ok + errors) if ok + errors else 0.0
+        print(f"{model_id:<48} {ok:>6} {errors:>7} {average:>7.2f}")
+    total = sum(run.counts.values())
+    print(f"{total} answers in {elapsed:.1f}s ({total / elapsed:.1f}/s), written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
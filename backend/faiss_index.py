@@ -0,0 +1,120 @@
+import math
+import os
+
+import numpy as np
+
+# flat       - exact search over float32 vectors (the LangChain default)
+# flat_fp16  - exact search over float16 vectors, half the memory
+# ivf        - inverted lists over k-means cells, probes nprobe cells per query
+# ivf_pq     - IVF with product-quantized codes, a few dozen bytes per vector
+# hnsw       - graph search over float32 vectors, fastest queries, most memory
+INDEX_TYPES = ("flat", "flat_fp16", "ivf", "ivf_pq", "hnsw")
+
+# Index types whose vectors can be removed in place when a document changes
+REMOVABLE_INDEX_TYPES = ("flat", "flat_fp16")
+
+
+def index_settings_from_env() -> tuple[str, dict]:
+    index_type = os.getenv("FAISS_INDEX_TYPE", "flat")
+    params = {}
+    for key, env_name in (
+        ("nlist", "FAISS_NLIST"),
+        ("nprobe", "FAISS_NPROBE"),
+        ("pq_m", "FAISS_PQ_M"),
+        ("hnsw_m", "FAISS_HNSW_M"),
+        ("ef_search", "FAISS_EF_SEARCH"),
+    ):
+        if os.getenv(env_name):
+            params[key] = int(os.getenv(env_name))
+    return index_type, params
+
+
+def default_nlist(n_vectors: int) -> int:
+    return max(1, min(n_vectors // 39, int(4 * math.sqrt(n_vectors))))
+
+
+def default_pq_m(dim: int) -> int:
+    # Largest sub-quantizer count that divides the dimension with at least 16 dims each
+    for m in range(max(1, dim // 16), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def create_index(
+    index_type: str,
+    vectors: np.ndarray,
+    nlist: int = 0,
+    nprobe: int = 8,
+    pq_m: int = 0,
+    hnsw_m: int = 32,
+    ef_construction: int = 80,
+    ef_search: int = 64,
+):
+    import faiss
+
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type}")
+
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, dim = vectors.shape
+
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dim)
+    elif index_type == "flat_fp16":
+        index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16)
+    elif index_type == "ivf":
+        index = faiss.IndexIVFFlat(faiss.IndexFlatL2(dim), dim, nlist or default_nlist(n))
+    elif index_type == "ivf_pq":
+        # k-means wants ~39 training points per centroid, use smaller codebooks on small corpora
+        nbits = max(1, min(8, int(math.log2(max(n // 39, 2)))))
+        index = faiss.IndexIVFPQ(faiss.IndexFlatL2(dim), dim, nlist or default_nlist(n), pq_m or default_pq_m(dim), nbits)
+    else:
+        index = faiss.IndexHNSWFlat(dim, hnsw_m)
+        index.hnsw.efConstruction = ef_construction
+
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    tune_index(index, nprobe=nprobe, ef_search=ef_search)
+    return index
+
+
+def tune_index(index, nprobe: int = 8, ef_search: int = 64) -> None:
+    # Search-time knobs, applied after every load so they follow the current settings
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search
+
+
+def enable_reconstruct(index) -> None:
+    # IVF indexes need a direct map before stored vectors can be read back by position
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and ivf.direct_map.no():
+        ivf.make_direct_map()
+
+
+def index_type_of(index) -> str:
+    import faiss
+
+    if isinstance(index, faiss.IndexHNSWFlat):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVFFlat):
+        return "ivf"
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return "flat_fp16"
+    return "flat"
+
+
+def index_memory_bytes(index) -> int:
+    import faiss
+
+    return int(faiss.serialize_index(index).nbytes)
@@ -0,0 +1,45 @@
+import asyncio
+import hashlib
+import re
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+class HashEmbeddings(Embeddings):
+    """Deterministic offline embeddings for benchmarks and local runs.
+
+    Each word is hashed into one of dim buckets with a random sign (feature hashing),
+    so texts sharing words still land near each other and retrieval stays meaningful.
+    latency is slept once per call to stand in for the embedding API round trip.
+    """
+
+    def __init__(self, dim: int = 256, latency: float = 0.0):
+        self.dim = dim
+        self.latency = latency
+        # Cached vectors are keyed by this, so they never mix with real embeddings
+        self.model = f"hash-{dim}"
+
+    def _embed(self, text: str) -> list[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            digest = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[digest % self.dim] += 1.0 if digest >> 63 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.embed_query(text)
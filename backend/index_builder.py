@@ -0,0 +1,484 @@
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
+import sqlite3
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from itertools import chain, islice
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from bm25 import BM25Index
+from faiss_index import REMOVABLE_INDEX_TYPES, create_index, index_settings_from_env, tune_index
+from markdown_chunks import PARSER_VERSION, chunk_markdown_file
+from tokens import count_tokens
+
+MANIFEST_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def save_vectorstore(vectorstore: FAISS, path: str) -> None:
+    # Written aside and renamed into place, so processes that have the old index mapped keep a valid file
+    import faiss
+
+    os.makedirs(path, exist_ok=True)
+    index_path = os.path.join(path, "index.faiss")
+    docstore_path = os.path.join(path, "index.pkl")
+    faiss.write_index(vectorstore.index, index_path + ".tmp")
+    with open(docstore_path + ".tmp", "wb") as f:
+        pickle.dump((vectorstore.docstore, vectorstore.index_to_docstore_id), f)
+    os.replace(index_path + ".tmp", index_path)
+    os.replace(docstore_path + ".tmp", docstore_path)
+
+
+def load_mapped_vectorstore(path: str, embeddings, index_params: Optional[dict] = None) -> Optional[FAISS]:
+    """Read-only store whose vectors are memory-mapped from disk instead of copied.
+
+    Every worker mapping the same file shares one copy in the OS page cache. The
+    docstore (chunk text and metadata) is still unpickled per process.
+    """
+    import faiss
+
+    index_path = os.path.join(path, "index.faiss")
+    if not os.path.exists(index_path):
+        return None
+    # MMAP_IFC maps flat codes as well as inverted lists, older FAISS builds only have MMAP
+    flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+    try:
+        try:
+            index = faiss.read_index(index_path, flags)
+        except RuntimeError as e:
+            print(f"Memory-mapping the index failed, reading it into memory: {str(e)}")
+            index = faiss.read_index(index_path)
+        with open(os.path.join(path, "index.pkl"), "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+    except Exception as e:
+        print(f"Failed to load vector store from cache: {str(e)}")
+        return None
+    params = index_params or {}
+    tune_index(index, **{key: params[key] for key in ("nprobe", "ef_search") if key in params})
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+
+def ingest_settings_from_env() -> dict:
+    return {
+        "parse_workers": int(os.getenv("INDEX_PARSE_WORKERS", "0")) or None,
+        "embed_batch_size": int(os.getenv("INDEX_EMBED_BATCH", "256")),
+        "embed_concurrency": int(os.getenv("INDEX_EMBED_CONCURRENCY", "4")),
+    }
+
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """On-disk store of embedding vectors keyed by chunk content hash."""
+
+    def __init__(self, path: str, model: str):
+        self.path = path
+        self.model = model
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+
+    def _key(self, chunk_hash: str) -> str:
+        # Vectors from different embedding models must never be mixed
+        return f"{self.model}:{chunk_hash}"
+
+    def get_many(self, chunk_hashes: list[str]) -> dict[str, np.ndarray]:
+        found = {}
+        hashes_by_key = {self._key(h): h for h in chunk_hashes}
+        keys = list(hashes_by_key)
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+            ).fetchall()
+            for key, blob in rows:
+                found[hashes_by_key[key]] = np.frombuffer(blob, dtype=np.float32)
+        self.hits += len(found)
+        self.misses += len(set(chunk_hashes)) - len(found)
+        return found
+
+    def put_many(self, items: dict[str, np.ndarray]) -> None:
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+            [(self._key(h), np.asarray(v, dtype=np.float32).tobytes()) for h, v in items.items()],
+        )
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class BuildProgress:
+    """Counts files and chunks as they stream through a build, printed every few seconds."""
+
+    def __init__(self, total_files: int, interval: float = 5.0):
+        self.total_files = total_files
+        self.interval = interval
+        self.files = 0
+        self.chunks = 0
+        self.cached = 0
+        self.embedded = 0
+        self.started = time.monotonic()
+        self._reported = self.started
+
+    def report(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._reported < self.interval:
+            return
+        self._reported = now
+        rate = self.chunks / max(now - self.started, 1e-9)
+        print(
+            f"Indexed {self.chunks} chunks from {self.files}/{self.total_files} files "
+            f"({self.cached} cached, {self.embedded} embedded, {rate:.0f} chunks/s)"
+        )
+
+
+class IndexBuilder:
+    """Keeps the FAISS store in sync with the markdown corpus, re-embedding only what changed.
+
+    A manifest next to the saved index records the content hash of every source file and
+    of every chunk it produced. On each run, chunks of removed or edited files are deleted
+    from the index and chunks of new or edited files are added, with their vectors looked
+    up in the embedding cache before anything is sent to the embedding API.
+
+    New files stream through the build: they are parsed in a process pool and handed
+    over as each one finishes, cache misses go to the embedding API in concurrent
+    batches, and every batch is stored in the embedding cache as it lands, so an
+    interrupted build picks up where it stopped. Only a few files and batches are in
+    flight at a time, whatever the corpus size.
+
+    Index types that can't remove vectors in place (IVF, PQ, HNSW) are instead rebuilt
+    from the embedding cache whenever the corpus changes, which costs no API calls.
+    """
+
+    def __init__(
+        self,
+        data_dir: str,
+        cache_path: str,
+        embeddings,
+        embedding_cache_path: str,
+        chunk_size: int = 1000,
+        chunk_overlap: int = 200,
+        embed_batch_size: int = 256,
+        embed_concurrency: int = 4,
+        parse_workers: Optional[int] = None,
+        index_type: str = "flat",
+        index_params: Optional[dict] = None,
+    ):
+        self.data_dir = data_dir
+        self.cache_path = cache_path
+        self.embeddings = embeddings
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.embed_batch_size = embed_batch_size
+        self.embed_concurrency = embed_concurrency
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        self.index_type = index_type
+        self.index_params = index_params or {}
+        self.files: dict = {}
+        self.model_name = getattr(embeddings, "model", type(embeddings).__name__)
+        self.embedding_cache = EmbeddingCache(embedding_cache_path, self.model_name)
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.cache_path, MANIFEST_NAME)
+
+    def _settings(self) -> dict:
+        return {
+            "version": MANIFEST_VERSION,
+            "embedding_model": self.model_name,
+            "parser": PARSER_VERSION,
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "index_type": self.index_type,
+        }
+
+    def load_manifest(self) -> dict:
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {"files": {}}
+        # Any change to how chunks or vectors are produced invalidates every entry
+        if any(manifest.get(key) != value for key, value in self._settings().items()):
+            print("Index settings changed, rebuilding from embedding cache...")
+            return {"files": {}}
+        return manifest
+
+    def save_manifest(self, manifest: dict) -> None:
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def scan_files(self) -> dict[str, str]:
+        files = {}
+        for path in sorted(glob.glob(os.path.join(self.data_dir, "**", "*.md"), recursive=True)):
+            files[os.path.relpath(path, self.data_dir)] = hash_file(path)
+        return files
+
+    def load_vectorstore(self) -> Optional[FAISS]:
+        if not os.path.exists(os.path.join(self.cache_path, "index.faiss")):
+            return None
+        try:
+            vectorstore = FAISS.load_local(self.cache_path, self.embeddings)
+            tune_index(vectorstore.index, **self._search_params())
+            return vectorstore
+        except Exception as e:
+            # Keep the files on disk, the embedding cache makes a rebuild cheap anyway
+            print(f"Failed to load vector store from cache: {str(e)}")
+            return None
+
+    def _search_params(self) -> dict:
+        return {key: self.index_params[key] for key in ("nprobe", "ef_search") if key in self.index_params}
+
+    def iter_file_chunks(self, rel_paths: list[str]) -> Iterator[tuple[str, list[tuple[str, dict]]]]:
+        # Yields (file, chunks) in completion order, parsing at most two files per worker ahead of the caller
+        paths = {rel: os.path.join(self.data_dir, rel) for rel in rel_paths}
+        # Starting worker processes costs about a second, not worth it for a few changed files
+        if self.parse_workers <= 1 or len(rel_paths) < 4 * self.parse_workers:
+            for rel in rel_paths:
+                yield rel, chunk_markdown_file(paths[rel], self.chunk_size, self.chunk_overlap)
+            return
+
+        # Spawned rather than forked, the server calls this from a thread next to a running event loop
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(self.parse_workers, mp_context=context) as executor:
+            queued = iter(rel_paths)
+            pending = {}
+            while True:
+                for rel in islice(queued, self.parse_workers * 2 - len(pending)):
+                    future = executor.submit(chunk_markdown_file, paths[rel], self.chunk_size, self.chunk_overlap)
+                    pending[future] = rel
+                if not pending:
+                    return
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+
+    def embed_stream(self, items: Iterable[tuple], progress: Optional[BuildProgress] = None) -> Iterator[list]:
+        """Vectors for (chunk hash, text, payload) items, yielded as [(payload, vector)] groups.
+
+        Groups come back as soon as their vectors are known, not in input order. Cached
+        vectors return straight away, the rest are embedded in batches of embed_batch_size
+        with at most embed_concurrency batches in flight.
+        """
+        pending = {}
+
+        def collect(timeout: Optional[float]) -> Iterator[list]:
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = pending.pop(future)
+                vectors = np.asarray(future.result(), dtype=np.float32)
+                # Persist per batch so an interrupted build resumes where it stopped
+                self.embedding_cache.put_many({chunk_hash: vector for (chunk_hash, _, _), vector in zip(batch, vectors)})
+                if progress is not None:
+                    progress.embedded += len(batch)
+                yield [(payload, vector) for (_, _, payload), vector in zip(batch, vectors)]
+
+        def submit(batch: list) -> Iterator[list]:
+            if len(pending) >= self.embed_concurrency:
+                # Backpressure: wait for a batch to land before reading more of the corpus
+                yield from collect(None)
+            pending[executor.submit(self.embeddings.embed_documents, [text for _, text, _ in batch])] = batch
+
+        with ThreadPoolExecutor(self.embed_concurrency) as executor:
+            misses = []
+            for group in batched(items, self.embed_batch_size):
+                cached = self.embedding_cache.get_many([chunk_hash for chunk_hash, _, _ in group])
+                hits = [(payload, cached[chunk_hash]) for chunk_hash, _, payload in group if chunk_hash in cached]
+                if hits:
+                    if progress is not None:
+                        progress.cached += len(hits)
+                    yield hits
+                misses.extend(item for item in group if item[0] not in cached)
+                while len(misses) >= self.embed_batch_size:
+                    yield from submit(misses[:self.embed_batch_size])
+                    misses = misses[self.embed_batch_size:]
+                yield from collect(0)
+            if misses:
+                yield from submit(misses)
+            while pending:
+                yield from collect(None)
+
+    def _fresh_chunks(self, fresh: list[str], current: dict, files: dict, progress: BuildProgress) -> Iterator[tuple]:
+        # Records each file's manifest entry as its chunks go by
+        for rel, chunks in self.iter_file_chunks(fresh):
+            entries = []
+            for i, (text, metadata) in enumerate(chunks):
+                chunk_id = f"{rel}#{i}"
+                chunk_hash = hash_text(text)
+                # Stored with the chunk so the context packer never re-tokenizes it per request
+                metadata["tokens"] = count_tokens(text)
+                entries.append({"id": chunk_id, "hash": chunk_hash})
+                yield chunk_hash, text, (chunk_id, Document(page_content=text, metadata=metadata))
+            files[rel] = {"hash": current[rel], "chunks": entries}
+            progress.files += 1
+
+    @staticmethod
+    def _missing_chunks(vectorstore: FAISS, files: dict) -> int:
+        return sum(
+            isinstance(vectorstore.docstore.search(chunk["id"]), str)
+            for entry in files.values()
+            for chunk in entry["chunks"]
+        )
+
+    def _kept_chunks(self, previous: Optional[FAISS], files: dict) -> Iterator[tuple]:
+        # Unchanged chunks come out of the previous store, their vectors out of the embedding cache
+        if previous is None:
+            return
+        for rel, entry in list(files.items()):
+            for chunk in entry["chunks"]:
+                doc = previous.docstore.search(chunk["id"])
+                yield chunk["hash"], doc.page_content, (chunk["id"], doc)
+
+    def build(self) -> Optional[FAISS]:
+        os.makedirs(self.cache_path, exist_ok=True)
+        vectorstore = self.load_vectorstore()
+        manifest = self.load_manifest() if vectorstore is not None else {"files": {}}
+        if vectorstore is not None and not manifest["files"]:
+            # Legacy store without a manifest, chunk ids are unknown so start over
+            vectorstore = None
+        elif vectorstore is not None and self._missing_chunks(vectorstore, manifest["files"]):
+            # The docstore returns a message string for ids it doesn't know, so the store
+            # no longer matches its manifest. Start over, the embedding cache keeps it cheap.
+            print("Vector store is missing chunks listed in its manifest, rebuilding")
+            vectorstore = None
+            manifest = {"files": {}}
+
+        previous = manifest["files"]
+        current = self.scan_files()
+
+        stale = [rel for rel, entry in previous.items() if current.get(rel) != entry["hash"]]
+        fresh = [rel for rel, file_hash in current.items() if previous.get(rel, {}).get("hash") != file_hash]
+
+        if vectorstore is not None and not stale and not fresh:
+            print(f"Vector store is up to date ({len(current)} files)")
+            self.files = previous
+            return vectorstore
+
+        print(f"Updating vector store: {len(fresh)} new or changed files, {len(stale)} removed or changed files")
+
+        files = {rel: entry for rel, entry in previous.items() if rel not in stale}
+        progress = BuildProgress(len(fresh))
+        chunks = self._fresh_chunks(fresh, current, files, progress)
+
+        if self.index_type in REMOVABLE_INDEX_TYPES:
+            # Vectors go into the index batch by batch, nothing accumulates besides the index itself
+            stale_ids = [chunk["id"] for rel in stale for chunk in previous[rel]["chunks"]] if vectorstore is not None else []
+            if stale_ids:
+                vectorstore.delete(stale_ids)
+            for group in self.embed_stream(chunks, progress):
+                vectorstore = self.add_chunks(vectorstore, group)
+                progress.chunks += len(group)
+                progress.report()
+        else:
+            kept = self._kept_chunks(vectorstore, files)
+            vectorstore = self.assemble(self.embed_stream(chain(kept, chunks), progress), progress)
+        progress.report(force=True)
+
+        if vectorstore is None or not files:
+            print("Warning: No documents found in data directory")
+            return None
+
+        save_vectorstore(vectorstore, self.cache_path)
+        self.save_manifest({**self._settings(), "files": files})
+        self.files = files
+        print(f"Vector store saved with {vectorstore.index.ntotal} chunks from {len(files)} files")
+        return vectorstore
+
+    def add_chunks(self, vectorstore: Optional[FAISS], group: list) -> FAISS:
+        if vectorstore is None:
+            return self._new_store(group)
+        vectorstore.add_embeddings(
+            [(doc.page_content, vector) for (_, doc), vector in group],
+            metadatas=[doc.metadata for (_, doc), _ in group],
+            ids=[chunk_id for (chunk_id, _), _ in group],
+        )
+        return vectorstore
+
+    def _new_store(self, group: list) -> FAISS:
+        vectors = np.stack([vector for _, vector in group])
+        index = create_index(self.index_type, vectors, **self.index_params)
+        docstore = InMemoryDocstore({chunk_id: doc for (chunk_id, doc), _ in group})
+        return FAISS(self.embeddings, index, docstore, {i: chunk_id for i, ((chunk_id, _), _) in enumerate(group)})
+
+    def assemble(self, groups: Iterable[list], progress: BuildProgress) -> Optional[FAISS]:
+        # Trained indexes need every vector up front, collected as compact float32 rows
+        collected = []
+        for group in groups:
+            collected.extend(group)
+            progress.chunks += len(group)
+            progress.report()
+        if not collected:
+            return None
+        print(f"Building {self.index_type} index over {len(collected)} chunks...")
+        return self._new_store(collected)
+
+    def build_bm25(self, vectorstore: Optional[FAISS], path: str) -> Optional[BM25Index]:
+        # Lexical index over exactly the chunks in the vector store, rebuilt when the manifest changes
+        if vectorstore is None:
+            return None
+        signature = hash_text(json.dumps(self.files, sort_keys=True))
+        bm25 = BM25Index.load(path)
+        if bm25 is not None and bm25.signature == signature:
+            return bm25
+
+        print("Building BM25 index...")
+        doc_ids = list(vectorstore.index_to_docstore_id.values())
+        texts = [vectorstore.docstore.search(doc_id).page_content for doc_id in doc_ids]
+        bm25 = BM25Index.build(doc_ids, texts, signature)
+        bm25.save(path)
+        print(f"BM25 index saved with {len(bm25.vocab)} terms over {len(bm25)} chunks")
+        return bm25
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from langchain_openai import OpenAIEmbeddings
+
+    load_dotenv()
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    index_type, index_params = index_settings_from_env()
+    builder = IndexBuilder(
+        os.path.join(base_dir, "data", "jfk_text"),
+        os.path.join(base_dir, "cache", "faiss_store"),
+        OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY")),
+        os.path.join(base_dir, "cache", "embeddings.sqlite3"),
+        index_type=index_type,
+        index_params=index_params,
+        **ingest_settings_from_env(),
+    )
+    store = builder.build()
+    builder.build_bm25(store, os.path.join(base_dir, "cache", "bm25.npz"))
+    builder.embedding_cache.close()
@@ -0,0 +1,95 @@
+import asyncio
+import hashlib
+import json
+import time
+from typing import Optional
+
+from sqlalchemy import select, update
+
+from database import AsyncSessionLocal, change_counters, models
+
+LEADERBOARD_COUNTER = "leaderboard"
+
+
+def bump_leaderboard_version():
+    # Executed inside the vote transaction so the new version commits with the new ratings
+    return (
+        update(change_counters)
+        .where(change_counters.c.name == LEADERBOARD_COUNTER)
+        .values(value=change_counters.c.value + 1)
+        .returning(change_counters.c.value)
+    )
+
+
+class LeaderboardCache:
+    """Serialized leaderboard snapshot tagged with the database change counter.
+
+    Votes in this process invalidate the snapshot directly. Votes in other workers are
+    noticed by re-reading the one-row counter at most every poll_interval seconds, and
+    the models table is queried again when the counter has moved. Writers that don't
+    bump the counter (the frontend's vote action updates models directly) are picked up
+    by reloading anyway once the snapshot is max_age seconds old.
+    """
+
+    def __init__(self, poll_interval: float = 1.0, max_age: float = 5.0):
+        self.poll_interval = poll_interval
+        self.max_age = max_age
+        self.version: Optional[int] = None
+        self.body: bytes = b"[]"
+        self.digest = ""
+        self.reloads = 0
+        self._checked_at = 0.0
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self) -> None:
+        self._checked_at = 0.0
+
+    @property
+    def etag(self) -> str:
+        # The content digest covers changes that didn't move the counter
+        return f'"leaderboard-{self.version}-{self.digest}"'
+
+    async def _current_version(self, db) -> int:
+        version = (await db.execute(
+            select(change_counters.c.value).where(change_counters.c.name == LEADERBOARD_COUNTER)
+        )).scalar()
+        return version or 0
+
+    async def refresh(self) -> None:
+        if time.monotonic() - self._checked_at < self.poll_interval:
+            return
+        async with self._lock:
+            # Another request may have refreshed while we waited for the lock
+            if time.monotonic() - self._checked_at < self.poll_interval:
+                return
+            async with AsyncSessionLocal() as db:
+                # Version first, so the snapshot is never tagged newer than its data
+                version = await self._current_version(db)
+                if version != self.version or time.monotonic() - self._loaded_at >= self.max_age:
+                    rows = (await db.execute(
+                        select(models).order_by(models.c.elo.desc())
+                    )).fetchall()
+                    self.body = json.dumps([
+                        {
+                            "id": row.model_id,
+                            "name": row.name,
+                            "wins": row.wins,
+                            "losses": row.losses,
+                            "draws": row.draws,
+                            "invalid": row.invalid,
+                            "elo": row.elo
+                        }
+                        for row in rows
+                    ]).encode("utf-8")
+                    self.digest = hashlib.sha256(self.body).hexdigest()[:16]
+                    self.version = version
+                    self.reloads += 1
+                    self._loaded_at = time.monotonic()
+            self._checked_at = time.monotonic()
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        if not if_none_match or self.version is None:
+            return False
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return self.etag in tags or "*" in tags
@@ -1,32 +1,73 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field, validator
-from typing import Dict
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field
+from typing import Dict, Optional
+from contextlib import asynccontextmanager
 import os
 from dotenv import load_dotenv
-from langchain_community.vectorstores import FAISS
 from langchain_openai import OpenAIEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import DirectoryLoader
 import httpx
 import json
-import tiktoken
-from sqlalchemy import create_engine, Column, Integer, String, Float, MetaData, Table, select, func, ForeignKey, inspect, DateTime, UniqueConstraint, Boolean
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import bindparam, case, or_, select, func, inspect
 from sqlalchemy.sql import text
 import asyncio
+import hmac
+import math
+from auth_sessions import SessionResolver
+from battle_writer import BattleWriter
+from bm25 import BM25Index
+from hash_embeddings import HashEmbeddings
+from database import AsyncSessionLocal, SessionLocal, async_engine, battles, change_counters, engine, metadata, models, pool_status
+from faiss_index import index_settings_from_env
+from index_builder import IndexBuilder, ingest_settings_from_env, load_mapped_vectorstore
+from leaderboard import LEADERBOARD_COUNTER, LeaderboardCache, bump_leaderboard_version
+from metrics import MetricsMiddleware, registry, stage
+from model_registry import ModelRegistry, UnknownModelError
+from recompute_ratings import METHODS, StaleRatingsError, recompute
+from retrieval import ContextRetriever
+from response_cache import ResponseCache
+from tokens import TokenBudget, acount_tokens, atruncate_to_tokens, count_cache_stats, get_encoding
+from ttl_cache import TTLCache
+from resilience import (
+    AdmissionController, AdmissionSlot, CircuitOpenError, Deadline, KeyedRateLimiter, RateLimitedError,
+    UpstreamPolicy, gather_or_cancel,
+)
+from startup import StartupOnce
+from upstream import OPENROUTER_URL, UpstreamClient
 
 # Load environment variables
 load_dotenv()
 
-# Initialize FastAPI app
-app = FastAPI()
+# Readiness of the components warmed up in the background after the port opens
+startup_state: Dict[str, str] = {"database": "pending", "index": "pending"}
+READY_STATES = {"database": ("ready",), "index": ("ready", "unavailable")}
 
-# Initialize tokenizer for length checks
-tokenizer = tiktoken.get_encoding("cl100k_base")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the port right away and do the slow initialization in the background
+    global upstream
+    upstream = create_upstream_client()
+    warmup_tasks = [
+        asyncio.create_task(warm_up_database()),
+        asyncio.create_task(warm_up_index()),
+        asyncio.create_task(asyncio.to_thread(get_encoding)),
+    ]
+    battle_writer.start()
+    yield
+    for task in warmup_tasks:
+        task.cancel()
+    retriever.close()
+    await upstream.aclose()
+    await battle_writer.close()
+    await async_engine.dispose()
+
+# Initialize FastAPI app
+app = FastAPI(lifespan=lifespan)
 
-def count_tokens(text: str) -> int:
-    return len(tokenizer.encode(text))
+# Shared OpenRouter client, created by the lifespan so it lives on the server's event loop
+upstream = None
 
 # Configure CORS
 app.add_middleware(
@@ -37,148 +78,84 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Added last so it wraps everything, fraction of requests logged as JSON traces
+app.add_middleware(MetricsMiddleware, sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", "0")))
+
 # Initialize battle statistics
 battle_stats: Dict[str, dict] = {}
 
 # ELO rating constant
 K_FACTOR = 32
 
+# RAG paths
+base_dir = os.path.dirname(os.path.abspath(__file__))
+cache_dir = os.getenv("CACHE_DIR", os.path.join(base_dir, "cache"))
+cache_path = os.path.join(cache_dir, "faiss_store")
+embedding_cache_path = os.path.join(cache_dir, "embeddings.sqlite3")
+bm25_path = os.path.join(cache_dir, "bm25.npz")
+data_dir = os.getenv("DATA_DIR", os.path.join(base_dir, "data", "jfk_text"))
+
+# Vector store and lexical index, set once the background warm-up has loaded them
+vectorstore = None
+bm25_index = None
+
+def create_embeddings():
+    # "hash" embeds offline and deterministically, for benchmarks and local runs without an API key
+    if os.getenv("EMBEDDINGS_PROVIDER", "openai") == "hash":
+        return HashEmbeddings(
+            dim=int(os.getenv("HASH_EMBEDDINGS_DIM", "256")),
+            latency=float(os.getenv("HASH_EMBEDDINGS_LATENCY_MS", "0")) / 1000,
+        )
+    return OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"))
+
 # Initialize RAG components
-try:
-    # Setup paths
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    cache_dir = os.path.join(base_dir, "cache")
-    cache_path = os.path.join(cache_dir, "faiss_store")
-    data_dir = os.path.join(base_dir, "data", "jfk_text")
-    
-    print(f"Cache path: {cache_path}")
-    print(f"Data directory: {data_dir}")
-    
-    # Create directories if they don't exist
-    os.makedirs(cache_dir, exist_ok=True)
-    os.makedirs(data_dir, exist_ok=True)
-    
-    if os.path.exists(cache_path):
-        print("Loading vector store from cache...")
-        try:
-            embeddings = OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"))
-            vectorstore = FAISS.load_local(cache_path, embeddings)
-            print("Successfully loaded vector store from cache!")
-        except Exception as e:
-            print(f"Failed to load from cache: {str(e)}")
-            print("Will attempt to recreate vector store...")
-            os.remove(cache_path)  # Remove corrupted cache
-            raise  # Trigger the recreation logic
-    
-    if not os.path.exists(cache_path):
-        # If cache doesn't exist or failed to load, create new vector store
-        print("Creating new vector store...")
-        if not os.path.exists(data_dir):
-            print(f"Warning: Data directory not found: {data_dir}")
-            print("Creating empty data directory...")
-            os.makedirs(data_dir, exist_ok=True)
-            
-        loader = DirectoryLoader(data_dir, glob="**/*.md", show_progress=True)
-        print(f"Loading documents from {data_dir}...")
-        documents = loader.load()
-        print(f"Loaded {len(documents)} documents")
+def build_vectorstore():
+    try:
+        print(f"Cache path: {cache_path}")
+        print(f"Data directory: {data_dir}")
         
-        if not documents:
-            print("Warning: No documents found in data directory")
-            vectorstore = None
-        else:
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1000,
-                chunk_overlap=200,
-                length_function=len,
-                separators=["\n\n", "\n", " ", ""]
-            )
-            print("Splitting documents into chunks...")
-            texts = text_splitter.split_documents(documents)
-            print(f"Created {len(texts)} text chunks")
-            
-            print("Initializing embeddings and vector store...")
-            embeddings = OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"))
-            vectorstore = FAISS.from_documents(texts, embeddings)
-            
-            # Save to cache
-            os.makedirs(cache_dir, exist_ok=True)
-            vectorstore.save_local(cache_path)
-            print("Successfully created and cached vector store!")
-
-except Exception as e:
-    print(f"Warning: Failed to initialize RAG components: {str(e)}")
-    print("Please ensure the data/jfk_text directory exists and contains .md files")
-    vectorstore = None
-
-# Database connection
-DATABASE_URL = os.getenv("DATABASE_URL")
-if not DATABASE_URL:
-    raise Exception("DATABASE_URL environment variable is not set")
-
-print(f"Connecting to database: {DATABASE_URL}")
-engine = create_engine(
-    DATABASE_URL,
-    pool_pre_ping=True,  # Automatically check if connection is valid
-    pool_recycle=3600,   # Connection recycle time (1 hour)
-    pool_size=5,         # Connection pool size
-    max_overflow=10,     # Maximum overflow connections
-    pool_timeout=30,     # Connection timeout
-    connect_args={
-        "connect_timeout": 10,  # Connection timeout
-        "keepalives": 1,        # Enable keepalive
-        "keepalives_idle": 30,  # Keepalive idle time
-        "keepalives_interval": 10,  # Keepalive interval
-        "keepalives_count": 5,   # Keepalive retry count
-    }
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-# Create database tables
-metadata = MetaData()
-
-user = Table(
-    "user",
-    metadata,
-    Column("id", String, primary_key=True),
-    Column("name", String, nullable=False),
-    Column("email", String, nullable=False, unique=True),
-    Column("email_verified", Boolean, nullable=False),
-    Column("image", String, nullable=True),
-    Column("created_at", DateTime, nullable=False),
-    Column("updated_at", DateTime, nullable=False),
-    Column("anonymous", Boolean, nullable=False, default=False),
-)
+        # Create directories if they don't exist
+        os.makedirs(cache_dir, exist_ok=True)
+        os.makedirs(data_dir, exist_ok=True)
+        
+        # Load the cached store and re-embed only the chunks whose content changed
+        embeddings = create_embeddings()
+        index_type, index_params = index_settings_from_env()
+        index_builder = IndexBuilder(
+            data_dir, cache_path, embeddings, embedding_cache_path,
+            index_type=index_type, index_params=index_params, **ingest_settings_from_env(),
+        )
+        try:
+            store = index_builder.build()
+            return store, index_builder.build_bm25(store, bm25_path)
+        finally:
+            index_builder.embedding_cache.close()
 
-models = Table(
-    "models",
-    metadata,
-    Column("id", Integer, primary_key=True),
-    Column("model_id", String),
-    Column("name", String),
-    Column("wins", Integer, default=0),
-    Column("losses", Integer, default=0),
-    Column("draws", Integer, default=0),
-    Column("invalid", Integer, default=0),
-    Column("elo", Float, default=1500.0),
-    Column("user_id", String, ForeignKey("user.id", ondelete="CASCADE"), nullable=True),
-    UniqueConstraint('user_id', 'model_id', name='models_user_id_model_id_key')
-)
+    except Exception as e:
+        print(f"Warning: Failed to initialize RAG components: {str(e)}")
+        print("Please ensure the data/jfk_text directory exists and contains .md files")
+        return None, None
 
-battles = Table(
-    "battles",
-    metadata,
-    Column("id", Integer, primary_key=True),
-    Column("model1_id", Integer, ForeignKey("models.id", ondelete="CASCADE")),
-    Column("model2_id", Integer, ForeignKey("models.id", ondelete="CASCADE")),
-    Column("winner_id", Integer, ForeignKey("models.id", ondelete="CASCADE"), nullable=True),
-    Column("question", String),
-    Column("response1", String),
-    Column("response2", String),
-    Column("result", String, nullable=True),  # 'model1_win', 'model2_win', 'draw', 'invalid'
-    Column("created_at", DateTime, default=func.now()),
-    Column("voted_at", DateTime, nullable=True),
-    Column("user_id", String, ForeignKey("user.id", ondelete="CASCADE"), nullable=True),
+# Share retrieved context across both models of a battle and across repeated questions
+retriever = ContextRetriever(
+    vectorstore,
+    k=int(os.getenv("RETRIEVAL_K", "3")),
+    cache=TTLCache(
+        max_size=int(os.getenv("RETRIEVAL_CACHE_SIZE", "1024")),
+        ttl=float(os.getenv("RETRIEVAL_CACHE_TTL", "3600")),
+    ),
+    search_workers=int(os.getenv("RETRIEVAL_SEARCH_WORKERS", "2")),
+    batched=os.getenv("RETRIEVAL_BATCHED", "true").lower() == "true",
+    max_batch_size=int(os.getenv("RETRIEVAL_MAX_BATCH", "32")),
+    batch_window=float(os.getenv("RETRIEVAL_BATCH_WINDOW_MS", "2")) / 1000,
+    mode=os.getenv("RETRIEVAL_MODE", "hybrid"),
+    fusion_depth=int(os.getenv("RETRIEVAL_FUSION_DEPTH", "20")),
+    # Prompt tokens the retrieved chunks may take, 0 keeps the plain top-k join
+    context_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "1000")),
+    # Over-fetch, drop near-duplicates and reorder by MMR before packing
+    rerank=os.getenv("RETRIEVAL_RERANK", "true").lower() == "true",
+    diversity=float(os.getenv("RETRIEVAL_DIVERSITY", "0.3")),
+    dedup_threshold=float(os.getenv("RETRIEVAL_DEDUP_THRESHOLD", "0.95")),
 )
 
 # Supported model list
@@ -218,32 +195,51 @@ def check_tables_exist():
     inspector = inspect(engine)
     existing_tables = inspector.get_table_names()
     print(f"Existing tables: {existing_tables}")
+    # Anything newer comes from the drizzle migrations, which own the schema
+    missing = [name for name in ("battle_texts", "change_counters") if name not in existing_tables]
+    if missing and "models" in existing_tables:
+        print(f"Missing tables {missing}, run the drizzle migrations (npm run db:migrate in frontend/)")
     return "models" in existing_tables and "battles" in existing_tables
 
 # Initialize models in the database
 def init_models():
+    # One read plus one multi-row insert, however many models are supported. Shared models
+    # have a NULL user_id, which never conflicts on models_user_id_model_id_key, so this
+    # can't be an ON CONFLICT upsert on that constraint.
     with SessionLocal() as db:
         try:
-            for model in SUPPORTED_MODELS:
-                # Check if model exists
-                result = db.execute(
-                    select(models).where(models.c.model_id == model["id"])
-                ).first()
-                if not result:
-                    # If model doesn't exist, add it
-                    db.execute(
-                        models.insert().values(
-                            model_id=model["id"],
-                            name=model["name"],
-                            wins=0,
-                            losses=0,
-                            draws=0,
-                            invalid=0,
-                            elo=1500.0
-                        )
-                    )
+            existing = dict(db.execute(
+                select(models.c.model_id, models.c.name).where(models.c.user_id.is_(None))
+            ).all())
+            missing = [
+                {
+                    "model_id": model["id"],
+                    "name": model["name"],
+                    "wins": 0,
+                    "losses": 0,
+                    "draws": 0,
+                    "invalid": 0,
+                    "elo": 1500.0,
+                }
+                for model in SUPPORTED_MODELS
+                if model["id"] not in existing
+            ]
+            renamed = [
+                {"b_model_id": model["id"], "b_name": model["name"]}
+                for model in SUPPORTED_MODELS
+                if model["id"] in existing and existing[model["id"]] != model["name"]
+            ]
+            if missing:
+                db.execute(models.insert(), missing)
+            if renamed:
+                db.execute(
+                    models.update()
+                    .where(models.c.model_id == bindparam("b_model_id"), models.c.user_id.is_(None))
+                    .values(name=bindparam("b_name")),
+                    renamed,
+                )
             db.commit()
-            print("Models initialized successfully!")
+            print(f"Models initialized successfully! ({len(missing)} added, {len(renamed)} renamed)")
         except Exception as e:
             print(f"Error initializing models: {str(e)}")
             db.rollback()
@@ -265,47 +261,105 @@ def initialize_database():
         
         # Create our application tables
         metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            # Seeded by the drizzle migration on Postgres, here for databases created from metadata
+            if conn.execute(select(change_counters.c.name).where(change_counters.c.name == LEADERBOARD_COUNTER)).first() is None:
+                conn.execute(change_counters.insert().values(name=LEADERBOARD_COUNTER, value=0))
         print("Created new tables")
-        
-        # Initialize models
-        init_models()
         return True
     except Exception as e:
         print(f"Error initializing database: {str(e)}")
         return False
 
-# Test connection and initialize database at startup
-print("Starting database initialization...")
-if test_db_connection():
+# Test connection and initialize database
+def prepare_database() -> bool:
+    print("Starting database initialization...")
+    if not test_db_connection():
+        return False
     if not check_tables_exist():
         print("Tables do not exist. Creating tables...")
         if not initialize_database():
             raise Exception("Failed to initialize database")
     else:
         print("Tables already exist. Skipping initialization.")
-else:
-    raise Exception("Failed to connect to the database")
+    # Cheap enough to run on every start, and picks up models added to SUPPORTED_MODELS
+    init_models()
+    return True
 
-def update_elo(winner_elo: float, loser_elo: float) -> tuple[float, float]:
-    expected_winner = 1 / (1 + 10 ** ((loser_elo - winner_elo) / 400))
-    expected_loser = 1 - expected_winner
-    
-    new_winner_elo = winner_elo + K_FACTOR * (1 - expected_winner)
-    new_loser_elo = loser_elo + K_FACTOR * (0 - expected_loser)
-    
-    return new_winner_elo, new_loser_elo
+async def prepare_database_once() -> bool:
+    # Schema, model rows and spilled battles are handled by one worker, the rest only connect
+    async with StartupOnce("database", cache_dir) as once:
+        if not once.leader:
+            return await asyncio.to_thread(test_db_connection)
+        if not await asyncio.to_thread(prepare_database):
+            return False
+        await replay_spilled_battles()
+        once.done()
+        return True
 
-class BattleRequest(BaseModel):
-    model1: str
-    model2: str
-    question: str
+async def warm_up_database():
+    # Keep retrying so a slow or restarting Postgres doesn't take the process down
+    delay = 1.0
+    while True:
+        try:
+            if await prepare_database_once():
+                await model_registry.load()
+                startup_state["database"] = "ready"
+                return
+            startup_state["database"] = "unavailable"
+        except Exception as e:
+            # Usually transient too, e.g. the connection dropping mid-migration
+            print(f"Database initialization failed, retrying in {delay:.0f}s: {str(e)}")
+            startup_state["database"] = "failed"
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 30.0)
 
-    @validator("question")
-    def validate_question_length(cls, v):
-        tokens = count_tokens(v)
-        if tokens > 500:
-            raise ValueError(f"Question exceeds 500 tokens (current: {tokens})")
-        return v
+async def replay_spilled_battles():
+    try:
+        # Each worker spills to its own file, replay all of them
+        await battle_writer.replay_spill(os.path.join(cache_dir, "pending_battles*.jsonl"))
+    except Exception as e:
+        print(f"Failed to replay spilled battles: {str(e)}")
+
+def load_vectorstore():
+    _, index_params = index_settings_from_env()
+    store = load_mapped_vectorstore(cache_path, create_embeddings(), index_params)
+    return store, BM25Index.load(bm25_path) if store is not None else None
+
+async def warm_up_index():
+    global vectorstore, bm25_index
+    startup_state["index"] = "loading"
+    async with StartupOnce("index", cache_dir) as once:
+        if once.leader:
+            # Brings the files on disk up to date, the in-memory copy it returns is dropped
+            await asyncio.to_thread(build_vectorstore)
+            once.done()
+    # Every worker maps the same files, so the vectors sit in the page cache once
+    vectorstore, bm25_index = await asyncio.to_thread(load_vectorstore)
+    retriever.set_vectorstore(vectorstore, bm25_index)
+    # Battles still run without context when no index could be built
+    startup_state["index"] = "ready" if vectorstore is not None else "unavailable"
+
+def require_ready(*components: str):
+    def dependency():
+        waiting = [name for name in components if startup_state[name] not in READY_STATES[name]]
+        if waiting:
+            raise HTTPException(
+                status_code=503,
+                detail=f"Service is starting up, waiting for: {', '.join(waiting)}",
+                headers={"Retry-After": "5"},
+            )
+    return dependency
+
+MAX_QUESTION_TOKENS = 500
+
+async def check_question_length(question: str) -> None:
+    tokens = await acount_tokens(question)
+    if tokens > MAX_QUESTION_TOKENS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Question exceeds {MAX_QUESTION_TOKENS} tokens (current: {tokens})"
+        )
 
 class VoteRequest(BaseModel):
     result: str  # "model1", "model2", "draw", "invalid"
@@ -313,27 +367,115 @@ class VoteRequest(BaseModel):
     model2: str
     question: str
 
-def get_relevant_context(question: str) -> str:
-    if vectorstore is None:
-        return ""
+async def get_relevant_context(question: str) -> str:
+    return await retriever.aget_context(question)
+
+# OpenRouter completion settings
+TOKEN_BUDGET = 2000
+
+# Total time one battle may spend on upstream calls, retries included
+BATTLE_DEADLINE = float(os.getenv("BATTLE_DEADLINE", "90"))
+
+upstream_policy = UpstreamPolicy(
+    max_retries=int(os.getenv("UPSTREAM_MAX_RETRIES", "2")),
+    backoff_base=float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.5")),
+    backoff_cap=float(os.getenv("UPSTREAM_BACKOFF_CAP", "8")),
+    hedging=os.getenv("UPSTREAM_HEDGING", "false").lower() == "true",
+    hedge_percentile=float(os.getenv("UPSTREAM_HEDGE_PERCENTILE", "95")),
+    failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5")),
+    reset_timeout=float(os.getenv("CIRCUIT_RESET_TIMEOUT", "60")),
+)
+
+# Each battle holds two upstream connections and a database session, so cap how many
+# run at once and turn the rest away quickly instead of letting them pile up. This is a
+# per-worker cap on purpose: the upstream client and DB pool it protects are per worker too,
+# so the server as a whole admits ADMISSION_MAX_IN_FLIGHT x WEB_CONCURRENCY battles.
+battle_admission = AdmissionController(
+    max_in_flight=int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "32")),
+    max_queue=int(os.getenv("ADMISSION_QUEUE_SIZE", "16")),
+    queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2")),
+)
+
+# Worker processes behind the port (serve.py exports it), each with its own limiter state
+WORKER_COUNT = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+
+# Per signed-in or anonymous user, so one client can't take every slot. The configured rate
+# is for the whole server: requests spread over the workers, so each gets an equal share.
+# 0 turns the per-user limit off.
+USER_BATTLES_PER_MINUTE = float(os.getenv("USER_BATTLES_PER_MINUTE", "10"))
+user_rate_limiter = KeyedRateLimiter(
+    rate=USER_BATTLES_PER_MINUTE / 60 / WORKER_COUNT,
+    burst=max(1.0, float(os.getenv("USER_BATTLE_BURST", "5")) / WORKER_COUNT),
+) if USER_BATTLES_PER_MINUTE > 0 else None
+
+# Who a request comes from, per the frontend's session cookie
+sessions = SessionResolver(ttl=float(os.getenv("SESSION_CACHE_TTL", "60")))
+
+# Proxies we run in front of the app that append to X-Forwarded-For, 0 ignores the header.
+# Only the entry the nearest trusted proxy added can be believed, anything before it is client-supplied.
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+
+def client_ip(http_request: Request) -> str:
+    # Fly's edge overwrites Fly-Client-IP, anywhere else a client could set it
+    if os.getenv("FLY_APP_NAME"):
+        fly_ip = http_request.headers.get("fly-client-ip")
+        if fly_ip:
+            return fly_ip
+    if TRUSTED_PROXY_HOPS:
+        forwarded = [hop.strip() for hop in http_request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+        if len(forwarded) >= TRUSTED_PROXY_HOPS:
+            return forwarded[-TRUSTED_PROXY_HOPS]
+    return getattr(http_request.client, "host", "")
+
+async def rate_limit_key(http_request: Request) -> str:
+    # Every browser session has a user, anonymous ones included. Ids in the body are the
+    # client's to choose, so a caller without a valid session is limited by address.
     try:
-        docs = vectorstore.similarity_search(question, k=3)
-        return "\n".join([doc.page_content for doc in docs])
+        user_id = await sessions.user_id(http_request)
     except Exception as e:
-        print(f"Error getting context: {str(e)}")
-        return ""
+        print(f"Session lookup failed, limiting by address: {str(e)}")
+        user_id = None
+    if user_id:
+        return f"user:{user_id}"
+    return f"ip:{client_ip(http_request)}"
 
-async def get_model_response(client: httpx.AsyncClient, model_id: str, question: str) -> str:
-    # Get relevant context from RAG
-    context = get_relevant_context(question)
-    
-    headers = {
-        "Authorization": f"Bearer {os.getenv('OPENROUTER_API_KEY')}",
-        "HTTP-Referer": "https://github.com/OpenRouterStudio/openrouter-py",
-        "X-Title": "JFK Battle Arena",
-        "Content-Type": "application/json"
-    }
-    
+async def admit_battle(http_request: Request) -> AdmissionSlot:
+    try:
+        if user_rate_limiter is not None:
+            user_rate_limiter.check(await rate_limit_key(http_request))
+        with stage("admission"):
+            return await battle_admission.acquire()
+    except RateLimitedError as e:
+        detail = (
+            "Too many battles, please wait a moment before starting another."
+            if e.reason == "user" else "The arena is busy right now. Please try again shortly."
+        )
+        raise HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))})
+
+def create_upstream_client() -> UpstreamClient:
+    return UpstreamClient(
+        os.getenv("OPENROUTER_API_KEY"),
+        url=os.getenv("OPENROUTER_URL", OPENROUTER_URL),
+        http2=os.getenv("UPSTREAM_HTTP2", "true").lower() == "true",
+        max_connections=int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "64")),
+        max_keepalive_connections=int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "32")),
+        keepalive_expiry=float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "60")),
+        connect_timeout=float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5")),
+        read_timeout=float(os.getenv("UPSTREAM_READ_TIMEOUT", "120")),
+        per_model_concurrency=int(os.getenv("UPSTREAM_PER_MODEL_CONCURRENCY", "8")),
+    )
+
+# Bump whenever the prompt below changes so cached responses to the old prompt are not reused
+PROMPT_VERSION = "1"
+
+# Opt-in: identical (model, question, context, prompt) requests reuse one completion
+response_cache = ResponseCache(
+    enabled=os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true",
+    max_size=int(os.getenv("RESPONSE_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", "21600")),
+)
+
+def build_completion_request(model_id: str, question: str, context: str, stream: bool = False) -> dict:
     system_prompt = """You are an AI assistant participating in a battle arena. 
     Your task is to provide the most helpful, accurate, and well-reasoned response to the user's question in a concise manner, using a single natural paragraph without bullet points. 
     If relevant context is provided, incorporate it to inform your answer without merely repeating it; 
@@ -356,16 +498,17 @@ Question: {question}"""
                 "content": user_prompt
             }
         ],
-        "max_tokens": 2000
+        "max_tokens": TOKEN_BUDGET
     }
+    if stream:
+        data["stream"] = True
+    return data
+
+async def get_model_response(upstream: UpstreamClient, model_id: str, question: str, context: str) -> str:
+    data = build_completion_request(model_id, question, context)
     
     try:
-        response = await client.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers=headers,
-            json=data,
-            timeout=120.0
-        )
+        response = await upstream.post_completion(model_id, data)
         
         if not response.is_success:
             error_content = response.text
@@ -377,12 +520,14 @@ Question: {question}"""
         response_data = response.json()
         response_text = response_data["choices"][0]["message"]["content"]
         
-        # Check response length
-        if count_tokens(response_text) > 2000:
-            response_text = response_text[:response_text.rindex(" ", 0, 2000)] + "..."
+        # Cut at a token offset, encoding at most once
+        with stage("truncate_response"):
+            response_text, _ = await atruncate_to_tokens(response_text, TOKEN_BUDGET)
             
         return response_text
         
+    except HTTPException:
+        raise
     except httpx.TimeoutException as e:
         print(f"Timeout error for {model_id}: {str(e)}")
         raise HTTPException(
@@ -404,258 +549,483 @@ Question: {question}"""
             detail=f"Failed to get response from {model_id}: {str(e)}"
         )
 
+# Model id -> primary key map, so requests resolve and validate models without a query
+model_registry = ModelRegistry(refresh_interval=float(os.getenv("MODEL_REGISTRY_REFRESH", "30")))
+
+# Battles are queued and inserted in batches in the background, Postgres only since ids come from its sequence
+battle_writer = BattleWriter(
+    model_registry,
+    write_behind=os.getenv("BATTLE_WRITE_BEHIND", "true").lower() == "true" and engine.dialect.name == "postgresql",
+    queue_size=int(os.getenv("BATTLE_QUEUE_SIZE", "1000")),
+    batch_size=int(os.getenv("BATTLE_FLUSH_BATCH", "100")),
+    flush_interval=float(os.getenv("BATTLE_FLUSH_INTERVAL_MS", "200")) / 1000,
+    id_block_size=int(os.getenv("BATTLE_ID_BLOCK", "50")),
+    spill_path=os.path.join(cache_dir, f"pending_battles.{os.getpid()}.jsonl"),
+    replay_interval=float(os.getenv("BATTLE_REPLAY_INTERVAL", "60")),
+    # How long a vote waits for a battle another worker has queued but not yet flushed
+    miss_timeout=float(os.getenv("BATTLE_MISS_WAIT_MS", "2000")) / 1000,
+)
+
+async def stream_model_response(upstream: UpstreamClient, model_id: str, question: str, context: str, budget: TokenBudget):
+    # Yields text deltas as they arrive and hangs up on the upstream once the budget is spent
+    data = build_completion_request(model_id, question, context, stream=True)
+    async with upstream.stream_completion(model_id, data) as response:
+        if not response.is_success:
+            error_content = (await response.aread()).decode(errors="replace")
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"OpenRouter API error for {model_id}: {error_content}"
+            )
+
+        async for line in response.aiter_lines():
+            # Skip keep-alive comments such as ": OPENROUTER PROCESSING"
+            if not line.startswith("data:"):
+                continue
+            payload = line[len("data:"):].strip()
+            if payload == "[DONE]":
+                break
+
+            chunk = json.loads(payload)
+            if "error" in chunk:
+                raise HTTPException(
+                    status_code=502,
+                    detail=f"OpenRouter API error for {model_id}: {chunk['error']}"
+                )
+            choices = chunk.get("choices") or []
+            delta = (choices[0].get("delta") or {}).get("content") if choices else None
+            if not delta:
+                continue
+
+            accepted = budget.add(delta)
+            if accepted:
+                yield accepted
+            if budget.exhausted:
+                # Leaving the context manager closes the connection, so we stop paying for tokens
+                yield "..."
+                break
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    ready = all(state in READY_STATES[name] for name, state in startup_state.items())
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "starting", **startup_state, "db_pool": pool_status()},
+    )
+
 @app.get("/models")
 async def get_models():
-    return SUPPORTED_MODELS
+    # Models whose circuit is open are flagged so clients can avoid pairing with them
+    return [
+        {**model, "available": upstream_policy.is_available(model["id"])}
+        for model in SUPPORTED_MODELS
+    ]
 
-@app.post("/battle")
-async def battle(request: dict):
+@app.post("/battle", dependencies=[Depends(require_ready("database", "index"))])
+async def battle(request: dict, http_request: Request):
     model1_id = request.get("model1")
     model2_id = request.get("model2")
     question = request.get("question")
+    # Set when a fresh sample is wanted instead of a cached answer
+    bypass_cache = bool(request.get("bypass_cache", False))
 
     if not model1_id or not model2_id or not question:
         raise HTTPException(status_code=400, detail="Missing required fields")
 
+    # Reject unknown models before paying for any completion
     try:
-        async with httpx.AsyncClient(timeout=120.0) as client:  # Increased timeout to 120 seconds
-            # Get responses concurrently
-            response1_task = get_model_response(client, model1_id, question)
-            response2_task = get_model_response(client, model2_id, question)
-            
+        await model_registry.validate(model1_id, model2_id)
+    except UnknownModelError:
+        raise HTTPException(status_code=400, detail="Invalid model ID")
+    with stage("count_question_tokens"):
+        await check_question_length(question)
+
+    async with await admit_battle(http_request):
+        try:
+            # Retrieve context once and share it between both models
+            with stage("context"):
+                context = await get_relevant_context(question)
+
+            # Get responses concurrently, with retries and circuit breaking inside one deadline
+            deadline = Deadline(BATTLE_DEADLINE)
+
+            def cached_call(model_id: str):
+                return response_cache.get_or_compute(
+                    ResponseCache.key(model_id, question, context, PROMPT_VERSION),
+                    lambda: upstream_policy.call(
+                        model_id, lambda: get_model_response(upstream, model_id, question, context), deadline
+                    ),
+                    bypass=bypass_cache,
+                )
+
+            response1_task = cached_call(model1_id)
+            response2_task = cached_call(model2_id)
+        
             try:
-                response1, response2 = await asyncio.gather(response1_task, response2_task)
+                with stage("completions"):
+                    response1, response2 = await gather_or_cancel(response1_task, response2_task)
+            except CircuitOpenError as e:
+                raise HTTPException(
+                    status_code=503,
+                    detail=f"{e.model_id} is temporarily unavailable. Please try another model.",
+                    headers={"Retry-After": str(int(e.retry_after) + 1)},
+                )
+            except asyncio.TimeoutError:
+                raise HTTPException(
+                    status_code=504,
+                    detail="Request timed out. Please try again."
+                )
             except Exception as e:
                 print(f"Error getting model responses: {str(e)}")
                 raise HTTPException(
                     status_code=500,
                     detail="Failed to get responses from one or both models. Please try again."
                 )
-            
-            # Store battle in database with timeout
+        
+            # Reserve the battle id and queue the row, the insert happens in the background
             try:
-                with SessionLocal() as db:
-                    # Get model IDs from database
-                    model1 = db.execute(
-                        select(models).where(models.c.model_id == model1_id)
-                    ).first()
-                    model2 = db.execute(
-                        select(models).where(models.c.model_id == model2_id)
-                    ).first()
-
-                    if not model1 or not model2:
-                        raise HTTPException(status_code=400, detail="Invalid model ID")
-
-                    # Create new battle record
-                    battle_result = db.execute(
-                        battles.insert().values(
-                            model1_id=model1.id,
-                            model2_id=model2.id,
-                            winner_id=None,
-                            question=question,
-                            response1=response1,
-                            response2=response2,
-                            result=None,
-                            created_at=func.now(),
-                            voted_at=None
-                        )
-                    )
-                    db.commit()
-                    battle_id = battle_result.inserted_primary_key[0]
-                
+                with stage("store_battle"):
+                    battle_id = await battle_writer.submit(model1_id, model2_id, question, response1, response2)
+            
                 return {
                     "battle_id": battle_id,
                     "response1": response1,
                     "response2": response2
                 }
+            except UnknownModelError:
+                raise HTTPException(status_code=400, detail="Invalid model ID")
             except Exception as e:
                 print(f"Database error in battle endpoint: {str(e)}")
                 raise HTTPException(
                     status_code=500,
                     detail="Failed to store battle results. Please try again."
                 )
-    except httpx.TimeoutException:
-        raise HTTPException(
-            status_code=504,
-            detail="Request timed out. Please try again with a shorter question."
-        )
-    except Exception as e:
-        print(f"Unexpected error in battle endpoint: {str(e)}")
-        raise HTTPException(
-            status_code=500,
-            detail="An unexpected error occurred. Please try again."
-        )
+        except HTTPException:
+            raise
+        except httpx.TimeoutException:
+            raise HTTPException(
+                status_code=504,
+                detail="Request timed out. Please try again with a shorter question."
+            )
+        except Exception as e:
+            print(f"Unexpected error in battle endpoint: {str(e)}")
+            raise HTTPException(
+                status_code=500,
+                detail="An unexpected error occurred. Please try again."
+            )
 
-@app.post("/vote")
-async def vote(request: dict):
-    result = request.get("result")
+@app.post("/battle/stream", dependencies=[Depends(require_ready("database", "index"))])
+async def battle_stream(request: dict, http_request: Request):
     model1_id = request.get("model1")
     model2_id = request.get("model2")
-    battle_id = request.get("battle_id")
-    
-    if not result or not model1_id or not model2_id or not battle_id:
+    question = request.get("question")
+    bypass_cache = bool(request.get("bypass_cache", False))
+
+    if not model1_id or not model2_id or not question:
         raise HTTPException(status_code=400, detail="Missing required fields")
-    
-    with SessionLocal() as db:
+
+    try:
+        await model_registry.validate(model1_id, model2_id)
+    except UnknownModelError:
+        raise HTTPException(status_code=400, detail="Invalid model ID")
+    with stage("count_question_tokens"):
+        await check_question_length(question)
+
+    # Held until the stream ends, released by whichever of the generator or the response finishes first
+    slot = await admit_battle(http_request)
+    try:
+        with stage("context"):
+            context = await get_relevant_context(question)
+    except BaseException:
+        slot.release()
+        raise
+    deadline = Deadline(BATTLE_DEADLINE)
+
+    async def events():
+        # Both model streams feed one queue, tagged by side, in arrival order
+        queue: asyncio.Queue = asyncio.Queue()
+        responses: Dict[str, str] = {}
+
+        async def pump(side: str, model_id: str):
+            budget = TokenBudget(TOKEN_BUDGET)
+            cache_key = ResponseCache.key(model_id, question, context, PROMPT_VERSION)
+            cached = response_cache.get(cache_key, bypass=bypass_cache)
+            if cached is not None:
+                # A cached answer goes out as a single token event
+                responses[side] = cached
+                await queue.put(("token", side, cached))
+                await queue.put(("done", side, None))
+                return
+            try:
+                deltas = upstream_policy.stream(
+                    model_id, lambda: stream_model_response(upstream, model_id, question, context, budget), deadline
+                )
+                async for delta in deltas:
+                    await queue.put(("token", side, delta))
+                responses[side] = budget.text + ("..." if budget.exhausted else "")
+                response_cache.set(cache_key, responses[side])
+                await queue.put(("done", side, None))
+            except CircuitOpenError:
+                await queue.put(("error", side, f"{model_id} is temporarily unavailable. Please try another model."))
+            except (httpx.TimeoutException, asyncio.TimeoutError):
+                await queue.put(("error", side, f"Request timeout for {model_id}"))
+            except HTTPException as e:
+                await queue.put(("error", side, e.detail))
+            except Exception as e:
+                print(f"Streaming error for {model_id}: {str(e)}")
+                await queue.put(("error", side, f"Failed to get response from {model_id}"))
+
+        tasks = [
+            asyncio.create_task(pump("model1", model1_id)),
+            asyncio.create_task(pump("model2", model2_id)),
+        ]
         try:
-            # Get current status of both models
-            model1 = db.execute(
-                select(models).where(models.c.model_id == model1_id)
-            ).first()
-            model2 = db.execute(
-                select(models).where(models.c.model_id == model2_id)
-            ).first()
-            
-            if not model1 or not model2:
-                raise HTTPException(status_code=404, detail="Model not found")
-            
-            # Update battle record with result
-            battle_result = None
-            winner_id = None
-            if result == "model1":
-                winner_id = model1.id
-                battle_result = "model1_win"
-            elif result == "model2":
-                winner_id = model2.id
-                battle_result = "model2_win"
-            elif result == "draw":
-                battle_result = "draw"
-            else:  # invalid
-                battle_result = "invalid"
-
-            # Update battle record
-            db.execute(
-                battles.update()
-                .where(battles.c.id == battle_id)
+            finished = 0
+            while finished < len(tasks):
+                kind, side, payload = await queue.get()
+                if kind == "token":
+                    yield sse_event("token", {"side": side, "text": payload})
+                elif kind == "done":
+                    finished += 1
+                    yield sse_event("done", {"side": side})
+                else:
+                    # A battle needs both answers, so one failed side ends it
+                    yield sse_event("error", {"side": side, "detail": payload})
+                    return
+
+            # Persist only once both streams have finished
+            try:
+                with stage("store_battle"):
+                    battle_id = await battle_writer.submit(model1_id, model2_id, question, responses["model1"], responses["model2"])
+            except UnknownModelError:
+                yield sse_event("error", {"side": None, "detail": "Invalid model ID"})
+                return
+            except Exception as e:
+                print(f"Database error in battle stream endpoint: {str(e)}")
+                yield sse_event("error", {"side": None, "detail": "Failed to store battle results. Please try again."})
+                return
+            yield sse_event("battle", {"battle_id": battle_id})
+        finally:
+            for task in tasks:
+                task.cancel()
+            slot.release()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(slot.release),
+    )
+
+# Vote results and how they are stored on the battle row
+VOTE_RESULTS = {"model1": "model1_win", "model2": "model2_win", "draw": "draw", "invalid": "invalid"}
+
+class VoteConflict(Exception):
+    pass
+
+async def apply_vote(battle_id: int, result: str, winner_id: Optional[int] = None, user_id: Optional[str] = None) -> None:
+    """Record a vote and update both models in one short transaction.
+
+    The battle row is claimed with a conditional UPDATE, so a second vote on the same
+    battle matches nothing and is refused. Both model rows are then locked in id order
+    and the new ratings are computed by the database from their current values, so
+    concurrent votes on the same model serialize instead of overwriting each other.
+    """
+    claim = [battles.c.id == battle_id, battles.c.result.is_(None)]
+    if winner_id is not None:
+        # The client may show the models flipped, so the winner is named by model rather than side
+        claim.append(or_(battles.c.model1_id == winner_id, battles.c.model2_id == winner_id))
+
+    values = {"result": VOTE_RESULTS[result], "winner_id": winner_id, "voted_at": func.now()}
+    if user_id:
+        # Resolved from the voter's session, never taken from the request body
+        values["user_id"] = user_id
+
+    async with AsyncSessionLocal() as db:
+        claimed = (await db.execute(
+            battles.update()
+            .where(*claim)
+            .values(**values)
+            .returning(battles.c.model1_id, battles.c.model2_id, battles.c.winner_id)
+        )).first()
+
+        if claimed is None:
+            await db.rollback()
+            existing = (await db.execute(
+                select(battles.c.result).where(battles.c.id == battle_id)
+            )).first()
+            if existing is None:
+                raise HTTPException(status_code=404, detail="Battle not found")
+            if existing.result is not None:
+                raise VoteConflict(battle_id)
+            raise HTTPException(status_code=400, detail="Model is not part of this battle")
+
+        pair = (claimed.model1_id, claimed.model2_id)
+        await db.execute(
+            select(models.c.id).where(models.c.id.in_(pair)).order_by(models.c.id).with_for_update()
+        )
+
+        if claimed.winner_id is not None:
+            # Standard ELO, evaluated per row against the other model of the pair
+            opponent = models.alias("opponent")
+            won = case((models.c.id == claimed.winner_id, 1), else_=0)
+            expected = 1.0 / (1.0 + func.power(10.0, (opponent.c.elo - models.c.elo) / 400.0))
+            await db.execute(
+                models.update()
+                .where(models.c.id.in_(pair), opponent.c.id.in_(pair), opponent.c.id != models.c.id)
                 .values(
-                    winner_id=winner_id,
-                    result=battle_result,
-                    voted_at=func.now()  # Use func.now() for timestamp
+                    wins=models.c.wins + won,
+                    losses=models.c.losses + (1 - won),
+                    elo=models.c.elo + K_FACTOR * (won - expected),
                 )
             )
-            
-            # Update statistics
-            if result == "model1":
-                # Update win/loss counts
-                db.execute(
-                    models.update()
-                    .where(models.c.model_id == model1_id)
-                    .values(wins=models.c.wins + 1)
-                )
-                db.execute(
-                    models.update()
-                    .where(models.c.model_id == model2_id)
-                    .values(losses=models.c.losses + 1)
-                )
-                
-                # Calculate new ELO scores
-                r1 = 10 ** (model1.elo / 400)
-                r2 = 10 ** (model2.elo / 400)
-                e1 = r1 / (r1 + r2)
-                e2 = r2 / (r1 + r2)
-                
-                new_elo1 = model1.elo + K_FACTOR * (1 - e1)
-                new_elo2 = model2.elo + K_FACTOR * (0 - e2)
-                
-                # Update ELO scores
-                db.execute(
-                    models.update()
-                    .where(models.c.model_id == model1_id)
-                    .values(elo=new_elo1)
-                )
-                db.execute(
-                    models.update()
-                    .where(models.c.model_id == model2_id)
-                    .values(elo=new_elo2)
-                )
-                
-            elif result == "model2":
-                # Update win/loss counts
-                db.execute(
-                    models.update()
-                    .where(models.c.model_id == model2_id)
-                    .values(wins=models.c.wins + 1)
-                )
-                db.execute(
-                    models.update()
-                    .where(models.c.model_id == model1_id)
-                    .values(losses=models.c.losses + 1)
-                )
-                
-                # Calculate new ELO scores
-                r1 = 10 ** (model1.elo / 400)
-                r2 = 10 ** (model2.elo / 400)
-                e1 = r1 / (r1 + r2)
-                e2 = r2 / (r1 + r2)
-                
-                new_elo1 = model1.elo + K_FACTOR * (0 - e1)
-                new_elo2 = model2.elo + K_FACTOR * (1 - e2)
-                
-                # Update ELO scores
-                db.execute(
-                    models.update()
-                    .where(models.c.model_id == model1_id)
-                    .values(elo=new_elo1)
-                )
-                db.execute(
-                    models.update()
-                    .where(models.c.model_id == model2_id)
-                    .values(elo=new_elo2)
-                )
-                
-            elif result == "draw":
-                # Update draw counts
-                db.execute(
-                    models.update()
-                    .where(models.c.model_id == model1_id)
-                    .values(draws=models.c.draws + 1)
-                )
-                db.execute(
-                    models.update()
-                    .where(models.c.model_id == model2_id)
-                    .values(draws=models.c.draws + 1)
-                )
-                
-            elif result == "invalid":
-                # Update invalid counts
-                db.execute(
-                    models.update()
-                    .where(models.c.model_id == model1_id)
-                    .values(invalid=models.c.invalid + 1)
-                )
-                db.execute(
-                    models.update()
-                    .where(models.c.model_id == model2_id)
-                    .values(invalid=models.c.invalid + 1)
-                )
-            
-            db.commit()
-            return {"status": "success"}
-        except Exception as e:
-            print(f"Error in vote endpoint: {str(e)}")
-            db.rollback()
-            raise HTTPException(status_code=500, detail=str(e))
+        elif result == "draw":
+            await db.execute(
+                models.update().where(models.c.id.in_(pair)).values(draws=models.c.draws + 1)
+            )
+        else:
+            await db.execute(
+                models.update().where(models.c.id.in_(pair)).values(invalid=models.c.invalid + 1)
+            )
 
-@app.get("/leaderboard")
-async def get_leaderboard():
-    with SessionLocal() as db:
-        # Get all models sorted by ELO score in descending order
-        result = db.execute(
-            select(models).order_by(models.c.elo.desc())
-        ).fetchall()
-        
-        return [
-            {
-                "id": row.model_id,
-                "name": row.name,
-                "wins": row.wins,
-                "losses": row.losses,
-                "draws": row.draws,
-                "invalid": row.invalid,
-                "elo": row.elo
-            }
-            for row in result
-        ]
+        # Last statement, so the counter row stays locked only for the commit
+        await db.execute(bump_leaderboard_version())
+        await db.commit()
+
+@app.post("/vote", dependencies=[Depends(require_ready("database"))])
+async def vote(request: dict, http_request: Request):
+    result = request.get("result")
+    model1_id = request.get("model1")
+    model2_id = request.get("model2")
+    battle_id = request.get("battle_id")
+
+    if not result or not model1_id or not model2_id or not battle_id:
+        raise HTTPException(status_code=400, detail="Missing required fields")
+    if result not in VOTE_RESULTS:
+        raise HTTPException(status_code=400, detail=f"Invalid result: {result}")
+    try:
+        battle_id = int(battle_id)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Invalid battle_id: {battle_id}")
+
+    try:
+        model_pks = {"model1": await model_registry.pk(model1_id), "model2": await model_registry.pk(model2_id)}
+    except UnknownModelError:
+        raise HTTPException(status_code=404, detail="Model not found")
+
+    try:
+        with stage("wait_battle_written"):
+            await battle_writer.wait_until_written(battle_id)
+        with stage("apply_vote"):
+            await apply_vote(battle_id, result, model_pks.get(result), await sessions.user_id(http_request))
+        leaderboard_cache.invalidate()
+        return {"status": "success"}
+    except VoteConflict:
+        raise HTTPException(status_code=409, detail="This battle has already been voted on")
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error in vote endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to record vote. Please try again.")
+
+# Polled by every client, so it is served from a snapshot and revalidated with an ETag
+leaderboard_cache = LeaderboardCache(
+    poll_interval=float(os.getenv("LEADERBOARD_POLL_INTERVAL", "1")),
+    max_age=float(os.getenv("LEADERBOARD_MAX_AGE", "5")),
+)
+
+@app.get("/leaderboard", dependencies=[Depends(require_ready("database"))])
+async def get_leaderboard(request: Request):
+    with stage("leaderboard_refresh"):
+        await leaderboard_cache.refresh()
+    headers = {"ETag": leaderboard_cache.etag, "Cache-Control": "no-cache"}
+    if leaderboard_cache.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=leaderboard_cache.body, media_type="application/json", headers=headers)
+
+# Admin endpoints are off unless a token is configured
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN or not hmac.compare_digest(x_admin_token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+@app.post("/admin/ratings/recompute", dependencies=[Depends(require_admin), Depends(require_ready("database"))])
+async def recompute_ratings(request: dict):
+    # Without "write" this is a dry run that only reports the recomputed ratings
+    method = request.get("write")
+    if method is not None and method not in METHODS:
+        raise HTTPException(status_code=400, detail=f"write must be one of {', '.join(METHODS)}")
+    try:
+        report = await asyncio.to_thread(
+            recompute,
+            k=float(request.get("k", K_FACTOR)),
+            method=method,
+            bootstrap_rounds=int(request.get("bootstrap", 1000)),
+            confidence=float(request.get("confidence", 0.95)),
+        )
+    except StaleRatingsError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if method is not None:
+        leaderboard_cache.invalidate()
+    return report
+
+def collect_metrics() -> list:
+    # Counters the components keep themselves, read only when scraped
+    caches = {
+        "retrieval": retriever.cache.stats(),
+        "response": response_cache.stats(),
+        "token_count": count_cache_stats(),
+    }
+    writer = battle_writer.stats()
+    policy = upstream_policy.stats()
+    pool = pool_status()
+    admission = battle_admission.stats()
+    return [
+        ("arena_cache_hits_total", "counter", "Cache lookups served from the cache", ("cache",),
+         [((name,), stats["hits"]) for name, stats in caches.items()]),
+        ("arena_cache_misses_total", "counter", "Cache lookups that missed", ("cache",),
+         [((name,), stats["misses"]) for name, stats in caches.items()]),
+        ("arena_cache_entries", "gauge", "Entries held per cache", ("cache",),
+         [((name,), stats["size"]) for name, stats in caches.items()]),
+        ("arena_response_cache_coalesced_total", "counter", "Completions shared with an identical in-flight request", (),
+         [((), caches["response"]["coalesced"])]),
+        ("arena_battle_queue_depth", "gauge", "Battles waiting for the background writer", (),
+         [((), writer["queued"])]),
+        ("arena_battles_written_total", "counter", "Battles stored, by path", ("path",),
+         [(("batched",), writer["written"]), (("inline",), writer["inline"]), (("spilled",), writer["spilled"])]),
+        ("arena_upstream_retries_total", "counter", "Upstream retries", (), [((), policy["retries"])]),
+        ("arena_upstream_hedges_total", "counter", "Hedged upstream requests", (), [((), policy["hedges"])]),
+        ("arena_upstream_circuit_open", "gauge", "1 while a model's circuit is not closed", ("model_id",),
+         [((model_id,), circuit["state"] != "closed") for model_id, circuit in policy["circuits"].items()]),
+        ("arena_upstream_in_flight", "gauge", "Upstream calls holding a per-model slot", ("model_id",),
+         [((model_id,), count) for model_id, count in upstream.in_flight().items()] if upstream is not None else []),
+        ("arena_admission_in_flight", "gauge", "Battles holding an admission slot", (),
+         [((), admission["in_flight"])]),
+        ("arena_admission_queued", "gauge", "Battles waiting for an admission slot", (),
+         [((), admission["queued"])]),
+        ("arena_admission_rejected_total", "counter", "Battles refused with 429, by reason", ("reason",),
+         [(("overloaded",), admission["rejected"]), (("user",), user_rate_limiter.rejected if user_rate_limiter is not None else 0)]),
+        ("arena_db_pool_checked_out", "gauge", "Connections checked out of the async pool", (),
+         [((), pool["checked_out"])] if "checked_out" in pool else []),
+    ]
+
+registry.collector(collect_metrics)
+
+# Open unless a token is set, Prometheus sends it as a bearer token
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+@app.get("/metrics")
+async def get_metrics(authorization: Optional[str] = Header(None)):
+    if METRICS_TOKEN and not hmac.compare_digest(authorization or "", f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return Response(content=registry.render(), media_type="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     import uvicorn
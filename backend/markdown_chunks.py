@@ -0,0 +1,118 @@
+"""Markdown files to plain-text chunks, run in worker processes during index builds.
+
+A handful of regular expressions covers the markdown in the corpus (headings, lists,
+emphasis, links, tables) at a fraction of the cost of a full document partitioner.
+Kept free of the vector store and tokenizer imports so worker processes start quickly.
+"""
+import re
+from functools import lru_cache
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+# Part of the index manifest, bump whenever the text produced below changes
+PARSER_VERSION = "markdown-1"
+
+FRONT_MATTER = re.compile(r"\A---\n.*?\n---\n", re.DOTALL)
+COMMENT = re.compile(r"<!--.*?-->", re.DOTALL)
+FENCE = re.compile(r"^\s*(```|~~~)")
+HEADING = re.compile(r"^\s{0,3}#{1,6}\s+(.*?)\s*#*\s*$")
+SETEXT_UNDERLINE = re.compile(r"^\s{0,3}(=+|-+)\s*$")
+RULE = re.compile(r"^\s{0,3}([-*_])(\s*\1){2,}\s*$")
+LIST_ITEM = re.compile(r"^\s*(?:[-*+]|\d+[.)])\s+(?:\[[ xX]\]\s+)?")
+QUOTE = re.compile(r"^\s*(?:>\s?)+")
+TABLE_DIVIDER = re.compile(r"^\s*\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$")
+IMAGE = re.compile(r"!\[([^\]]*)\]\([^)]*\)")
+LINK = re.compile(r"\[([^\]]+)\]\([^)]*\)")
+REFERENCE_LINK = re.compile(r"\[([^\]]+)\]\[[^\]]*\]")
+LINK_DEFINITION = re.compile(r"^\s{0,3}\[[^\]]+\]:\s+\S+")
+EMPHASIS = re.compile(r"(?<!\\)(\*\*|\*|~~)(?=\S)(.+?)(?<=[^\s\\])\1")
+# Underscores inside words (file_names, ids) are not emphasis
+UNDERSCORE_EMPHASIS = re.compile(r"(?<![\w\\])(__|_)(?=\S)(.+?)(?<=\S)\1(?!\w)")
+INLINE_CODE = re.compile(r"`+([^`]+)`+")
+TAG = re.compile(r"</?[a-zA-Z][^>]*>")
+ESCAPE = re.compile(r"\\([\\`*_{}\[\]()#+\-.!|>])")
+
+
+def _inline(text: str) -> str:
+    text = IMAGE.sub(r"\1", text)
+    text = LINK.sub(r"\1", text)
+    text = REFERENCE_LINK.sub(r"\1", text)
+    text = INLINE_CODE.sub(r"\1", text)
+    text = EMPHASIS.sub(r"\2", text)
+    text = UNDERSCORE_EMPHASIS.sub(r"\2", text)
+    text = TAG.sub("", text)
+    return ESCAPE.sub(r"\1", text).strip()
+
+
+def parse_markdown(text: str) -> str:
+    """Plain text with one block per paragraph, heading, list item or table row.
+
+    Blocks are separated by blank lines and the lines of a paragraph are joined with
+    spaces, so the splitter's paragraph separator lines up with the document structure.
+    """
+    text = FRONT_MATTER.sub("", text.replace("\r\n", "\n"))
+    text = COMMENT.sub("", text)
+
+    blocks, paragraph, code = [], [], []
+    in_fence = False
+
+    def flush():
+        if paragraph:
+            blocks.append(" ".join(paragraph))
+            paragraph.clear()
+
+    for line in text.split("\n"):
+        if FENCE.match(line):
+            flush()
+            if in_fence:
+                # Code keeps its line breaks, one block per fence
+                blocks.append("\n".join(code))
+                code.clear()
+            in_fence = not in_fence
+            continue
+        if in_fence:
+            code.append(line.rstrip())
+            continue
+
+        line = QUOTE.sub("", line)
+        if not line.strip() or RULE.match(line) or TABLE_DIVIDER.match(line) or LINK_DEFINITION.match(line):
+            flush()
+            continue
+        if paragraph and SETEXT_UNDERLINE.match(line):
+            flush()
+            continue
+
+        heading = HEADING.match(line)
+        if heading:
+            flush()
+            blocks.append(_inline(heading.group(1)))
+        elif LIST_ITEM.match(line):
+            flush()
+            paragraph.append(_inline(LIST_ITEM.sub("", line)))
+        elif "|" in line and line.strip().startswith("|"):
+            flush()
+            blocks.append(" ".join(_inline(cell) for cell in line.strip().strip("|").split("|") if cell.strip()))
+        else:
+            paragraph.append(_inline(line))
+    flush()
+    blocks.append("\n".join(code))
+
+    return "\n\n".join(block for block in blocks if block.strip())
+
+
+@lru_cache(maxsize=None)
+def _splitter(chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        separators=["\n\n", "\n", " ", ""]
+    )
+
+
+def chunk_markdown_file(path: str, chunk_size: int, chunk_overlap: int) -> list[tuple[str, dict]]:
+    # (text, metadata) pairs, plain data so they pickle cheaply back to the parent
+    with open(path, encoding="utf-8", errors="replace") as f:
+        text = parse_markdown(f.read())
+    # Token counts are added by the parent, so workers never load the tokenizer
+    return [(chunk, {"source": path}) for chunk in _splitter(chunk_size, chunk_overlap).split_text(text)]
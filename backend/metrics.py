@@ -0,0 +1,207 @@
+"""In-process Prometheus metrics and sampled request traces.
+
+Histograms are recorded on the hot path with one lock per metric and
+rendered in the Prometheus text format by /metrics. Stats that components already
+keep (cache hits, queue depth, pool usage) are read at scrape time by collectors
+instead of being counted twice. Every process has its own registry.
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+# Seconds, from a cached leaderboard read to a slow completion
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # Per label set: count per bucket (the last one is +Inf), then the sum
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(label_values, list(counts), total) for label_values, (counts, total) in self._series.items()]
+        for label_values, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), label_values + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, label_values)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labels, label_values)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list = []
+        # Each returns (name, type, help, labels, [(label values, value)]) for scrape-time values
+        self.collectors: list[Callable[[], list]] = []
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, collect: Callable[[], list]) -> None:
+        self.collectors.append(collect)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collect in self.collectors:
+            try:
+                families = collect()
+            except Exception as e:
+                print(f"Metrics collector failed: {str(e)}")
+                continue
+            for name, kind, help, labels, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for label_values, value in samples:
+                    lines.append(f"{name}{_labels(labels, label_values)} {float(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    "arena_request_seconds", "HTTP request duration, streamed bodies included", ("method", "route", "status")
+)
+STAGE_SECONDS = registry.histogram("arena_stage_seconds", "Time spent in each stage of a request", ("stage",))
+UPSTREAM_QUEUE_SECONDS = registry.histogram(
+    "arena_upstream_queue_seconds", "Wait for a per-model upstream slot", ("model_id",)
+)
+UPSTREAM_FIRST_BYTE_SECONDS = registry.histogram(
+    "arena_upstream_first_byte_seconds", "Upstream time to response headers", ("model_id",)
+)
+UPSTREAM_SECONDS = registry.histogram(
+    "arena_upstream_seconds", "Upstream call duration, body included", ("model_id", "status")
+)
+DB_POOL_WAIT_SECONDS = registry.histogram(
+    "arena_db_pool_wait_seconds", "Connection pool checkout time, opening new connections included", ("engine",)
+)
+
+# Set by the middleware for the sampled requests only
+current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+
+
+class Trace:
+    """Spans of one sampled request, logged as a single JSON line when it completes."""
+
+    def __init__(self, method: str, path: str):
+        self.id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.spans: list[dict] = []
+
+    def add(self, name: str, started: float, seconds: float, **labels) -> None:
+        self.spans.append({
+            "name": name,
+            "start_ms": round((started - self.started) * 1000, 2),
+            "ms": round(seconds * 1000, 2),
+            **labels,
+        })
+
+    def log(self, status: int, seconds: float) -> None:
+        print(json.dumps({
+            "trace_id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": status,
+            "ms": round(seconds * 1000, 2),
+            "spans": sorted(self.spans, key=lambda span: span["start_ms"]),
+        }))
+
+
+def record(histogram: Histogram, started: float, *label_values, span: Optional[str] = None) -> float:
+    # Observes the time since started, and adds it to the request's trace when sampled
+    seconds = time.perf_counter() - started
+    histogram.observe(seconds, *label_values)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(span or histogram.name, started, seconds, **dict(zip(histogram.labels, label_values)))
+    return seconds
+
+
+@contextmanager
+def stage(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        STAGE_SECONDS.observe(seconds, name)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add(name, started, seconds)
+
+
+class MetricsMiddleware:
+    """Plain ASGI middleware, so streamed responses pass through untouched.
+
+    Requests are labeled by route template rather than raw path to keep the label
+    set bounded, and sample_rate of them are traced.
+    """
+
+    def __init__(self, app, sample_rate: float = 0.0):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = 500
+        trace = Trace(scope["method"], scope["path"]) if self.sample_rate and random.random() < self.sample_rate else None
+        token = current_trace.set(trace)
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            seconds = time.perf_counter() - started
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_SECONDS.observe(seconds, scope["method"], route, str(status))
+            if trace is not None:
+                trace.log(status, seconds)
+            current_trace.reset(token)
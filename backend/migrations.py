@@ -0,0 +1,79 @@
+"""Data backfills for databases created by earlier versions of the backend.
+
+Schema changes are drizzle migrations in frontend/src/db/migrations, apply them
+first. Backfills can take a while on a large table, so they run from the command
+line in small committed batches and can be stopped and resumed at any point:
+
+    python migrations.py backfill-battle-texts --batch-size 500
+"""
+import argparse
+import time
+
+from sqlalchemy import bindparam, or_, select
+
+from battle_texts import TEXT_COLUMNS, hash_text, insert_texts, select_text_ids, text_rows
+from database import battles, engine
+
+
+def backfill_battle_texts(batch_size: int = 500, pause: float = 0.0) -> int:
+    """Move inline question/response text of older battles into battle_texts."""
+    legacy = or_(*(battles.c[column].is_not(None) for column in TEXT_COLUMNS))
+    moved = 0
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(battles.c.id, *(battles.c[column] for column in TEXT_COLUMNS))
+                .where(battles.c.id > last_id, legacy)
+                .order_by(battles.c.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+
+            texts = text_rows(row._mapping[column] for row in rows for column in TEXT_COLUMNS if row._mapping[column] is not None)
+            conn.execute(insert_texts(engine.dialect.name), list(texts.values()))
+            ids = dict(conn.execute(select_text_ids(texts)).all())
+
+            updates = []
+            for row in rows:
+                update = {"b_id": row.id}
+                for column, id_column in TEXT_COLUMNS.items():
+                    value = row._mapping[column]
+                    update[f"b_{id_column}"] = ids[hash_text(value)] if value is not None else None
+                updates.append(update)
+            conn.execute(
+                battles.update()
+                .where(battles.c.id == bindparam("b_id"))
+                .values(
+                    **{id_column: bindparam(f"b_{id_column}") for id_column in TEXT_COLUMNS.values()},
+                    **{column: None for column in TEXT_COLUMNS},
+                ),
+                updates,
+            )
+
+        moved += len(rows)
+        last_id = rows[-1].id
+        print(f"Backfilled {moved} battles (up to id {last_id})")
+        if pause:
+            # Leave room for live traffic between batches
+            time.sleep(pause)
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    backfill = sub.add_parser("backfill-battle-texts", help="move inline battle text into battle_texts")
+    backfill.add_argument("--batch-size", type=int, default=500)
+    backfill.add_argument("--pause", type=float, default=0.0, help="seconds to sleep between batches")
+    args = parser.parse_args()
+
+    if args.command == "backfill-battle-texts":
+        started = time.perf_counter()
+        moved = backfill_battle_texts(args.batch_size, args.pause)
+        print(f"Moved text of {moved} battles in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+from sqlalchemy import select
+
+from database import AsyncSessionLocal, models
+
+
+class UnknownModelError(Exception):
+    pass
+
+
+class ModelRegistry:
+    """In-process map from OpenRouter model ids to models table primary keys.
+
+    Loaded once the database is ready, so battles and votes resolve and validate model
+    ids without a query. An unknown id triggers a reload, at most once per
+    refresh_interval, to pick up models added by another process.
+    """
+
+    def __init__(self, refresh_interval: float = 30.0):
+        self.refresh_interval = refresh_interval
+        self._pks: dict[str, int] = {}
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._pks)
+
+    def __contains__(self, model_id: str) -> bool:
+        return model_id in self._pks
+
+    async def load(self) -> None:
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                # Shared arena models only, per-user rows reuse the same model ids
+                select(models.c.model_id, models.c.id).where(models.c.user_id.is_(None))
+            )).all()
+        self._pks = {row.model_id: row.id for row in rows}
+        self._loaded_at = time.monotonic()
+        print(f"Model registry loaded {len(self._pks)} models")
+
+    async def pk(self, model_id: str) -> int:
+        pk = self._pks.get(model_id)
+        if pk is not None:
+            return pk
+        async with self._lock:
+            if model_id not in self._pks and time.monotonic() - self._loaded_at >= self.refresh_interval:
+                await self.load()
+        pk = self._pks.get(model_id)
+        if pk is None:
+            raise UnknownModelError(model_id)
+        return pk
+
+    async def validate(self, *model_ids: str) -> None:
+        for model_id in model_ids:
+            await self.pk(model_id)
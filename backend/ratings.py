@@ -0,0 +1,107 @@
+"""Rating computations over the full battle history.
+
+Battles are given as parallel arrays: model1 and model2 are dense model indices and
+outcome is one of the OUTCOME_* codes below. Everything except the ELO replay works
+on per-pair outcome counts, so its cost does not grow with the number of battles.
+"""
+import numpy as np
+
+OUTCOME_MODEL1 = 0
+OUTCOME_MODEL2 = 1
+OUTCOME_DRAW = 2
+OUTCOME_INVALID = 3
+
+BASE_RATING = 1500.0
+
+
+def outcome_counts(model1: np.ndarray, model2: np.ndarray, outcome: np.ndarray, n_models: int) -> dict:
+    # wins/losses/draws/invalid per model, matching the counters /vote maintains
+    def tally(first: np.ndarray, second: np.ndarray) -> np.ndarray:
+        return np.bincount(first, minlength=n_models) + np.bincount(second, minlength=n_models)
+
+    m1_won = outcome == OUTCOME_MODEL1
+    m2_won = outcome == OUTCOME_MODEL2
+    draw = outcome == OUTCOME_DRAW
+    invalid = outcome == OUTCOME_INVALID
+    return {
+        "wins": tally(model1[m1_won], model2[m2_won]),
+        "losses": tally(model1[m2_won], model2[m1_won]),
+        "draws": tally(model1[draw], model2[draw]),
+        "invalid": tally(model1[invalid], model2[invalid]),
+    }
+
+
+def elo_replay(model1: np.ndarray, model2: np.ndarray, outcome: np.ndarray, n_models: int, k: float = 32.0) -> np.ndarray:
+    """Replays the live /vote update in order: only decisive votes move ratings."""
+    # Each update depends on the previous one, so this is inherently sequential. It runs
+    # over plain Python lists of the decisive votes, which is about a second per million.
+    decisive = outcome <= OUTCOME_MODEL2
+    winners = np.where(outcome[decisive] == OUTCOME_MODEL1, model1[decisive], model2[decisive]).tolist()
+    losers = np.where(outcome[decisive] == OUTCOME_MODEL1, model2[decisive], model1[decisive]).tolist()
+    ratings = [BASE_RATING] * n_models
+    for w, l in zip(winners, losers):
+        expected = 1.0 / (1.0 + 10.0 ** ((ratings[l] - ratings[w]) / 400.0))
+        ratings[w] += k * (1.0 - expected)
+        ratings[l] -= k * (1.0 - expected)
+    return np.asarray(ratings)
+
+
+def pair_cells(model1: np.ndarray, model2: np.ndarray, outcome: np.ndarray, n_models: int) -> np.ndarray:
+    # Battles collapsed into counts per (model1, model2, outcome) cell, invalid votes dropped
+    valid = outcome != OUTCOME_INVALID
+    flat = (model1[valid] * n_models + model2[valid]) * 3 + outcome[valid]
+    return np.bincount(flat, minlength=n_models * n_models * 3).astype(np.float64)
+
+
+def win_matrix(cells: np.ndarray, n_models: int) -> np.ndarray:
+    # wins[i, j] = times i beat j, a draw counts half a win for each side
+    cells = cells.reshape(n_models, n_models, 3)
+    wins = cells[:, :, OUTCOME_MODEL1] + cells[:, :, OUTCOME_MODEL2].T
+    draws = cells[:, :, OUTCOME_DRAW] + cells[:, :, OUTCOME_DRAW].T
+    return wins + draws / 2
+
+
+def bradley_terry(wins: np.ndarray, prior: float = 0.5, max_iter: int = 1000, tol: float = 1e-9) -> np.ndarray:
+    """Maximum-likelihood Bradley-Terry ratings on the ELO scale (Hunter's MM algorithm).
+
+    prior adds that many virtual draws to every pair that played, which keeps models
+    with no wins (or no losses) finite. Models that never played stay at BASE_RATING.
+    """
+    games = wins + wins.T
+    played = games > 0
+    wins = wins + prior * played
+    games = wins + wins.T
+    active = games.sum(axis=1) > 0
+    total_wins = wins.sum(axis=1)
+
+    strength = np.ones(len(wins))
+    for _ in range(max_iter):
+        denom = (games / (strength[:, None] + strength[None, :])).sum(axis=1)
+        updated = np.where(active, total_wins / np.where(denom > 0, denom, 1.0), 1.0)
+        # Only differences are identified, pin the geometric mean of active models to 1
+        updated /= np.exp(np.log(updated[active]).mean()) if active.any() else 1.0
+        if np.max(np.abs(updated - strength)) < tol:
+            strength = updated
+            break
+        strength = updated
+
+    return np.where(active, BASE_RATING + 400.0 * np.log10(strength), BASE_RATING)
+
+
+def bootstrap_bradley_terry(
+    cells: np.ndarray, n_models: int, rounds: int = 1000, confidence: float = 0.95, prior: float = 0.5, seed: int = 0
+) -> tuple[np.ndarray, np.ndarray]:
+    """Percentile confidence intervals for bradley_terry().
+
+    Resampling N battles with replacement is the same as drawing the cell counts from a
+    multinomial over the observed cell frequencies, which avoids touching N rows per round.
+    """
+    rng = np.random.default_rng(seed)
+    total = int(cells.sum())
+    if total == 0:
+        base = np.full(n_models, BASE_RATING)
+        return base, base
+    samples = rng.multinomial(total, cells / total, size=rounds)
+    ratings = np.stack([bradley_terry(win_matrix(sample, n_models), prior=prior) for sample in samples])
+    alpha = (1 - confidence) / 2
+    return np.quantile(ratings, alpha, axis=0), np.quantile(ratings, 1 - alpha, axis=0)
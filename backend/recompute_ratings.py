@@ -0,0 +1,207 @@
+"""Recompute model ratings from the full battle history.
+
+Streams every voted battle from the database (ids and outcome only, never the
+response text), replays ELO in vote order, fits Bradley-Terry with bootstrap
+confidence intervals, and optionally writes ratings and win/loss counters back
+in one transaction.
+
+    python recompute_ratings.py --k 32 --method elo --write
+"""
+import argparse
+import json
+import time
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import bindparam, case, select
+
+from database import battles, change_counters, engine, models
+from leaderboard import LEADERBOARD_COUNTER, bump_leaderboard_version
+from ratings import (
+    OUTCOME_DRAW,
+    OUTCOME_INVALID,
+    OUTCOME_MODEL1,
+    OUTCOME_MODEL2,
+    bootstrap_bradley_terry,
+    bradley_terry,
+    elo_replay,
+    outcome_counts,
+    pair_cells,
+    win_matrix,
+)
+
+METHODS = ("elo", "bt")
+
+
+class StaleRatingsError(Exception):
+    pass
+
+
+def load_battles(conn, chunk_size: int = 100_000) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Outcomes are encoded in SQL so each fetched chunk converts to an array in one call.
+    # result is relative to the order the client showed the models in, which may be
+    # flipped, so the winner comes from winner_id like in /vote.
+    outcome = case(
+        (battles.c.winner_id == battles.c.model1_id, OUTCOME_MODEL1),
+        (battles.c.winner_id == battles.c.model2_id, OUTCOME_MODEL2),
+        (battles.c.result == "draw", OUTCOME_DRAW),
+        else_=OUTCOME_INVALID,
+    )
+    result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(
+        select(battles.c.model1_id, battles.c.model2_id, outcome)
+        .where(battles.c.result.is_not(None))
+        .order_by(battles.c.voted_at, battles.c.id)
+    )
+    chunks = [np.asarray(part, dtype=np.int64) for part in result.partitions()]
+    rows = np.concatenate(chunks) if chunks else np.empty((0, 3), dtype=np.int64)
+    return rows[:, 0], rows[:, 1], rows[:, 2]
+
+
+def compute(k: float = 32.0, bootstrap_rounds: int = 1000, confidence: float = 0.95, prior: float = 0.5) -> dict:
+    started = time.perf_counter()
+    with engine.connect() as conn:
+        # Version first, so a vote landing during the read is caught when writing back
+        version = conn.execute(
+            select(change_counters.c.value).where(change_counters.c.name == LEADERBOARD_COUNTER)
+        ).scalar() or 0
+        # Only the global rows, per-user rows belong to the personal leaderboards
+        model_rows = conn.execute(
+            select(models.c.id, models.c.model_id, models.c.name)
+            .where(models.c.user_id.is_(None))
+            .order_by(models.c.id)
+        ).all()
+        model1_pk, model2_pk, outcome = load_battles(conn)
+    loaded = time.perf_counter()
+
+    # Primary keys to dense 0..n-1 indices, dropping battles that point at any other row
+    pks = np.asarray([row.id for row in model_rows], dtype=np.int64)
+    n = len(pks)
+    known = np.isin(model1_pk, pks) & np.isin(model2_pk, pks)
+    model1_pk, model2_pk, outcome = model1_pk[known], model2_pk[known], outcome[known]
+    model1 = np.searchsorted(pks, model1_pk)
+    model2 = np.searchsorted(pks, model2_pk)
+
+    elo = elo_replay(model1, model2, outcome, n, k=k)
+    cells = pair_cells(model1, model2, outcome, n)
+    bt = bradley_terry(win_matrix(cells, n), prior=prior)
+    low, high = bootstrap_bradley_terry(cells, n, rounds=bootstrap_rounds, confidence=confidence, prior=prior)
+    counts = outcome_counts(model1, model2, outcome, n)
+
+    ratings = [
+        {
+            "pk": int(pks[i]),
+            "id": row.model_id,
+            "name": row.name,
+            "elo": float(elo[i]),
+            "bt": float(bt[i]),
+            "bt_low": float(low[i]),
+            "bt_high": float(high[i]),
+            **{name: int(values[i]) for name, values in counts.items()},
+        }
+        for i, row in enumerate(model_rows)
+    ]
+    ratings.sort(key=lambda r: r["bt"], reverse=True)
+    return {
+        "version": int(version),
+        "battles": int(len(outcome)),
+        "k": k,
+        "confidence": confidence,
+        "load_s": round(loaded - started, 3),
+        "compute_s": round(time.perf_counter() - loaded, 3),
+        "ratings": ratings,
+    }
+
+
+def write_back(report: dict, method: str = "elo") -> int:
+    """Store the recomputed ratings and counters, refusing if any vote landed since the read."""
+    if method not in METHODS:
+        raise ValueError(f"Unknown method: {method}")
+    with engine.begin() as conn:
+        # Same lock order as /vote (models by id, then the counter), so the two can't deadlock
+        conn.execute(select(models.c.id).where(models.c.user_id.is_(None)).order_by(models.c.id).with_for_update())
+        version = conn.execute(
+            select(change_counters.c.value)
+            .where(change_counters.c.name == LEADERBOARD_COUNTER)
+            .with_for_update()
+        ).scalar() or 0
+        if version != report["version"]:
+            raise StaleRatingsError(f"Votes arrived since the ratings were computed ({report['version']} -> {version})")
+
+        conn.execute(
+            models.update()
+            .where(models.c.id == bindparam("b_pk"), models.c.user_id.is_(None))
+            .values(
+                elo=bindparam("b_elo"),
+                wins=bindparam("b_wins"),
+                losses=bindparam("b_losses"),
+                draws=bindparam("b_draws"),
+                invalid=bindparam("b_invalid"),
+            ),
+            [
+                {
+                    "b_pk": r["pk"],
+                    "b_elo": r[method],
+                    "b_wins": r["wins"],
+                    "b_losses": r["losses"],
+                    "b_draws": r["draws"],
+                    "b_invalid": r["invalid"],
+                }
+                for r in report["ratings"]
+            ],
+        )
+        return conn.execute(bump_leaderboard_version()).scalar()
+
+
+def recompute(
+    k: float = 32.0,
+    method: Optional[str] = None,
+    bootstrap_rounds: int = 1000,
+    confidence: float = 0.95,
+    attempts: int = 3,
+) -> dict:
+    # Recompute and write back, starting over if votes keep landing in between
+    for attempt in range(attempts):
+        report = compute(k=k, bootstrap_rounds=bootstrap_rounds, confidence=confidence)
+        if method is None:
+            return report
+        try:
+            report["written"] = method
+            report["version"] = write_back(report, method)
+            return report
+        except StaleRatingsError as e:
+            print(f"{e}, retrying ({attempt + 1}/{attempts})")
+    raise StaleRatingsError("Votes kept arriving while recomputing, try again later")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--k", type=float, default=32.0, help="ELO K factor for the replay")
+    parser.add_argument("--method", choices=METHODS, default="elo", help="rating to store in models.elo")
+    parser.add_argument("--bootstrap", type=int, default=1000, help="bootstrap rounds for the confidence intervals")
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--write", action="store_true", help="write ratings and counters back to the database")
+    parser.add_argument("--output", help="write the full report as JSON to this path")
+    args = parser.parse_args()
+
+    report = recompute(
+        k=args.k,
+        method=args.method if args.write else None,
+        bootstrap_rounds=args.bootstrap,
+        confidence=args.confidence,
+    )
+    print(f"{report['battles']} battles, loaded in {report['load_s']}s, computed in {report['compute_s']}s")
+    print(f"{'model':<48} {'elo':>8} {'bt':>8} {'ci':>17} {'W':>6} {'L':>6} {'D':>6}")
+    for r in report["ratings"]:
+        ci = f"{r['bt_low']:.0f}..{r['bt_high']:.0f}"
+        print(f"{r['id']:<48} {r['elo']:>8.1f} {r['bt']:>8.1f} {ci:>17} {r['wins']:>6} {r['losses']:>6} {r['draws']:>6}")
+    if args.write:
+        print(f"Wrote {args.method} ratings, leaderboard version is now {report['version']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Reranking of retrieved chunks before they are packed into the prompt.
+
+Retrieval over-fetches candidates. Near-duplicates are then dropped and the rest are
+ordered by maximal marginal relevance, working on the stored vectors with NumPy. Last,
+text that a chunk shares with one ranked above it (the splitter's chunk_overlap,
+repeated pages) is trimmed, so the models don't pay for the same passage twice.
+"""
+from typing import Optional
+
+import numpy as np
+
+
+def _unit(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.where(norms == 0, 1, norms)
+
+
+def mmr_order(
+    query: Optional[np.ndarray],
+    vectors: np.ndarray,
+    diversity: float = 0.3,
+    dedup_threshold: float = 0.95,
+    limit: Optional[int] = None,
+) -> list[int]:
+    """Candidate positions in MMR order, leaving out near-duplicates of an earlier pick.
+
+    Each step picks the candidate with the best (1 - diversity) * relevance minus
+    diversity * its highest cosine similarity to anything already picked. Without a
+    query vector (lexical-only retrieval) relevance follows the incoming rank order.
+    """
+    vectors = _unit(np.asarray(vectors, dtype=np.float32))
+    n = len(vectors)
+    similarity = vectors @ vectors.T
+    if query is not None:
+        relevance = vectors @ _unit(np.asarray(query, dtype=np.float32))
+    else:
+        relevance = 1.0 - np.arange(n, dtype=np.float32) / n
+
+    available = np.ones(n, dtype=bool)
+    # Cosine similarity never goes below -1, so the first pick is decided by relevance alone
+    redundancy = np.full(n, -1.0, dtype=np.float32)
+    order = []
+    while available.any() and (limit is None or len(order) < limit):
+        scores = np.where(available, (1 - diversity) * relevance - diversity * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        order.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+        available &= similarity[best] < dedup_threshold
+    return order
+
+
+def _overlap(first: str, second: str, min_chars: int) -> int:
+    # Length of the longest end of first that second starts with, 0 if under min_chars
+    if len(second) < min_chars:
+        return 0
+    probe = second[:min_chars]
+    start = first.find(probe)
+    while start != -1:
+        if second.startswith(first[start:]):
+            return len(first) - start
+        start = first.find(probe, start + 1)
+    return 0
+
+
+def trim_overlaps(text: str, kept: list[str], min_chars: int = 50) -> str:
+    """text without the parts already present in the kept chunks.
+
+    Returns "" when text is wholly contained in one of them. Otherwise a start that
+    repeats the end of a kept chunk, or an end that repeats its start, is cut off.
+    """
+    for other in kept:
+        if text in other:
+            return ""
+        head = _overlap(other, text, min_chars)
+        if head:
+            text = text[head:].lstrip()
+        tail = _overlap(text, other, min_chars)
+        if tail:
+            text = text[:len(text) - tail].rstrip()
+    return text
@@ -0,0 +1,454 @@
+import asyncio
+import random
+import time
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+import httpx
+from fastapi import HTTPException
+
+
+async def gather_or_cancel(*aws: Awaitable) -> list:
+    # Like asyncio.gather, but the first failure cancels the rest instead of letting them run on
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in tasks:
+            if task in done and task.exception() is not None:
+                raise task.exception()
+        return [task.result() for task in tasks]
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+class Deadline:
+    """Overall time budget shared by every upstream attempt of one battle."""
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, model_id: str, retry_after: float):
+        super().__init__(f"Circuit open for {model_id}")
+        self.model_id = model_id
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Stops sending traffic to a model after repeated failures.
+
+    closed    - requests flow, consecutive failures are counted
+    open      - requests fail fast until reset_timeout has passed
+    half_open - a single probe request decides whether to close again
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+    def release_probe(self) -> None:
+        # The call ended without telling us anything (cancelled, client error), let the next one probe
+        self._probing = False
+
+
+class TokenBucket:
+    """Allows rate calls per second on average, with bursts of up to burst calls."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        # Take the token up front, going into debt if needed, so waiters are served in arrival order
+        self._refill()
+        self.tokens -= 1
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+    def try_acquire(self) -> float:
+        # Non-blocking: takes a token and returns 0, or returns the seconds until one is free
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    @property
+    def full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.burst
+
+
+class RateLimitedError(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Rate limited: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class KeyedRateLimiter:
+    """One token bucket per key (a user or anonymous session), created on first use.
+
+    Buckets that have refilled completely hold no state worth keeping, so the oldest
+    of those are dropped once more than max_keys are tracked.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.rejected = 0
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+
+    def check(self, key: str) -> None:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+            self._evict()
+        self._buckets.move_to_end(key)
+        wait = bucket.try_acquire()
+        if wait:
+            self.rejected += 1
+            raise RateLimitedError("user", wait)
+
+    def _evict(self) -> None:
+        if len(self._buckets) <= self.max_keys:
+            return
+        for key in [key for key, bucket in self._buckets.items() if bucket.full]:
+            del self._buckets[key]
+            if len(self._buckets) <= self.max_keys:
+                return
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class AdmissionSlot:
+    """A held place among the in-flight requests, released at most once."""
+
+    def __init__(self, controller: "AdmissionController"):
+        self._controller = controller
+        self._started = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._controller._release(time.monotonic() - self._started)
+
+    async def __aenter__(self) -> "AdmissionSlot":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.release()
+
+
+class AdmissionController:
+    """Caps requests in flight, with a short FIFO queue in front of the cap.
+
+    A request that finds the queue full, or is still queued after queue_timeout, is
+    refused at once with an estimate of when to retry, so admitted requests keep
+    their latency instead of everyone slowing down together. The estimate comes from
+    a moving average of how long slots are held.
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int = 0, queue_timeout: float = 1.0):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.hold_seconds = 1.0
+        self._waiters: deque = deque()
+
+    def retry_after(self) -> float:
+        # Time for the slots ahead of a new request to turn over once
+        return self.hold_seconds * (1 + len(self._waiters) / self.max_in_flight)
+
+    def _reject(self) -> None:
+        self.rejected += 1
+        raise RateLimitedError("overloaded", self.retry_after())
+
+    async def acquire(self) -> AdmissionSlot:
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+        else:
+            if len(self._waiters) >= self.max_queue:
+                self._reject()
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                # The releasing request hands its slot over, so in_flight is already counted
+                await asyncio.wait_for(asyncio.shield(waiter), timeout=self.queue_timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if waiter.done() and not waiter.cancelled():
+                    # Handed a slot just as we gave up, pass it on
+                    self._release(None)
+                else:
+                    waiter.cancel()
+                    self._waiters.remove(waiter)
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                self._reject()
+        self.admitted += 1
+        return AdmissionSlot(self)
+
+    def _release(self, held: Optional[float]) -> None:
+        if held is not None:
+            self.hold_seconds += 0.1 * (held - self.hold_seconds)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies, used to pick the hedging delay."""
+
+    def __init__(self, window: int = 200):
+        self._samples: deque = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        # Too few samples to say what "slow" means for this model yet
+        if len(self._samples) < 20:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, HTTPException):
+        return error.status_code == 429 or error.status_code >= 500
+    # Streams surface connection drops and read timeouts as raw httpx errors
+    return isinstance(error, (asyncio.TimeoutError, httpx.TransportError))
+
+
+class UpstreamPolicy:
+    """Retries, hedging and circuit breaking around per-model upstream calls."""
+
+    def __init__(
+        self,
+        max_retries: int = 2,
+        backoff_base: float = 0.5,
+        backoff_cap: float = 8.0,
+        hedge_percentile: float = 95.0,
+        hedging: bool = False,
+        failure_threshold: int = 5,
+        reset_timeout: float = 60.0,
+    ):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.hedge_percentile = hedge_percentile
+        self.hedging = hedging
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.hedges = 0
+        self.retries = 0
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._latencies: dict[str, LatencyTracker] = {}
+
+    def breaker(self, model_id: str) -> CircuitBreaker:
+        breaker = self._breakers.get(model_id)
+        if breaker is None:
+            breaker = self._breakers[model_id] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        return breaker
+
+    def latencies(self, model_id: str) -> LatencyTracker:
+        tracker = self._latencies.get(model_id)
+        if tracker is None:
+            tracker = self._latencies[model_id] = LatencyTracker()
+        return tracker
+
+    def is_available(self, model_id: str) -> bool:
+        return self.breaker(model_id).state != "open"
+
+    def backoff(self, attempt: int) -> float:
+        # Full jitter keeps retries from many battles from landing in lockstep
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def check(self, model_id: str) -> CircuitBreaker:
+        breaker = self.breaker(model_id)
+        if not breaker.allow():
+            raise CircuitOpenError(model_id, breaker.retry_after())
+        return breaker
+
+    async def _hedged(self, model_id: str, call: Callable[[], Awaitable], deadline: Deadline):
+        threshold = self.latencies(model_id).percentile(self.hedge_percentile) if self.hedging else None
+        tasks = [asyncio.ensure_future(call())]
+        try:
+            if threshold is None or threshold >= deadline.remaining():
+                return await tasks[0]
+
+            done, _ = await asyncio.wait(tasks, timeout=threshold)
+            if done:
+                return tasks[0].result()
+
+            # The first request is slower than usual, race a second one against it
+            self.hedges += 1
+            tasks.append(asyncio.ensure_future(call()))
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def call(self, model_id: str, call: Callable[[], Awaitable], deadline: Deadline):
+        breaker = self.check(model_id)
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                result = await asyncio.wait_for(self._hedged(model_id, call, deadline), timeout=deadline.remaining())
+            except Exception as e:
+                # Client-side errors don't count against the model, but don't prove it healthy either
+                if not is_retryable(e):
+                    breaker.release_probe()
+                    raise
+                breaker.record_failure()
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt)
+                if delay >= deadline.remaining():
+                    raise
+                self.retries += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+                # Another battle may have tripped the breaker while we slept
+                breaker = self.check(model_id)
+                continue
+            except BaseException:
+                # Cancelled by gather_or_cancel or a dropped client, no outcome to record
+                breaker.release_probe()
+                raise
+
+            breaker.record_success()
+            self.latencies(model_id).record(time.monotonic() - started)
+            return result
+
+    async def stream(self, model_id: str, open_stream: Callable[[], AsyncIterator], deadline: Deadline):
+        # Retries only happen before the first chunk, once text reached the client the attempt is final
+        breaker = self.check(model_id)
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            streamed = False
+            iterator = open_stream().__aiter__()
+            try:
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(iterator.__anext__(), timeout=deadline.remaining())
+                    except StopAsyncIteration:
+                        break
+                    streamed = True
+                    yield chunk
+            except Exception as e:
+                if not is_retryable(e):
+                    breaker.release_probe()
+                    raise
+                breaker.record_failure()
+                if streamed or attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt)
+                if delay >= deadline.remaining():
+                    raise
+                self.retries += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+                breaker = self.check(model_id)
+                continue
+            except BaseException:
+                # GeneratorExit when the client goes away mid-stream, CancelledError when the pump is cancelled
+                breaker.release_probe()
+                raise
+            finally:
+                await iterator.aclose()
+
+            breaker.record_success()
+            self.latencies(model_id).record(time.monotonic() - started)
+            return
+
+    def stats(self) -> dict:
+        return {
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "circuits": {
+                model_id: {"state": breaker.state, "failures": breaker.failures}
+                for model_id, breaker in self._breakers.items()
+            },
+        }
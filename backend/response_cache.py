@@ -0,0 +1,85 @@
+import asyncio
+import hashlib
+import json
+from typing import Awaitable, Callable, Optional
+
+from retrieval import normalize_question
+from ttl_cache import TTLCache
+
+
+class ResponseCache:
+    """Opt-in cache of model completions with single-flight coalescing.
+
+    Entries are keyed by model, normalized question, a hash of the retrieved context
+    and the prompt version, so any change to what the model would actually see is a
+    miss. Concurrent requests for the same key share one upstream call: the first one
+    starts it and the rest await the same task.
+    """
+
+    def __init__(self, enabled: bool = False, max_size: int = 2048, ttl: float = 6 * 3600.0):
+        self.enabled = enabled
+        self.entries = TTLCache(max_size=max_size, ttl=ttl)
+        self.coalesced = 0
+        self.bypassed = 0
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def key(model_id: str, question: str, context: str, prompt_version: str) -> str:
+        payload = json.dumps([
+            model_id,
+            normalize_question(question),
+            hashlib.sha256(context.encode("utf-8")).hexdigest(),
+            prompt_version,
+        ])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, bypass: bool = False) -> Optional[str]:
+        if not self.enabled:
+            return None
+        if bypass:
+            self.bypassed += 1
+            return None
+        return self.entries.get(key)
+
+    def set(self, key: str, response: str) -> None:
+        if self.enabled:
+            self.entries.set(key, response)
+
+    def _finish(self, key: str, task: asyncio.Future) -> None:
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            self.entries.set(key, task.result())
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[str]], bypass: bool = False) -> str:
+        if not self.enabled:
+            return await compute()
+        if bypass:
+            # Fresh sample, but it still replaces the cached answer
+            self.bypassed += 1
+            response = await compute()
+            self.entries.set(key, response)
+            return response
+
+        cached = self.entries.get(key)
+        if cached is not None:
+            return cached
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            self.coalesced += 1
+
+        # Shielded so one waiter giving up doesn't cancel the call the others are waiting on
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {
+            **self.entries.stats(),
+            "enabled": self.enabled,
+            "coalesced": self.coalesced,
+            "bypassed": self.bypassed,
+            "in_flight": len(self._inflight),
+        }
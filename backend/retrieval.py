@@ -0,0 +1,332 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from bm25 import reciprocal_rank_fusion
+from faiss_index import enable_reconstruct
+from metrics import stage
+from rerank import mmr_order, trim_overlaps
+from tokens import chunk_tokens, count_tokens, pack_context
+from ttl_cache import TTLCache
+
+RETRIEVAL_MODES = ("vector", "hybrid", "lexical")
+
+
+def normalize_question(question: str) -> str:
+    # Collapse case and whitespace so trivially different questions share a cache entry
+    return " ".join(question.lower().split())
+
+
+class SearchBatcher:
+    """Groups vector searches issued close together into a single index.search call."""
+
+    def __init__(self, search_fn: Callable, executor: ThreadPoolExecutor, max_batch_size: int = 32, window: float = 0.002):
+        self.search_fn = search_fn
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.window = window
+        self.batches = 0
+        self.queries = 0
+        self._pending: list = []
+        self._flush_handle = None
+        # The loop only keeps weak references to tasks, so in-flight batches are held here
+        self._tasks: set = set()
+
+    async def search(self, vector):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((vector, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list) -> None:
+        self.batches += 1
+        self.queries += len(batch)
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self.executor, self.search_fn, [vector for vector, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), docs in zip(batch, results):
+            if not future.done():
+                future.set_result(docs)
+
+
+class ContextRetriever:
+    """Looks up RAG context for a question, going to the indexes only on a cache miss.
+
+    The async path embeds through the embedding model's async client and runs the FAISS
+    and BM25 searches on a small dedicated thread pool, so neither blocks the event loop.
+
+    Modes:
+      vector  - dense FAISS search only
+      hybrid  - FAISS and BM25 results merged with reciprocal rank fusion
+      lexical - BM25 only, no embedding call at all
+
+    With rerank, more candidates than k are fetched and reordered by maximal marginal
+    relevance on their stored vectors, dropping near-duplicates and trimming text
+    already covered by a higher-ranked chunk. diversity trades relevance (0) for
+    variety (1).
+
+    With a context_budget, the best-ranked chunks (at most k) are packed into that many
+    tokens, reaching further down the ranking when a top chunk is too large to fit.
+    """
+
+    def __init__(
+        self,
+        vectorstore=None,
+        k: int = 3,
+        cache: Optional[TTLCache] = None,
+        search_workers: int = 2,
+        batched: bool = True,
+        max_batch_size: int = 32,
+        batch_window: float = 0.002,
+        bm25=None,
+        mode: str = "hybrid",
+        fusion_depth: int = 20,
+        context_budget: int = 0,
+        rerank: bool = False,
+        diversity: float = 0.3,
+        dedup_threshold: float = 0.95,
+        normalize_L2: bool = False,
+    ):
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+        self.vectorstore = vectorstore
+        self.bm25 = bm25
+        self.k = k
+        self.mode = mode
+        self.fusion_depth = fusion_depth
+        self.context_budget = context_budget
+        self.rerank = rerank
+        self.diversity = diversity
+        self.dedup_threshold = dedup_threshold
+        # Set for stores built from unit-length vectors, so queries are scaled the same way
+        self.normalize_L2 = normalize_L2
+        self.cache = cache if cache is not None else TTLCache()
+        self._executor = ThreadPoolExecutor(max_workers=search_workers, thread_name_prefix="retrieval")
+        self._batcher = SearchBatcher(self._search_vectors, self._executor, max_batch_size, batch_window) if batched else None
+        self._positions: Optional[tuple] = None
+        self._rerank_lock = threading.Lock()
+
+    def set_vectorstore(self, vectorstore, bm25=None) -> None:
+        # Cached contexts belong to the old index, so drop them
+        self.vectorstore = vectorstore
+        self.bm25 = bm25
+        self.cache.clear()
+
+    def _rerank_positions(self, vectorstore) -> dict:
+        # Docstore id -> position in the FAISS index, for reading stored vectors. Built on
+        # first use of each store, a failure only costs the search at hand its reranking.
+        with self._rerank_lock:
+            if self._positions is None or self._positions[0] is not vectorstore:
+                enable_reconstruct(vectorstore.index)
+                self._positions = (vectorstore, {doc_id: i for i, doc_id in vectorstore.index_to_docstore_id.items()})
+            return self._positions[1]
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+    @property
+    def effective_mode(self) -> str:
+        # Without a lexical index the only thing left to search is the vector store
+        if self.bm25 is None:
+            return "vector"
+        return self.mode
+
+    def _depth(self) -> int:
+        if self.effective_mode == "vector" and not self.context_budget and not self.rerank:
+            return self.k
+        return max(self.k, self.fusion_depth)
+
+    def _candidates(self) -> int:
+        # The packer may skip oversized chunks and the reranker drops duplicates, so over-fetch for both
+        return self._depth() if self.context_budget or self.rerank else self.k
+
+    def _embed(self, question: str) -> list[float]:
+        embeddings = getattr(self.vectorstore, "embeddings", None)
+        if embeddings is not None:
+            return embeddings.embed_query(question)
+        return self.vectorstore.embedding_function(question)
+
+    async def _aembed(self, question: str) -> list[float]:
+        embeddings = getattr(self.vectorstore, "embeddings", None)
+        if embeddings is not None:
+            return await embeddings.aembed_query(question)
+        # Plain embedding callables have no async variant, keep them off the loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._embed, question)
+
+    def _search_vectors(self, vectors: list) -> list[list[str]]:
+        import numpy as np
+
+        vectorstore = self.vectorstore
+        x = np.asarray(vectors, dtype=np.float32)
+        if self.normalize_L2:
+            norms = np.linalg.norm(x, axis=1, keepdims=True)
+            x = x / np.where(norms == 0, 1, norms)
+
+        _, indices = vectorstore.index.search(x, self._depth())
+        return [
+            [vectorstore.index_to_docstore_id[i] for i in row if i != -1]
+            for row in indices
+        ]
+
+    async def _asearch_vectors(self, question: str) -> tuple[list[float], list[str]]:
+        with stage("embed"):
+            vector = await self._aembed(question)
+        # Batched searches include the wait for the batch window
+        with stage("vector_search"):
+            if self._batcher is not None:
+                return vector, await self._batcher.search(vector)
+            loop = asyncio.get_running_loop()
+            return vector, (await loop.run_in_executor(self._executor, self._search_vectors, [vector]))[0]
+
+    def _search_lexical(self, question: str) -> list[str]:
+        with stage("lexical_search"):
+            return [doc_id for doc_id, _ in self.bm25.search(question, self._depth())]
+
+    def _fuse(self, vector_ids: Optional[list[str]], lexical_ids: Optional[list[str]]) -> list[str]:
+        if vector_ids is None:
+            return lexical_ids[:self._candidates()]
+        if lexical_ids is None:
+            return vector_ids[:self._candidates()]
+        return reciprocal_rank_fusion([vector_ids, lexical_ids], self._candidates())
+
+    def _join(self, doc_ids: list[str], query_vector: Optional[list[float]] = None) -> str:
+        # The docstore returns a message string for ids it doesn't know
+        found = [(doc_id, self.vectorstore.docstore.search(doc_id)) for doc_id in doc_ids]
+        found = [(doc_id, doc) for doc_id, doc in found if not isinstance(doc, str)]
+        chunks = None
+        if self.rerank and len(found) > 1:
+            try:
+                with stage("rerank"):
+                    chunks = self._rerank(found, query_vector)
+            except Exception as e:
+                # Fall back to the retrieval order rather than lose the context
+                print(f"Reranking failed, using retrieval order: {str(e)}")
+        if chunks is None:
+            chunks = [(doc.page_content, chunk_tokens(doc)) for _, doc in found]
+        with stage("pack_context"):
+            return self._pack(chunks)
+
+    def _rerank(self, found: list, query_vector: Optional[list[float]]) -> list[tuple[str, int]]:
+        import numpy as np
+
+        vectorstore = self.vectorstore
+        positions_by_id = self._rerank_positions(vectorstore)
+        positions = np.array([positions_by_id[doc_id] for doc_id, _ in found], dtype=np.int64)
+        vectors = vectorstore.index.reconstruct_batch(positions)
+        query = np.asarray(query_vector, dtype=np.float32) if query_vector is not None else None
+
+        chunks, kept = [], []
+        for i in mmr_order(query, vectors, self.diversity, self.dedup_threshold):
+            doc = found[i][1]
+            text = trim_overlaps(doc.page_content, kept)
+            if not text:
+                continue
+            kept.append(doc.page_content)
+            chunks.append((text, chunk_tokens(doc) if text == doc.page_content else count_tokens(text)))
+        return chunks
+
+    def _pack(self, chunks: list[tuple[str, int]]) -> str:
+        if not self.context_budget:
+            return "\n".join(text for text, _ in chunks[:self.k])
+        return pack_context(chunks, self.context_budget, self.k)
+
+    def _search(self, question: str) -> str:
+        mode = self.effective_mode
+        lexical_ids = self._search_lexical(question) if mode != "vector" else None
+        vector, vector_ids = None, None
+        if mode != "lexical":
+            try:
+                vector = self._embed(question)
+                vector_ids = self._search_vectors([vector])[0]
+            except Exception as e:
+                if lexical_ids is None:
+                    raise
+                print(f"Vector search failed, using lexical results only: {str(e)}")
+        return self._join(self._fuse(vector_ids, lexical_ids), vector)
+
+    async def _asearch(self, question: str) -> str:
+        mode = self.effective_mode
+        loop = asyncio.get_running_loop()
+        lexical_task = None
+        if mode != "vector":
+            # Run in a copy of the context so the search shows up in sampled traces
+            lexical_task = loop.run_in_executor(self._executor, contextvars.copy_context().run, self._search_lexical, question)
+
+        vector, vector_ids = None, None
+        if mode != "lexical":
+            try:
+                vector, vector_ids = await self._asearch_vectors(question)
+            except Exception as e:
+                if lexical_task is None:
+                    raise
+                # Embedding API down or slow, lexical results still make a usable context
+                print(f"Vector search failed, using lexical results only: {str(e)}")
+
+        lexical_ids = await lexical_task if lexical_task is not None else None
+        # Reranking and packing are CPU work, keep them off the event loop too
+        return await loop.run_in_executor(
+            self._executor, contextvars.copy_context().run, self._join, self._fuse(vector_ids, lexical_ids), vector
+        )
+
+    def get_context(self, question: str) -> str:
+        if self.vectorstore is None:
+            return ""
+
+        key = normalize_question(question)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        try:
+            context = self._search(question)
+        except Exception as e:
+            # Don't cache failures, the next battle should retry the lookup
+            print(f"Error getting context: {str(e)}")
+            return ""
+
+        self.cache.set(key, context)
+        return context
+
+    async def aget_context(self, question: str) -> str:
+        if self.vectorstore is None:
+            return ""
+
+        key = normalize_question(question)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        try:
+            context = await self._asearch(question)
+        except Exception as e:
+            print(f"Error getting context: {str(e)}")
+            return ""
+
+        self.cache.set(key, context)
+        return context
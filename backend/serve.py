@@ -0,0 +1,32 @@
+"""Run the API with several uvicorn worker processes sharing one startup.
+
+The first worker to start builds the index and prepares the database, the others
+wait for it and then memory-map the same index files, so the vectors are held in
+the page cache once however many workers there are. Workers uvicorn restarts later
+skip straight to loading.
+
+    WEB_CONCURRENCY=2 python serve.py --port 8080
+"""
+import argparse
+import os
+import uuid
+
+import uvicorn
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8080")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")))
+    args = parser.parse_args()
+
+    # Inherited by every worker, marks the startup work done for this server start only
+    os.environ["SERVER_GENERATION"] = uuid.uuid4().hex
+    # Lets each worker take its share of the server-wide per-user rate limit
+    os.environ["WEB_CONCURRENCY"] = str(args.workers)
+    uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
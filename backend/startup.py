@@ -0,0 +1,49 @@
+import asyncio
+import fcntl
+import os
+from typing import Optional
+
+# Set by serve.py and shared by all its workers, unset when uvicorn is started directly
+SERVER_GENERATION = os.getenv("SERVER_GENERATION")
+
+
+class StartupOnce:
+    """Runs a piece of startup work in one worker per server start.
+
+    Workers queue on an exclusive file lock. The first one in is the leader and does
+    the work, then calls done() to record the server generation next to the lock.
+    Later workers (including ones uvicorn restarts) find that generation and skip
+    straight to using the result. Without a generation every process is a leader,
+    so a plain `uvicorn main:app` still does all of its own setup.
+    """
+
+    def __init__(self, name: str, lock_dir: str, generation: Optional[str] = SERVER_GENERATION):
+        self.path = os.path.join(lock_dir, f"startup-{name}.lock")
+        self.generation = generation
+        self.leader = False
+        self._file = None
+
+    async def __aenter__(self) -> "StartupOnce":
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, "a+")
+        try:
+            # Blocks while the leader works, so wait on a thread
+            await asyncio.to_thread(fcntl.flock, self._file, fcntl.LOCK_EX)
+        except BaseException:
+            self._file.close()
+            raise
+        self._file.seek(0)
+        self.leader = self.generation is None or self._file.read().strip() != self.generation
+        return self
+
+    def done(self) -> None:
+        if self.generation is None:
+            return
+        self._file.seek(0)
+        self._file.truncate()
+        self._file.write(self.generation)
+        self._file.flush()
+
+    async def __aexit__(self, *exc_info) -> None:
+        # Closing the file releases the lock for the next worker
+        self._file.close()
@@ -0,0 +1,90 @@
+import os
+import sys
+import tempfile
+
+# Backend modules are flat and import each other by name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# database.py connects at import time, point it at a throwaway SQLite file first
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='arena-tests-'), 'test.db')}"
+
+import tokens  # noqa: E402
+
+
+class ByteEncoding:
+    # Stands in for cl100k_base, which tiktoken downloads on first use: one token per byte
+    def encode(self, text: str) -> list[int]:
+        return list(text.encode("utf-8"))
+
+    def decode(self, ids: list[int]) -> str:
+        return bytes(ids).decode("utf-8", errors="replace")
+
+
+tokens._encoding = ByteEncoding()
+
+
+import asyncio  # noqa: E402
+from datetime import datetime  # noqa: E402
+
+import pytest  # noqa: E402
+from sqlalchemy import select  # noqa: E402
+
+from database import async_engine, battles, change_counters, engine, metadata, models, user  # noqa: E402
+from leaderboard import LEADERBOARD_COUNTER  # noqa: E402
+
+GLOBAL_A, GLOBAL_B, PERSONAL_A = 1, 2, 3
+
+
+def run(coro):
+    async def wrapped():
+        try:
+            return await coro
+        finally:
+            # Pooled aiosqlite connections belong to this loop, don't leak them into the next test
+            await async_engine.dispose()
+    return asyncio.run(wrapped())
+
+
+@pytest.fixture
+def arena_db():
+    # Two shared models and one user's personal copy of the first
+    metadata.drop_all(bind=engine)
+    metadata.create_all(bind=engine)
+    now = datetime.now()
+    with engine.begin() as conn:
+        conn.execute(change_counters.insert().values(name=LEADERBOARD_COUNTER, value=0))
+        conn.execute(user.insert().values(id="u", name="u", email="u@example.com", email_verified=False, created_at=now, updated_at=now))
+        conn.execute(models.insert(), [
+            {"id": GLOBAL_A, "model_id": "a", "name": "A", "wins": 0, "losses": 0, "draws": 0, "invalid": 0, "elo": 1500.0, "user_id": None},
+            {"id": GLOBAL_B, "model_id": "b", "name": "B", "wins": 0, "losses": 0, "draws": 0, "invalid": 0, "elo": 1500.0, "user_id": None},
+            {"id": PERSONAL_A, "model_id": "a", "name": "A", "wins": 7, "losses": 0, "draws": 0, "invalid": 0, "elo": 1234.0, "user_id": "u"},
+        ])
+    return engine
+
+
+def add_battle(model1_id: int = GLOBAL_A, model2_id: int = GLOBAL_B, result=None, winner_id=None) -> int:
+    with engine.begin() as conn:
+        return conn.execute(
+            battles.insert().values(
+                model1_id=model1_id,
+                model2_id=model2_id,
+                result=result,
+                winner_id=winner_id,
+                voted_at=datetime.now() if result else None,
+            )
+        ).inserted_primary_key[0]
+
+
+def model_row(pk: int):
+    with engine.connect() as conn:
+        return conn.execute(select(models).where(models.c.id == pk)).first()
+
+
+def battle_row(battle_id: int):
+    with engine.connect() as conn:
+        return conn.execute(select(battles).where(battles.c.id == battle_id)).first()
+
+
+def counter() -> int:
+    with engine.connect() as conn:
+        return conn.execute(select(change_counters.c.value)).scalar()
@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+
+import pytest
+from starlette.requests import Request
+
+from auth_sessions import SessionResolver, session_token
+from conftest import run
+from database import engine, session
+
+pytestmark = pytest.mark.usefixtures("arena_db")
+
+
+def request_with(cookie: str = "") -> Request:
+    headers = [(b"cookie", cookie.encode())] if cookie else []
+    return Request({"type": "http", "method": "POST", "path": "/vote", "headers": headers})
+
+
+def add_session(token: str, expires_in: timedelta) -> None:
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(session.insert().values(
+            id=token, token=token, user_id="u", expires_at=now + expires_in, created_at=now, updated_at=now,
+        ))
+
+
+def test_session_token_drops_the_signature():
+    assert session_token(request_with("better-auth.session_token=abc123.c2lnbmF0dXJl%3D")) == "abc123"
+    assert session_token(request_with("__Secure-better-auth.session_token=abc123.sig")) == "abc123"
+    assert session_token(request_with("other=1")) is None
+
+
+def test_resolves_live_sessions_only():
+    add_session("live", timedelta(days=1))
+    add_session("expired", timedelta(days=-1))
+    resolver = SessionResolver()
+    assert run(resolver.user_id(request_with("better-auth.session_token=live.sig"))) == "u"
+    assert run(resolver.user_id(request_with("better-auth.session_token=expired.sig"))) is None
+    assert run(resolver.user_id(request_with("better-auth.session_token=forged.sig"))) is None
+    assert run(resolver.user_id(request_with())) is None
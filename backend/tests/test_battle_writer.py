@@ -0,0 +1,69 @@
+import asyncio
+import json
+import os
+import time
+from datetime import datetime
+
+import pytest
+
+from battle_writer import BattleWriter
+from conftest import GLOBAL_A, GLOBAL_B, add_battle, battle_row, run
+from database import battles, engine
+
+pytestmark = pytest.mark.usefixtures("arena_db")
+
+
+def writer(tmp_path, **kwargs) -> BattleWriter:
+    return BattleWriter(None, flush_interval=0.02, spill_path=str(tmp_path / "pending_battles.1.jsonl"), **kwargs)
+
+
+def spilled_row(battle_id: int) -> dict:
+    return {
+        "id": battle_id, "model1_id": GLOBAL_A, "model2_id": GLOBAL_B, "winner_id": None,
+        "question": "q", "response1": "r1", "response2": "r2", "result": None,
+        "created_at": datetime.now().isoformat(), "voted_at": None,
+    }
+
+
+def test_wait_sees_battle_flushed_by_another_worker(tmp_path):
+    async def scenario():
+        async def other_worker():
+            await asyncio.sleep(0.1)
+            await asyncio.to_thread(add_battle)
+        started = time.monotonic()
+        await asyncio.gather(writer(tmp_path, miss_timeout=5).wait_until_written(1), other_worker())
+        return time.monotonic() - started
+    assert run(scenario()) < 2
+
+
+def test_wait_gives_up_after_miss_timeout(tmp_path):
+    started = time.monotonic()
+    run(writer(tmp_path, miss_timeout=0.1).wait_until_written(42))
+    assert time.monotonic() - started < 2
+
+
+def test_replay_inserts_spilled_rows_and_claims_the_file(tmp_path):
+    path = tmp_path / "pending_battles.1.jsonl"
+    path.write_text("".join(json.dumps(spilled_row(i)) + "\n" for i in (7, 8)))
+    # Row 7 made it in before a crash, replaying it again must not fail
+    with engine.begin() as conn:
+        conn.execute(battles.insert().values(id=7, model1_id=GLOBAL_A, model2_id=GLOBAL_B))
+
+    assert run(writer(tmp_path).replay_spill(str(tmp_path / "pending_battles*.jsonl"))) == 2
+    assert battle_row(7) is not None and battle_row(8) is not None
+    assert os.listdir(tmp_path) == []
+    assert run(writer(tmp_path).replay_spill()) == 0
+
+
+def test_failed_replay_keeps_the_rows(tmp_path):
+    path = tmp_path / "pending_battles.1.jsonl"
+    path.write_text(json.dumps(spilled_row(9)) + "\n")
+
+    class Broken(BattleWriter):
+        async def _with_texts(self, db, rows):
+            raise RuntimeError("database down")
+
+    with pytest.raises(RuntimeError):
+        run(Broken(None, spill_path=str(path)).replay_spill())
+    assert [json.loads(line)["id"] for line in path.read_text().splitlines()] == [9]
+    assert os.listdir(tmp_path) == ["pending_battles.1.jsonl"]
@@ -0,0 +1,86 @@
+import os
+
+import numpy as np
+import pytest
+
+from hash_embeddings import HashEmbeddings
+from index_builder import IndexBuilder, save_vectorstore
+
+WORDS = "rifle motorcade plaza depository witness bullet parade window report commission".split()
+
+
+def write_doc(data_dir: str, name: str, seed: int) -> None:
+    rng = np.random.default_rng(seed)
+    sections = [
+        f"# Section {i}\n\n" + " ".join(rng.choice(WORDS, size=60)) + ".\n\n- " + " ".join(rng.choice(WORDS, size=8))
+        for i in range(4)
+    ]
+    with open(os.path.join(data_dir, name), "w") as f:
+        f.write("\n\n".join(sections))
+
+
+def builder(tmp_path, data_dir: str, name: str, index_type: str) -> IndexBuilder:
+    return IndexBuilder(
+        data_dir,
+        str(tmp_path / name),
+        HashEmbeddings(),
+        str(tmp_path / "embeddings.sqlite3"),
+        chunk_size=200,
+        chunk_overlap=40,
+        embed_batch_size=16,
+        parse_workers=1,
+        index_type=index_type,
+    )
+
+
+def contents(store) -> dict:
+    # Chunk id -> (text, vector), independent of the position each chunk ended up at
+    return {
+        doc_id: (store.docstore.search(doc_id).page_content, store.index.reconstruct(position))
+        for position, doc_id in store.index_to_docstore_id.items()
+    }
+
+
+def assert_same_store(incremental, full) -> None:
+    left, right = contents(incremental), contents(full)
+    assert left.keys() == right.keys()
+    for doc_id, (text, vector) in left.items():
+        assert text == right[doc_id][0]
+        np.testing.assert_allclose(vector, right[doc_id][1], rtol=1e-6)
+
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+def test_incremental_build_matches_full_rebuild(tmp_path, index_type):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    for i in range(4):
+        write_doc(str(data_dir), f"doc{i}.md", i)
+    builder(tmp_path, str(data_dir), "incremental", index_type).build()
+
+    write_doc(str(data_dir), "doc1.md", 100)
+    os.remove(data_dir / "doc2.md")
+    write_doc(str(data_dir), "doc9.md", 9)
+
+    incremental = builder(tmp_path, str(data_dir), "incremental", index_type)
+    updated = incremental.build()
+    full = builder(tmp_path, str(data_dir), "full", index_type).build()
+
+    assert_same_store(updated, full)
+    assert set(incremental.files) == {"doc0.md", "doc1.md", "doc3.md", "doc9.md"}
+
+
+def test_store_missing_manifest_chunks_is_rebuilt(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    for i in range(2):
+        write_doc(str(data_dir), f"doc{i}.md", i)
+    store = builder(tmp_path, str(data_dir), "store", "hnsw").build()
+    lost = store.index_to_docstore_id[0]
+    del store.docstore._dict[lost]
+    save_vectorstore(store, str(tmp_path / "store"))
+
+    write_doc(str(data_dir), "doc2.md", 2)
+    rebuilt = builder(tmp_path, str(data_dir), "store", "hnsw").build()
+    full = builder(tmp_path, str(data_dir), "full", "hnsw").build()
+    assert not isinstance(rebuilt.docstore.search(lost), str)
+    assert_same_store(rebuilt, full)
@@ -0,0 +1,99 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from starlette.requests import Request
+
+import resilience
+from conftest import run
+from database import engine, session
+from main import rate_limit_key
+from resilience import AdmissionController, KeyedRateLimiter, RateLimitedError, TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(resilience.time, "monotonic", clock)
+    return clock
+
+
+def test_token_bucket_burst_then_rate(clock):
+    bucket = TokenBucket(rate=2.0, burst=3)
+    assert [bucket.try_acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.try_acquire() == pytest.approx(0.5)
+    clock.now += 0.5
+    assert bucket.try_acquire() == 0.0
+    clock.now += 10
+    assert bucket.full
+    assert bucket.tokens == 3
+
+
+def test_keyed_rate_limiter_is_per_key(clock):
+    limiter = KeyedRateLimiter(rate=1.0, burst=2)
+    limiter.check("user:a")
+    limiter.check("user:a")
+    with pytest.raises(RateLimitedError) as e:
+        limiter.check("user:a")
+    assert e.value.retry_after == pytest.approx(1.0)
+    limiter.check("user:b")
+    assert limiter.rejected == 1
+
+
+def test_keyed_rate_limiter_evicts_only_full_buckets(clock):
+    limiter = KeyedRateLimiter(rate=1.0, burst=2, max_keys=2)
+    limiter.check("a")
+    clock.now += 5
+    limiter.check("b")
+    limiter.check("c")
+    # "a" refilled and was dropped, "b" and "c" still owe tokens and are kept
+    assert len(limiter) == 2
+    assert set(limiter._buckets) == {"b", "c"}
+
+
+def test_admission_queues_then_rejects():
+    async def scenario():
+        admission = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=0.05)
+        first = await admission.acquire()
+        queued = asyncio.ensure_future(admission.acquire())
+        await asyncio.sleep(0)
+        # Queue full: refused at once
+        with pytest.raises(RateLimitedError):
+            await admission.acquire()
+        first.release()
+        second = await queued
+        assert admission.stats()["in_flight"] == 1
+        # Nobody releases in time: refused after queue_timeout
+        with pytest.raises(RateLimitedError):
+            await admission.acquire()
+        second.release()
+        second.release()
+        return admission.stats()
+
+    assert asyncio.run(scenario()) == {"in_flight": 0, "queued": 0, "admitted": 2, "rejected": 2}
+
+
+def request_from(client: str, cookie: str = "") -> Request:
+    headers = [(b"cookie", cookie.encode())] if cookie else []
+    return Request({"type": "http", "method": "POST", "path": "/battle", "headers": headers, "client": (client, 1234)})
+
+
+@pytest.mark.usefixtures("arena_db")
+def test_rate_limit_key_comes_from_the_session():
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(session.insert().values(
+            id="s", token="ratelimit", user_id="u", expires_at=now + timedelta(days=1), created_at=now, updated_at=now,
+        ))
+    assert run(rate_limit_key(request_from("10.0.0.1", "better-auth.session_token=ratelimit.sig"))) == "user:u"
+    # Without a valid session every request from the address shares a bucket
+    assert run(rate_limit_key(request_from("10.0.0.1", "better-auth.session_token=made-up.sig"))) == "ip:10.0.0.1"
+    assert run(rate_limit_key(request_from("10.0.0.2"))) == "ip:10.0.0.2"
@@ -0,0 +1,59 @@
+import pytest
+
+from conftest import GLOBAL_A, GLOBAL_B, PERSONAL_A, add_battle, model_row, run
+from main import apply_vote
+from recompute_ratings import StaleRatingsError, compute, write_back
+
+pytestmark = pytest.mark.usefixtures("arena_db")
+
+
+def ratings_by_pk(report: dict) -> dict:
+    return {r["pk"]: r for r in report["ratings"]}
+
+
+def test_replay_matches_live_votes():
+    # Same votes through /vote and through the replay, one of them flipped on the client
+    run(apply_vote(add_battle(), "model1", GLOBAL_A))
+    run(apply_vote(add_battle(), "model1", GLOBAL_B))
+    run(apply_vote(add_battle(), "model2", GLOBAL_B))
+    run(apply_vote(add_battle(), "draw"))
+
+    ratings = ratings_by_pk(compute(k=32, bootstrap_rounds=20))
+    for pk in (GLOBAL_A, GLOBAL_B):
+        live = model_row(pk)
+        assert ratings[pk]["elo"] == pytest.approx(live.elo)
+        assert (ratings[pk]["wins"], ratings[pk]["losses"], ratings[pk]["draws"]) == (live.wins, live.losses, live.draws)
+
+
+def test_flipped_result_follows_winner_id():
+    add_battle(result="model1_win", winner_id=GLOBAL_B)
+    ratings = ratings_by_pk(compute(bootstrap_rounds=20))
+    assert ratings[GLOBAL_B]["wins"] == 1
+    assert ratings[GLOBAL_A]["losses"] == 1
+    assert ratings[GLOBAL_B]["elo"] > 1500 > ratings[GLOBAL_A]["elo"]
+
+
+def test_recompute_ignores_personal_rows():
+    for _ in range(3):
+        add_battle(result="model1_win", winner_id=GLOBAL_A)
+    add_battle(GLOBAL_B, GLOBAL_A, result="draw")
+    # Not a global pair, must not be counted or shift the dense indices
+    add_battle(PERSONAL_A, GLOBAL_B, result="model2_win", winner_id=GLOBAL_B)
+
+    report = compute(bootstrap_rounds=20)
+    assert report["battles"] == 4
+    ratings = ratings_by_pk(report)
+    assert set(ratings) == {GLOBAL_A, GLOBAL_B}
+    assert (ratings[GLOBAL_A]["wins"], ratings[GLOBAL_A]["draws"], ratings[GLOBAL_B]["losses"]) == (3, 1, 3)
+
+    assert write_back(report, "elo") == 1
+    assert model_row(GLOBAL_A).elo == pytest.approx(ratings[GLOBAL_A]["elo"])
+    personal = model_row(PERSONAL_A)
+    assert (personal.elo, personal.wins) == (1234.0, 7)
+
+
+def test_write_back_refuses_stale_report():
+    report = compute(bootstrap_rounds=20)
+    run(apply_vote(add_battle(), "model1", GLOBAL_A))
+    with pytest.raises(StaleRatingsError):
+        write_back(report, "elo")
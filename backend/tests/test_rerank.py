@@ -0,0 +1,58 @@
+import numpy as np
+
+from rerank import mmr_order, trim_overlaps
+
+
+def test_mmr_drops_near_duplicates():
+    vectors = np.array([[1.0, 0.0], [1.0, 0.01], [0.0, 1.0]])
+    assert mmr_order(np.array([1.0, 0.0]), vectors, dedup_threshold=0.95) == [0, 2]
+
+
+def test_mmr_without_diversity_follows_relevance():
+    vectors = np.array([[0.0, 1.0], [1.0, 0.0], [0.7, 0.7]])
+    order = mmr_order(np.array([1.0, 0.0]), vectors, diversity=0.0, dedup_threshold=1.1)
+    assert order == [1, 2, 0]
+
+
+def test_mmr_diversity_prefers_a_different_candidate():
+    vectors = np.array([[1.0, 0.0], [0.9, 0.3], [0.6, -0.8]])
+    query = np.array([1.0, 0.0])
+    assert mmr_order(query, vectors, diversity=0.0, dedup_threshold=1.1)[1] == 1
+    assert mmr_order(query, vectors, diversity=0.7, dedup_threshold=1.1)[1] == 2
+
+
+def test_mmr_without_query_keeps_rank_order_and_limit():
+    vectors = np.eye(4)
+    assert mmr_order(None, vectors) == [0, 1, 2, 3]
+    assert mmr_order(None, vectors, limit=2) == [0, 1]
+
+
+def test_mmr_handles_zero_vectors():
+    vectors = np.array([[0.0, 0.0], [1.0, 0.0]])
+    assert sorted(mmr_order(np.array([1.0, 0.0]), vectors)) == [0, 1]
+
+
+def test_trim_contained_chunk():
+    kept = ["The rifle was ordered by mail from a Chicago sporting goods store in March."]
+    assert trim_overlaps("ordered by mail from a Chicago sporting goods store", kept, min_chars=20) == ""
+
+
+def test_trim_overlapping_head():
+    first = "Alpha beta gamma delta. The package went to a post office box in Dallas."
+    second = "The package went to a post office box in Dallas. It was picked up a week later."
+    assert trim_overlaps(second, [first], min_chars=20) == "It was picked up a week later."
+
+
+def test_trim_overlapping_tail():
+    first = "The motorcade route was published in the newspapers. Crowds lined the street."
+    second = "Police cleared the plaza before noon. The motorcade route was published in the newspapers."
+    assert trim_overlaps(second, [first], min_chars=20) == "Police cleared the plaza before noon."
+
+
+def test_trim_ignores_short_overlaps_and_unrelated_text():
+    kept = ["Jack Ruby shot Oswald in the basement of police headquarters."]
+    # Shared text under min_chars is left alone
+    assert trim_overlaps("police headquarters. Then more.", kept, min_chars=50) == "police headquarters. Then more."
+    assert trim_overlaps("Something else entirely, with no shared passage at all here.", kept, min_chars=20) == (
+        "Something else entirely, with no shared passage at all here."
+    )
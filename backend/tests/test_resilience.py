@@ -0,0 +1,110 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from resilience import CircuitBreaker, Deadline, UpstreamPolicy, is_retryable
+
+
+def test_is_retryable():
+    assert is_retryable(HTTPException(status_code=503))
+    assert is_retryable(HTTPException(status_code=429))
+    assert not is_retryable(HTTPException(status_code=400))
+    assert is_retryable(asyncio.TimeoutError())
+    assert is_retryable(httpx.ConnectError("refused"))
+    assert is_retryable(httpx.ReadTimeout("slow"))
+    assert not is_retryable(ValueError("bad payload"))
+
+
+def test_breaker_opens_after_threshold_and_probes_once():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.opened_at is None
+    breaker.record_failure()
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def open_breaker(policy: UpstreamPolicy, model_id: str) -> CircuitBreaker:
+    breaker = policy.breaker(model_id)
+    for _ in range(policy.failure_threshold):
+        breaker.record_failure()
+    assert breaker.state == "half_open"
+    return breaker
+
+
+def test_cancelled_probe_releases_the_breaker():
+    policy = UpstreamPolicy(max_retries=0, failure_threshold=1, reset_timeout=0)
+    breaker = open_breaker(policy, "m")
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    async def ok():
+        return "done"
+
+    async def run():
+        task = asyncio.ensure_future(policy.call("m", hang, Deadline(30)))
+        await asyncio.sleep(0.01)
+        assert breaker._probing
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # The next request gets to probe instead of being refused forever
+        return await policy.call("m", ok, Deadline(30))
+
+    assert asyncio.run(run()) == "done"
+    assert breaker.state == "closed"
+
+
+def test_cancelled_stream_probe_releases_the_breaker():
+    policy = UpstreamPolicy(max_retries=0, failure_threshold=1, reset_timeout=0)
+    breaker = open_breaker(policy, "m")
+
+    async def chunks():
+        yield "a"
+        await asyncio.sleep(10)
+        yield "b"
+
+    async def run():
+        stream = policy.stream("m", chunks, Deadline(30))
+        assert await stream.__anext__() == "a"
+        await stream.aclose()
+
+    asyncio.run(run())
+    assert not breaker._probing
+    assert breaker.allow()
+
+
+def test_client_error_does_not_close_the_breaker():
+    policy = UpstreamPolicy(max_retries=0, failure_threshold=1, reset_timeout=0)
+    breaker = open_breaker(policy, "m")
+
+    async def bad_request():
+        raise HTTPException(status_code=400, detail="bad")
+
+    with pytest.raises(HTTPException):
+        asyncio.run(policy.call("m", bad_request, Deadline(30)))
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+
+
+def test_transport_errors_are_retried(monkeypatch):
+    policy = UpstreamPolicy(max_retries=2, failure_threshold=10)
+    monkeypatch.setattr(policy, "backoff", lambda attempt: 0)
+    calls = 0
+
+    async def flaky():
+        nonlocal calls
+        calls += 1
+        if calls < 3:
+            raise httpx.ConnectError("refused")
+        return "ok"
+
+    assert asyncio.run(policy.call("m", flaky, Deadline(30))) == "ok"
+    assert calls == 3
+    assert policy.retries == 2
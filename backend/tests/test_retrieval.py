@@ -0,0 +1,60 @@
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+import retrieval
+from faiss_index import create_index
+from hash_embeddings import HashEmbeddings
+from retrieval import ContextRetriever
+
+TEXTS = [
+    "The rifle was ordered by mail from a Chicago sporting goods store under an alias.",
+    "The rifle was ordered by mail from a Chicago sporting goods store under an alias.",
+    "The motorcade route through the plaza was published in the newspapers.",
+]
+
+
+def make_store(texts: list[str]) -> FAISS:
+    embeddings = HashEmbeddings()
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    ids = [f"doc#{i}" for i in range(len(texts))]
+    docs = {doc_id: Document(page_content=text, metadata={}) for doc_id, text in zip(ids, texts)}
+    return FAISS(embeddings, create_index("flat", vectors), InMemoryDocstore(docs), dict(enumerate(ids)))
+
+
+def test_retrieval_uses_public_embedding_api():
+    store = make_store(TEXTS)
+    retriever = ContextRetriever(store, k=3, batched=False)
+    try:
+        assert retriever._embed("rifle") == store.embeddings.embed_query("rifle")
+        assert retriever.get_context("rifle mail order").count("rifle") == 2
+    finally:
+        retriever.close()
+
+
+def test_rerank_failure_only_affects_one_search(monkeypatch):
+    calls = []
+
+    def flaky_enable_reconstruct(index):
+        calls.append(index)
+        if len(calls) == 1:
+            raise RuntimeError("no direct map")
+
+    monkeypatch.setattr(retrieval, "enable_reconstruct", flaky_enable_reconstruct)
+    retriever = ContextRetriever(make_store(TEXTS), k=3, batched=False, rerank=True)
+    try:
+        # The duplicate chunk survives while reranking is unavailable
+        assert retriever.get_context("rifle mail order").count("rifle") == 2
+        retriever.cache.clear()
+        assert retriever.get_context("rifle mail order").count("rifle") == 1
+        assert retriever.rerank
+
+        # A new store gets its own positions, not the old store's
+        replacement = make_store(TEXTS[2:] + TEXTS[:1])
+        retriever.set_vectorstore(replacement)
+        assert retriever.get_context("rifle mail order").count("rifle") == 1
+        assert retriever._positions[0] is replacement
+        assert len(calls) == 3
+    finally:
+        retriever.close()
@@ -0,0 +1,69 @@
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import update
+
+from conftest import GLOBAL_A, GLOBAL_B, PERSONAL_A, add_battle, battle_row, counter, model_row, run
+from database import engine, models
+from main import K_FACTOR, VoteConflict, apply_vote
+
+pytestmark = pytest.mark.usefixtures("arena_db")
+
+
+def test_vote_updates_elo_counters_and_battle():
+    battle_id = add_battle()
+    run(apply_vote(battle_id, "model2", GLOBAL_B))
+
+    winner, loser = model_row(GLOBAL_B), model_row(GLOBAL_A)
+    assert winner.elo == pytest.approx(1500 + K_FACTOR / 2)
+    assert loser.elo == pytest.approx(1500 - K_FACTOR / 2)
+    assert (winner.wins, winner.losses, loser.wins, loser.losses) == (1, 0, 0, 1)
+    assert model_row(PERSONAL_A).elo == 1234.0
+    assert counter() == 1
+
+    battle = battle_row(battle_id)
+    assert (battle.result, battle.winner_id) == ("model2_win", GLOBAL_B)
+    assert battle.voted_at is not None
+
+
+def test_flipped_vote_credits_the_named_model():
+    # The client showed B on the left, so its "model1" is the battle's model2
+    battle_id = add_battle()
+    run(apply_vote(battle_id, "model1", GLOBAL_B))
+    assert model_row(GLOBAL_B).wins == 1
+    assert model_row(GLOBAL_A).losses == 1
+    assert battle_row(battle_id).winner_id == GLOBAL_B
+
+
+def test_vote_uses_current_ratings():
+    with engine.begin() as conn:
+        conn.execute(update(models).where(models.c.id == GLOBAL_A).values(elo=1700.0))
+    run(apply_vote(add_battle(), "model1", GLOBAL_A))
+    expected = 1.0 / (1.0 + 10 ** ((1500 - 1700) / 400))
+    assert model_row(GLOBAL_A).elo == pytest.approx(1700 + K_FACTOR * (1 - expected))
+    assert model_row(GLOBAL_B).elo == pytest.approx(1500 - K_FACTOR * (1 - expected))
+
+
+def test_draw_and_invalid_leave_elo_alone():
+    run(apply_vote(add_battle(), "draw"))
+    run(apply_vote(add_battle(), "invalid"))
+    a = model_row(GLOBAL_A)
+    assert (a.elo, a.draws, a.invalid) == (1500.0, 1, 1)
+    assert counter() == 2
+
+
+def test_second_vote_conflicts():
+    battle_id = add_battle()
+    run(apply_vote(battle_id, "model1", GLOBAL_A))
+    with pytest.raises(VoteConflict):
+        run(apply_vote(battle_id, "model2", GLOBAL_B))
+    assert model_row(GLOBAL_B).wins == 0
+    assert counter() == 1
+
+
+def test_vote_errors():
+    with pytest.raises(HTTPException) as e:
+        run(apply_vote(999, "draw"))
+    assert e.value.status_code == 404
+    with pytest.raises(HTTPException) as e:
+        run(apply_vote(add_battle(), "model1", PERSONAL_A))
+    assert e.value.status_code == 400
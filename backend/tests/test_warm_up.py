@@ -0,0 +1,27 @@
+import asyncio
+
+import main
+from conftest import run
+
+
+def test_database_warm_up_retries_after_an_error(monkeypatch):
+    attempts = []
+
+    async def prepare_database_once():
+        attempts.append(main.startup_state["database"])
+        if len(attempts) == 1:
+            raise RuntimeError("connection reset")
+        return True
+
+    async def no_load():
+        pass
+
+    real_sleep = asyncio.sleep
+    monkeypatch.setattr(main, "prepare_database_once", prepare_database_once)
+    monkeypatch.setattr(main.model_registry, "load", no_load)
+    monkeypatch.setattr(main.asyncio, "sleep", lambda delay: real_sleep(0))
+    monkeypatch.setitem(main.startup_state, "database", "pending")
+
+    run(main.warm_up_database())
+    assert attempts == ["pending", "failed"]
+    assert main.startup_state["database"] == "ready"
@@ -0,0 +1,125 @@
+import asyncio
+from functools import lru_cache
+from typing import Optional
+
+ENCODING_NAME = "cl100k_base"
+
+# Texts longer than this are tokenized on a worker thread instead of the event loop
+OFFLOAD_CHARS = 4096
+
+_encoding = None
+
+
+def get_encoding():
+    # Loaded on first use, the lifespan warms it up in the background
+    global _encoding
+    if _encoding is None:
+        import tiktoken
+        _encoding = tiktoken.get_encoding(ENCODING_NAME)
+    return _encoding
+
+
+@lru_cache(maxsize=4096)
+def _count_cached(text: str) -> int:
+    return len(get_encoding().encode(text))
+
+
+def count_tokens(text: str) -> int:
+    # Short texts (questions, chunks, deltas) repeat a lot, long ones rarely do
+    if len(text) <= OFFLOAD_CHARS:
+        return _count_cached(text)
+    return len(get_encoding().encode(text))
+
+
+def count_cache_stats() -> dict:
+    info = _count_cached.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize}
+
+
+async def acount_tokens(text: str) -> int:
+    if len(text) <= OFFLOAD_CHARS:
+        return count_tokens(text)
+    return await asyncio.to_thread(count_tokens, text)
+
+
+def truncate_to_tokens(text: str, limit: int, suffix: str = "...") -> tuple[str, bool]:
+    """Cuts text to at most limit tokens, backing off to a word boundary near the end."""
+    encoded = get_encoding().encode(text)
+    if len(encoded) <= limit:
+        return text, False
+    # A cut can land inside a multi-byte character, which decodes as a replacement char
+    truncated = get_encoding().decode(encoded[:limit]).rstrip("\ufffd")
+    boundary = truncated.rfind(" ")
+    if boundary > len(truncated) * 0.9:
+        truncated = truncated[:boundary]
+    return truncated + suffix, True
+
+
+async def atruncate_to_tokens(text: str, limit: int, suffix: str = "...") -> tuple[str, bool]:
+    if len(text) <= OFFLOAD_CHARS:
+        return truncate_to_tokens(text, limit, suffix)
+    return await asyncio.to_thread(truncate_to_tokens, text, limit, suffix)
+
+
+def chunk_tokens(doc) -> int:
+    # Counted at index build time, older stores get it filled in on first use
+    tokens = doc.metadata.get("tokens")
+    if tokens is None:
+        tokens = doc.metadata["tokens"] = count_tokens(doc.page_content)
+    return tokens
+
+
+def pack_context(chunks: list[tuple[str, int]], budget: int, max_chunks: Optional[int] = None, separator: str = "\n") -> str:
+    """Fills budget tokens with the best-ranked chunks that fit.
+
+    chunks are (text, token count) in rank order. A chunk too big for what is left is
+    skipped in favour of the next one that fits, except the top chunk, which is cut
+    down rather than dropped so there is always some context when any was found.
+    """
+    separator_tokens = count_tokens(separator)
+    picked = []
+    used = 0
+    for text, tokens in chunks:
+        if max_chunks is not None and len(picked) >= max_chunks:
+            break
+        cost = tokens + (separator_tokens if picked else 0)
+        if used + cost <= budget:
+            picked.append(text)
+            used += cost
+        elif not picked:
+            text, _ = truncate_to_tokens(text, budget, suffix="")
+            picked.append(text)
+            used = budget
+    return separator.join(picked)
+
+
+class TokenBudget:
+    """Tracks streamed text against a token budget without re-encoding it on every delta.
+
+    Deltas are counted on their own, which can only overestimate the total, so the
+    full text is only encoded exactly once that estimate crosses the limit.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.text = ""
+        self.tokens = 0
+        self.exhausted = False
+
+    def add(self, delta: str) -> str:
+        self.tokens += count_tokens(delta)
+        if self.tokens <= self.limit:
+            self.text += delta
+            return delta
+
+        encoded = get_encoding().encode(self.text + delta)
+        if len(encoded) <= self.limit:
+            self.tokens = len(encoded)
+            self.text += delta
+            return delta
+
+        truncated = get_encoding().decode(encoded[:self.limit])
+        accepted = truncated[len(self.text):] if truncated.startswith(self.text) else ""
+        self.text += accepted
+        self.exhausted = True
+        return accepted
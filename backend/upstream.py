@@ -0,0 +1,112 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import httpx
+
+from metrics import UPSTREAM_FIRST_BYTE_SECONDS, UPSTREAM_QUEUE_SECONDS, UPSTREAM_SECONDS, record
+
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+
+
+class UpstreamClient:
+    """App-scoped, pooled HTTP/2 client for OpenRouter completions.
+
+    One client is shared by every battle so connections and TLS sessions are reused,
+    and each model_id gets its own semaphore so a burst on one model queues behind
+    its own limit instead of taking every connection in the pool.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str],
+        url: str = OPENROUTER_URL,
+        http2: bool = True,
+        max_connections: int = 64,
+        max_keepalive_connections: int = 32,
+        keepalive_expiry: float = 60.0,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 120.0,
+        per_model_concurrency: int = 8,
+    ):
+        self.url = url
+        self.per_model_concurrency = per_model_concurrency
+        # Built once instead of on every request
+        self.headers = {
+            "Authorization": f"Bearer {api_key}",
+            "HTTP-Referer": "https://github.com/OpenRouterStudio/openrouter-py",
+            "X-Title": "JFK Battle Arena",
+            "Content-Type": "application/json"
+        }
+        self.client = httpx.AsyncClient(
+            http2=http2,
+            headers=self.headers,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        )
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+
+    def semaphore(self, model_id: str) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(model_id)
+        if semaphore is None:
+            semaphore = self._semaphores[model_id] = asyncio.Semaphore(self.per_model_concurrency)
+        return semaphore
+
+    def in_flight(self) -> dict[str, int]:
+        return {
+            model_id: self.per_model_concurrency - semaphore._value
+            for model_id, semaphore in self._semaphores.items()
+        }
+
+    @asynccontextmanager
+    async def _slot(self, model_id: str):
+        queued = time.perf_counter()
+        async with self.semaphore(model_id):
+            record(UPSTREAM_QUEUE_SECONDS, queued, model_id, span="upstream_queue")
+            yield
+
+    async def post_completion(self, model_id: str, data: dict) -> httpx.Response:
+        async with self._slot(model_id):
+            started = time.perf_counter()
+            status = "error"
+            try:
+                # Sent as a stream so headers and body can be timed separately
+                response = await self.client.send(self.client.build_request("POST", self.url, json=data), stream=True)
+                record(UPSTREAM_FIRST_BYTE_SECONDS, started, model_id, span="upstream_first_byte")
+                try:
+                    await response.aread()
+                finally:
+                    await response.aclose()
+                status = str(response.status_code)
+                return response
+            except asyncio.CancelledError:
+                # Hedged or deadline-cancelled calls, kept apart from real failures
+                status = "cancelled"
+                raise
+            finally:
+                record(UPSTREAM_SECONDS, started, model_id, status, span="upstream")
+
+    @asynccontextmanager
+    async def stream_completion(self, model_id: str, data: dict):
+        async with self._slot(model_id):
+            started = time.perf_counter()
+            status = "error"
+            try:
+                async with self.client.stream("POST", self.url, json=data) as response:
+                    record(UPSTREAM_FIRST_BYTE_SECONDS, started, model_id, span="upstream_first_byte")
+                    status = str(response.status_code)
+                    yield response
+            except asyncio.CancelledError:
+                status = "cancelled"
+                raise
+            finally:
+                # Covers the whole stream, up to the caller hanging up
+                record(UPSTREAM_SECONDS, started, model_id, status, span="upstream")
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
@@ -5,6 +5,7 @@ import * as battlesRelations from './relations/battels-relations'
 import * as modelsRelations from './relations/models-relations'
 import * as authSchema from './schema/auth'
 import * as battlesSchema from './schema/battles'
+import * as countersSchema from './schema/counters'
 import * as modelsSchema from './schema/models'
 
 neonConfig.webSocketConstructor = ws
@@ -28,6 +29,7 @@ const schema = {
   ...authSchema,
   ...modelsSchema,
   ...battlesSchema,
+  ...countersSchema,
 
   ...modelsRelations,
   ...battlesRelations,
@@ -0,0 +1,24 @@
+CREATE TABLE "battle_texts" (
+	"id" serial PRIMARY KEY NOT NULL,
+	"hash" varchar(64) NOT NULL,
+	"codec" varchar(8) NOT NULL,
+	"size" integer NOT NULL,
+	"data" "bytea" NOT NULL,
+	CONSTRAINT "battle_texts_hash_key" UNIQUE("hash")
+);
+--> statement-breakpoint
+CREATE TABLE "change_counters" (
+	"name" varchar PRIMARY KEY NOT NULL,
+	"value" bigint DEFAULT 0 NOT NULL
+);
+--> statement-breakpoint
+ALTER TABLE "battles" ADD COLUMN "question_text_id" integer;--> statement-breakpoint
+ALTER TABLE "battles" ADD COLUMN "response1_text_id" integer;--> statement-breakpoint
+ALTER TABLE "battles" ADD COLUMN "response2_text_id" integer;--> statement-breakpoint
+ALTER TABLE "battles" ADD CONSTRAINT "battles_question_text_id_fkey" FOREIGN KEY ("question_text_id") REFERENCES "public"."battle_texts"("id") ON DELETE no action ON UPDATE no action;--> statement-breakpoint
+ALTER TABLE "battles" ADD CONSTRAINT "battles_response1_text_id_fkey" FOREIGN KEY ("response1_text_id") REFERENCES "public"."battle_texts"("id") ON DELETE no action ON UPDATE no action;--> statement-breakpoint
+ALTER TABLE "battles" ADD CONSTRAINT "battles_response2_text_id_fkey" FOREIGN KEY ("response2_text_id") REFERENCES "public"."battle_texts"("id") ON DELETE no action ON UPDATE no action;--> statement-breakpoint
+CREATE INDEX "ix_battles_user_id_created_at" ON "battles" USING btree ("user_id","created_at");--> statement-breakpoint
+CREATE INDEX "ix_battles_result" ON "battles" USING btree ("result");--> statement-breakpoint
+CREATE INDEX "ix_battles_model_pair" ON "battles" USING btree ("model1_id","model2_id");--> statement-breakpoint
+INSERT INTO "change_counters" ("name", "value") VALUES ('leaderboard', 0) ON CONFLICT DO NOTHING;
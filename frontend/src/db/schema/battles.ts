@@ -1,7 +1,24 @@
-import { foreignKey, integer, pgTable, serial, timestamp, varchar } from 'drizzle-orm/pg-core'
+import { customType, foreignKey, index, integer, pgTable, serial, timestamp, unique, varchar } from 'drizzle-orm/pg-core'
 import { user } from './auth'
 import { models } from './models'
 
+const bytea = customType<{ data: Buffer }>({
+  dataType() {
+    return 'bytea'
+  },
+})
+
+// Question and response text, compressed and stored once however many battles share it
+export const battleTexts = pgTable('battle_texts', {
+  id: serial().primaryKey().notNull(),
+  hash: varchar({ length: 64 }).notNull(),
+  codec: varchar({ length: 8 }).notNull(),
+  size: integer().notNull(),
+  data: bytea().notNull(),
+}, table => [
+  unique('battle_texts_hash_key').on(table.hash),
+])
+
 export const battles = pgTable('battles', {
   id: serial().primaryKey().notNull(),
   model1Id: integer('model1_id'),
@@ -14,6 +31,9 @@ export const battles = pgTable('battles', {
   result: varchar(),
   createdAt: timestamp('created_at', { mode: 'string' }),
   votedAt: timestamp('voted_at', { mode: 'string' }),
+  questionTextId: integer('question_text_id'),
+  response1TextId: integer('response1_text_id'),
+  response2TextId: integer('response2_text_id'),
 }, table => [
   foreignKey({
     columns: [table.userId],
@@ -35,4 +55,22 @@ export const battles = pgTable('battles', {
     foreignColumns: [models.id],
     name: 'battles_winner_id_fkey',
   }).onDelete('cascade'),
+  foreignKey({
+    columns: [table.questionTextId],
+    foreignColumns: [battleTexts.id],
+    name: 'battles_question_text_id_fkey',
+  }),
+  foreignKey({
+    columns: [table.response1TextId],
+    foreignColumns: [battleTexts.id],
+    name: 'battles_response1_text_id_fkey',
+  }),
+  foreignKey({
+    columns: [table.response2TextId],
+    foreignColumns: [battleTexts.id],
+    name: 'battles_response2_text_id_fkey',
+  }),
+  index('ix_battles_user_id_created_at').on(table.userId, table.createdAt),
+  index('ix_battles_result').on(table.result),
+  index('ix_battles_model_pair').on(table.model1Id, table.model2Id),
 ])
@@ -0,0 +1,7 @@
+import { bigint, pgTable, varchar } from 'drizzle-orm/pg-core'
+
+// Monotonic counters bumped by writers so readers can tell their cached data is stale
+export const changeCounters = pgTable('change_counters', {
+  name: varchar().primaryKey().notNull(),
+  value: bigint({ mode: 'number' }).notNull().default(0),
+})
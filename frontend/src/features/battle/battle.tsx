@@ -117,7 +117,7 @@ export function Battle() {
         />
 
         <VotingSection
-          responses={responses}
+          responses={battleId ? responses : null}
           voted={voted}
           isVoting={isPending}
           onVote={handleVote}
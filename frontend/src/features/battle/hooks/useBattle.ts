@@ -1,10 +1,15 @@
-import type { BattleResponse, SelectedModels } from '../types'
+import type { BattleResponse, BattleStreamEvent, SelectedModels } from '../types'
 import { MODELS } from '@/constants'
+import { useSession } from '@/features/auth/use-session'
 import { useState } from 'react'
 import { toast } from 'sonner'
-import useSWRMutation from 'swr/mutation'
 
-async function sendBattleRequest(url: string, { arg }: { arg: { model1: string, model2: string, question: string } }) {
+// Reads the server-sent events of /battle/stream and hands each one to onEvent
+async function streamBattleRequest(
+  url: string,
+  arg: { model1: string, model2: string, question: string, user_id?: string },
+  onEvent: (event: BattleStreamEvent) => void,
+) {
   const response = await fetch(url, {
     method: 'POST',
     headers: {
@@ -13,7 +18,7 @@ async function sendBattleRequest(url: string, { arg }: { arg: { model1: string,
     body: JSON.stringify(arg),
   })
 
-  if (!response.ok) {
+  if (!response.ok || !response.body) {
     const errorText = await response.text()
     console.error('Response error:', {
       status: response.status,
@@ -23,10 +28,36 @@ async function sendBattleRequest(url: string, { arg }: { arg: { model1: string,
     throw new Error(`Failed to fetch responses: ${response.status} ${response.statusText}`)
   }
 
-  return response.json()
+  const reader = response.body.pipeThrough(new TextDecoderStream()).getReader()
+  let buffer = ''
+  while (true) {
+    const { value, done } = await reader.read()
+    if (done)
+      break
+    buffer += value
+
+    let boundary = buffer.indexOf('\n\n')
+    while (boundary !== -1) {
+      const message = buffer.slice(0, boundary)
+      buffer = buffer.slice(boundary + 2)
+      boundary = buffer.indexOf('\n\n')
+
+      let event = ''
+      let data = ''
+      for (const line of message.split('\n')) {
+        if (line.startsWith('event:'))
+          event = line.slice(6).trim()
+        else if (line.startsWith('data:'))
+          data += line.slice(5).trim()
+      }
+      if (event && data)
+        onEvent({ event, data: JSON.parse(data) } as BattleStreamEvent)
+    }
+  }
 }
 
 export function useBattle() {
+  const { data: session } = useSession()
   const [question, setQuestion] = useState('')
   const [responses, setResponses] = useState<BattleResponse | null>(null)
   const [isFlipped, setIsFlipped] = useState(false)
@@ -36,8 +67,7 @@ export function useBattle() {
     model2: null,
   })
   const [error, setError] = useState<string | null>(null)
-
-  const { trigger, isMutating: loading } = useSWRMutation('/api/proxy/battle', sendBattleRequest)
+  const [loading, setLoading] = useState(false)
 
   const selectRandomModels = () => {
     if (MODELS.length < 2) {
@@ -71,15 +101,29 @@ export function useBattle() {
 
     try {
       setError(null)
-      const data = await trigger({
+      setLoading(true)
+      setResponses({ response1: '', response2: '', battle_id: 0 })
+      setIsFlipped(Math.random() > 0.5)
+
+      await streamBattleRequest('/api/proxy/battle/stream', {
         model1: selected.model1.id,
         model2: selected.model2.id,
         question: questionText,
+        // Keys the per-user rate limit, anonymous sessions have an id too
+        user_id: session?.user.id,
+      }, (message) => {
+        if (message.event === 'token') {
+          const key = message.data.side === 'model1' ? 'response1' : 'response2'
+          setResponses(prev => prev && { ...prev, [key]: prev[key] + message.data.text })
+        }
+        else if (message.event === 'battle') {
+          setResponses(prev => prev && { ...prev, battle_id: message.data.battle_id })
+          setBattleId(message.data.battle_id)
+        }
+        else if (message.event === 'error') {
+          throw new Error(message.data.detail)
+        }
       })
-
-      setResponses(data)
-      setBattleId(data.battle_id)
-      setIsFlipped(Math.random() > 0.5)
     }
     catch (error) {
       const message = error instanceof Error ? error.message : 'Failed to get responses'
@@ -87,6 +131,9 @@ export function useBattle() {
       toast.error(message)
       setError(message)
     }
+    finally {
+      setLoading(false)
+    }
   }
 
   return {
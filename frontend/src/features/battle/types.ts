@@ -9,6 +9,12 @@ export interface BattleResponse {
   battle_id: number
 }
 
+export type BattleStreamEvent
+  = | { event: 'token', data: { side: 'model1' | 'model2', text: string } }
+    | { event: 'done', data: { side: 'model1' | 'model2' } }
+    | { event: 'battle', data: { battle_id: number } }
+    | { event: 'error', data: { side: 'model1' | 'model2' | null, detail: string } }
+
 export interface SelectedModels {
   model1: Model | null
   model2: Model | null
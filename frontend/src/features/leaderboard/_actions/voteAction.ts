@@ -2,9 +2,8 @@
 
 import { authorizedActionClient } from '@/lib/safe-action'
 import { z } from 'zod'
-import { updateOverallLeaderboard } from '../_mutations/updateOverallLeaderboard'
+import { recordVote } from '../_mutations/recordVote'
 import { updatePersonalLeaderboard } from '../_mutations/updatePersonalLeaderboard'
-import { updateBattleRecord } from '../_mutations/utils'
 
 export const voteAction = authorizedActionClient.schema(z.object({
   result: z.string(),
@@ -15,11 +14,9 @@ export const voteAction = authorizedActionClient.schema(z.object({
   const { result, model1, model2, battleId } = parsedInput
   const userId = ctx.session.user.id
 
-  await Promise.all([
-    updateBattleRecord({ battleId, userId, result, model1Id: model1, model2Id: model2 }),
-    updateOverallLeaderboard({ result, model1, model2 }),
-    updatePersonalLeaderboard({ result, model1, model2, userId }),
-  ])
+  // First, so a refused vote (unknown or already voted battle) doesn't count on the personal board
+  await recordVote({ battleId, result, model1, model2 })
+  await updatePersonalLeaderboard({ result, model1, model2, userId })
 
   return { success: true }
 })
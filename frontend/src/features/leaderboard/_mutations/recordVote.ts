@@ -0,0 +1,33 @@
+import { headers } from 'next/headers'
+
+// eslint-disable-next-line node/prefer-global/process
+const API_URL = process.env.NEXT_PUBLIC_API_URL || ''
+
+// The backend owns the battle row and the overall ratings. It waits for a battle that is
+// still queued in its writer, claims the row only once and updates both models with it.
+// The voter is identified by the session cookie, forwarded from the incoming request.
+export async function recordVote({ battleId, result, model1, model2 }: {
+  battleId: number
+  result: string
+  model1: string
+  model2: string
+}) {
+  const response = await fetch(new URL('vote', API_URL), {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      'Cookie': (await headers()).get('cookie') ?? '',
+    },
+    body: JSON.stringify({
+      result,
+      model1,
+      model2,
+      battle_id: battleId,
+    }),
+  })
+
+  if (!response.ok) {
+    const body = await response.json().catch(() => null)
+    throw new Error(body?.detail || 'Failed to record vote')
+  }
+}
@@ -1,8 +1,6 @@
 import type { TransactionType } from '@/db'
 import type { Model } from '../types'
 import { DEFAULT_ELO } from '@/constants'
-import { db } from '@/db'
-import { battles } from '@/db/schema/battles'
 import { models } from '@/db/schema/models'
 import { and, eq, isNull, sql } from 'drizzle-orm'
 
@@ -44,51 +42,6 @@ export function calculateEloChange({ model1, model2, model1Won }: {
   }
 }
 
-// Update battle record
-export async function updateBattleRecord({ battleId, userId, result, model1Id, model2Id }: {
-  battleId: number
-  userId: string
-  result: string
-  model1Id: string
-  model2Id: string
-}) {
-  let battleResult = null
-  let winnerId = null
-
-  if (result === 'model1') {
-    winnerId = model1Id
-    battleResult = 'model1_win'
-  }
-  else if (result === 'model2') {
-    winnerId = model2Id
-    battleResult = 'model2_win'
-  }
-  else if (result === 'draw') {
-    battleResult = 'draw'
-  }
-  else {
-    battleResult = 'invalid'
-  }
-
-  const winnerModel = await db.query.models.findFirst({
-    where: (models, { eq, and, isNull }) => and(
-      eq(models.modelId, winnerId || ''),
-      isNull(models.userId),
-    ),
-  })
-
-  await db.update(battles)
-    .set({
-      userId,
-      winnerId: winnerModel?.id,
-      result: battleResult,
-      votedAt: new Date().toISOString(),
-    })
-    .where(eq(battles.id, battleId))
-
-  return battleResult
-}
-
 // Update model statistics based on battle result
 export async function updateModelStats({ tx, winner, model1Id, model2Id, userId }: {
   tx: TransactionType